@@ -0,0 +1,359 @@
+"""OCR pipeline throughput and latency, at several levels of concurrency.
+
+Runs the bundled fixtures (phototest.pdf, sample.pdf, static/uploads/test_uploads/*) and
+generated pages of text through _process_single_ocr_task, the Flask /api/ocr endpoint in process,
+or a running server, and reports pages/sec, p50/p95/p99 latency per file and peak RSS for each
+worker count. Needs Tesseract and poppler, like the service itself. The result cache is disabled
+so every file is really OCR'd, fixtures that aren't real images or PDFs (the test suite's
+placeholders) are skipped, and artifacts go to a temporary UPLOAD_FOLDER.
+
+    python benchmarks/bench_pipeline.py --workers 1,2,4 --json after.json
+    python benchmarks/bench_pipeline.py --mode http --json after.json --compare before.json
+    python benchmarks/bench_pipeline.py --server http://127.0.0.1:3001 --workers 4,8
+"""
+import argparse
+import glob
+import io
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+import ocr  # noqa: E402
+
+FIXTURES = ["phototest.pdf", "sample.pdf", "static/uploads/test_uploads/*"]
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while seven wizards box jovial quartz nymphs "
+    "and pack my box with five dozen liquor jugs then sphinx of black quartz judge my vow"
+).split()
+
+
+def page_font(size: int):
+    # A scalable font at size pixels. Pillow < 10.1 can't size its built-in font, so try
+    # common TrueType fonts first and fall back to the small bitmap default (still text,
+    # just less like a real page).
+    for name in ("DejaVuSans.ttf", "LiberationSans-Regular.ttf", "Arial.ttf", "Helvetica.ttc"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def synthetic_pages(directory: str, count: int, size=(1654, 2339)) -> list:
+    # Text pages at roughly A4 and 200 dpi: PNGs, and one PDF of all of them without a text layer
+    font = page_font(28)
+    pages = []
+    for page_num in range(count):
+        page = Image.new("L", size, 255)
+        draw = ImageDraw.Draw(page)
+        for line_num in range(60):
+            words = [WORDS[(page_num * 7 + line_num * 3 + i) % len(WORDS)] for i in range(10)]
+            draw.text((120, 120 + line_num * 35), " ".join(words), fill=0, font=font)
+        pages.append(page)
+    paths = []
+    for page_num, page in enumerate(pages, start=1):
+        path = os.path.join(directory, f"synthetic_{page_num}.png")
+        page.save(path)
+        paths.append(path)
+    if pages:
+        path = os.path.join(directory, "synthetic.pdf")
+        pages[0].save(path, save_all=True, append_images=pages[1:], resolution=200)
+        paths.append(path)
+    return paths
+
+
+def is_document(path: str) -> bool:
+    # Whether the file really is a PDF or an image, not a placeholder with the right extension
+    try:
+        if path.lower().endswith(".pdf"):
+            with open(path, "rb") as f:
+                return f.read(5) == b"%PDF-"
+        with Image.open(path) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+
+def fixture_paths() -> tuple:
+    # (usable fixtures, skipped ones)
+    supported = set(ocr.app.config["SUPPORTED_FORMATS"])
+    paths, skipped = [], []
+    for pattern in FIXTURES:
+        for path in sorted(glob.glob(os.path.join(REPO, pattern))):
+            if os.path.isfile(path) and os.path.splitext(path)[1].lstrip(".").lower() in supported:
+                (paths if is_document(path) else skipped).append(path)
+    return paths, skipped
+
+
+class RSSSampler:
+    """Peak resident set size of this process while a run is going (ru_maxrss only ever grows)."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    @staticmethod
+    def current_mb() -> float:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def _sample(self):
+        while not self.stop.is_set():
+            self.peak = max(self.peak, self.current_mb())
+            self.stop.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.current_mb())
+
+
+def make_runner(mode: str, language: str, image_output: str, server: str):
+    # Returns run(path) -> (pages, error) for one file
+    options = {"language": language, "image_output": image_output}
+    if mode == "task":
+
+        def run(path):
+            result = ocr._process_single_ocr_task({"filepath": path, **options})
+            return len(result["ocr_data"] or []), result["error"]
+
+        return run
+
+    if mode == "http":
+        client = ocr.app.test_client()
+
+        def run(path):
+            with open(path, "rb") as f:
+                data = {"file": (io.BytesIO(f.read()), os.path.basename(path)), **options}
+            result = client.post("/api/ocr", data=data).get_json()
+            return len(result.get("ocr_data") or []), result.get("error")
+
+        return run
+
+    session = ocr.requests.Session()
+
+    def run(path):
+        with open(path, "rb") as f:
+            response = session.post(
+                f"{server}/api/ocr", files={"file": (os.path.basename(path), f)}, data=options
+            )
+        result = response.json()
+        return len(result.get("ocr_data") or []), result.get("error")
+
+    return run
+
+
+def percentile(values: list, percent: float) -> float:
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def bench(run, paths: list, workers: int, repeat: int) -> dict:
+    latencies, pages, errors = [], 0, []
+
+    def timed(path):
+        started = time.perf_counter()
+        file_pages, error = run(path)
+        return time.perf_counter() - started, file_pages, error
+
+    work = paths * repeat
+    with RSSSampler() as rss, ThreadPoolExecutor(max_workers=workers) as executor:
+        started = time.perf_counter()
+        for seconds, file_pages, error in executor.map(timed, work):
+            latencies.append(seconds * 1000)
+            pages += file_pages
+            if error:
+                errors.append(error)
+        wall = time.perf_counter() - started
+    return {
+        "workers": workers,
+        "files": len(work),
+        "pages": pages,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_seconds": round(wall, 3),
+        "pages_per_second": round(pages / wall, 3) if wall else None,
+        "files_per_second": round(len(work) / wall, 3) if wall else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies), 2),
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+        },
+        "peak_rss_mb": round(rss.peak, 1),
+        # Largest single child so far (Tesseract, poppler); only ever grows during the process
+        "peak_child_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    # Prints the change per worker count; True when throughput fell or p95 rose by more
+    # than threshold
+    regressed = False
+    baseline_runs = {run["workers"]: run for run in baseline["runs"]}
+    print(f"\ncompared with {baseline['meta'].get('started', 'baseline')}:")
+    for run in current["runs"]:
+        before = baseline_runs.get(run["workers"])
+        if before is None or not before["pages_per_second"] or not run["pages_per_second"]:
+            continue
+        throughput = run["pages_per_second"] / before["pages_per_second"] - 1
+        p95 = run["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1
+        worse = throughput < -threshold or p95 > threshold
+        regressed = regressed or worse
+        print(
+            f"  workers {run['workers']:>3}: pages/s {throughput:+7.1%}   p95 {p95:+7.1%}"
+            + ("   REGRESSION" if worse else "")
+        )
+    return regressed
+
+
+def run_benchmark(args, parser, directory: str) -> dict:
+    paths, skipped = ([], []) if args.no_fixtures else fixture_paths()
+    for path in skipped:
+        print(f"skipping {os.path.relpath(path, REPO)}: not a real image or PDF", file=sys.stderr)
+    paths += args.input
+    paths += synthetic_pages(directory, args.synthetic)
+    if not paths:
+        parser.error("no inputs")
+    run = make_runner(
+        "server" if args.server else args.mode, args.language, args.image_output, args.server
+    )
+    run(paths[0])  # warm up: imports, Tesseract and language probing, thread pools
+
+    results = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "mode": "server" if args.server else args.mode,
+            "inputs": [
+                os.path.relpath(path, REPO) if path.startswith(REPO) else os.path.basename(path)
+                for path in paths
+            ],
+            "skipped": [os.path.relpath(path, REPO) for path in skipped],
+            "repeat": args.repeat,
+            "language": args.language,
+            "image_output": args.image_output,
+            "cache": args.cache,
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "tesseract_version": ocr.get_tesseract_version_string() if not args.server else None,
+            "config": {
+                key: ocr.app.config[key]
+                for key in (
+                    "OCR_ENGINE",
+                    "OCR_PAGE_WORKERS",
+                    "PDF_RENDER_DPI",
+                    "PDF_RENDER_CHUNK_SIZE",
+                    "PDF_USE_TEXT_LAYER",
+                )
+            },
+        },
+        "runs": [],
+    }
+    for workers in (int(value) for value in args.workers.split(",")):
+        result = bench(run, paths, workers, args.repeat)
+        results["runs"].append(result)
+        latency = result["latency_ms"]
+        errors = (
+            f"   {result['errors']} errors ({result['first_error']})" if result["errors"] else ""
+        )
+        print(
+            f"workers {workers:>3}: {result['pages_per_second']:>8} pages/s"
+            f"   p50 {latency['p50']:>9}ms   p95 {latency['p95']:>9}ms   p99 {latency['p99']:>9}ms"
+            f"   peak RSS {result['peak_rss_mb']}MB{errors}"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--mode",
+        choices=("task", "http"),
+        default="task",
+        help="call _process_single_ocr_task, or POST to /api/ocr through the Flask test client",
+    )
+    parser.add_argument("--server", help="POST to /api/ocr of a running server at this URL instead")
+    parser.add_argument(
+        "--workers", default="1,2,4", help="comma separated concurrency levels (default 1,2,4)"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=2, help="times each input is processed per run"
+    )
+    parser.add_argument(
+        "--synthetic", type=int, default=4, help="generated text pages (default 4, 0 for none)"
+    )
+    parser.add_argument(
+        "--no-fixtures", action="store_true", help="only use the generated pages and --input files"
+    )
+    parser.add_argument(
+        "--input", action="append", default=[], help="extra input file (repeatable)"
+    )
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--image-output", default="base64", choices=ocr.IMAGE_OUTPUT_MODES)
+    parser.add_argument("--cache", action="store_true", help="keep the OCR result cache enabled")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change counted as a regression by --compare (default 0.1)",
+    )
+    args = parser.parse_args()
+
+    if not args.cache:
+        ocr.app.config["OCR_CACHE_SIZE"] = 0
+        ocr.app.config["OCR_CACHE_DIR"] = ""
+
+    upload_folder = ocr.app.config["UPLOAD_FOLDER"]
+    with tempfile.TemporaryDirectory() as directory:
+        # PDF previews and image copies of the run are stored here, not in the real
+        # upload folder
+        ocr.app.config["UPLOAD_FOLDER"] = os.path.join(directory, "artifacts")
+        os.makedirs(ocr.app.config["UPLOAD_FOLDER"])
+        try:
+            results = run_benchmark(args, parser, directory)
+        finally:
+            ocr.app.config["UPLOAD_FOLDER"] = upload_folder
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            sys.exit(1 if compare(results, json.load(f), args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
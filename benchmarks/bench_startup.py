@@ -0,0 +1,110 @@
+"""Worker boot cost: time to import the app and the memory a worker holds before its first request.
+
+Each run starts a fresh interpreter (as a gunicorn worker without preload_app would), imports
+ocr, then loads the lazily imported dependencies as the first OCR request does.
+
+    python benchmarks/bench_startup.py --runs 10 --json startup.json
+    python benchmarks/bench_startup.py --max-import-ms 400 --max-rss-mb 80   # fail on regressions
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+
+def rss_mb():
+    # Current resident set size (Linux); falls back to the peak where /proc isn't available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * __import__("os").sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+base_rss = rss_mb()
+started = time.perf_counter()
+import ocr
+imported = time.perf_counter()
+import_rss = rss_mb()
+import_modules = len(sys.modules)
+ocr.load_heavy_modules()
+loaded = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "import_rss_mb": import_rss,
+    "import_rss_delta_mb": import_rss - base_rss,
+    "heavy_modules_ms": (loaded - imported) * 1000,
+    "loaded_rss_mb": rss_mb(),
+    "modules_after_import": import_modules,
+    "modules_after_load": len(sys.modules),
+}))
+"""
+
+
+def run_once() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=REPO, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples: list) -> dict:
+    return {
+        key: {
+            "median": round(statistics.median(sample[key] for sample in samples), 2),
+            "min": round(min(sample[key] for sample in samples), 2),
+            "max": round(max(sample[key] for sample in samples), 2),
+        }
+        for key in samples[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="write the summary to this file")
+    parser.add_argument(
+        "--max-import-ms", type=float, help="exit 1 if the median import time is above this"
+    )
+    parser.add_argument(
+        "--max-rss-mb", type=float, help="exit 1 if the median RSS after import is above this"
+    )
+    args = parser.parse_args()
+
+    run_once()  # warm the filesystem cache and bytecode
+    summary = summarize([run_once() for _ in range(args.runs)])
+    summary["runs"] = args.runs
+    summary["python"] = sys.version.split()[0]
+
+    for key, stats in summary.items():
+        if isinstance(stats, dict):
+            print(
+                f"{key:24} median {stats['median']:>9.2f}"
+                f"   min {stats['min']:>9.2f}   max {stats['max']:>9.2f}"
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    failed = False
+    if args.max_import_ms is not None and summary["import_ms"]["median"] > args.max_import_ms:
+        print(f"import time {summary['import_ms']['median']}ms is above {args.max_import_ms}ms")
+        failed = True
+    if args.max_rss_mb is not None and summary["import_rss_mb"]["median"] > args.max_rss_mb:
+        print(
+            f"RSS after import {summary['import_rss_mb']['median']}MB is above {args.max_rss_mb}MB"
+        )
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
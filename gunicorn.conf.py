@@ -1,6 +1,70 @@
 import multiprocessing
+import os
+import shutil
+import tempfile
 
 bind = "0.0.0.0:80"
-workers = multiprocessing.cpu_count()
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+# Threads per worker, so long-poll status requests and event streams don't hold a whole worker. They
+# mostly wait; the OCR of synchronous requests runs on SYNC_OCR_WORKERS threads sized to the cores.
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
 accesslog = "/tmp/ocr.access.log"
 wsgi_app = "ocr:app"
+# GUNICORN_PRELOAD=1 imports the app once in the master; forked workers then share its memory
+# copy-on-write and skip the import on boot
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+# Workers share their metrics through METRICS_DIR so /metrics covers all of them; without one
+# configured, use a directory of this run (on tmpfs where there is one), removed again on exit. Set
+# before the app is imported, and kept across config reloads since the environment then has it.
+_OWN_METRICS_DIR = None
+if not os.environ.get("METRICS_DIR"):
+    _OWN_METRICS_DIR = tempfile.mkdtemp(
+        prefix="ocr-metrics-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+    )
+    os.environ["METRICS_DIR"] = _OWN_METRICS_DIR
+
+
+def on_starting(server):
+    # Metrics snapshots of a previous run's workers would otherwise be counted as retired workers
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.startswith("metrics"):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def on_exit(server):
+    if _OWN_METRICS_DIR:
+        shutil.rmtree(_OWN_METRICS_DIR, ignore_errors=True)
+
+
+def when_ready(server):
+    if preload_app:
+        # The heavy dependencies are imported lazily; load them before forking so workers share
+        # them too
+        from ocr import load_heavy_modules
+
+        load_heavy_modules()
+
+
+def post_worker_init(worker):
+    # `kill -HUP <worker pid>` makes the worker re-probe the Tesseract version and installed
+    # languages on its next request. The handler only sets a flag: probing here could interrupt a
+    # thread holding the lock.
+    import signal
+
+    from ocr import (
+        _ensure_job_workers,
+        _ensure_metrics_flusher,
+        configure_process_count,
+        mark_tesseract_info_stale,
+    )
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: mark_tesseract_info_stale())
+    # Every worker runs its own job pools; size them to the worker's share of the cores (see
+    # JOB_WORKERS). worker.cfg has the effective count, including a --workers flag.
+    configure_process_count(worker.cfg.workers)
+    # With a shared JOB_STORE every worker pulls queued jobs, not just the one that accepted them
+    _ensure_job_workers()
+    # Report to /metrics from the start, before the worker has processed a file
+    _ensure_metrics_flusher()
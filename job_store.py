@@ -0,0 +1,605 @@
+import collections
+import contextlib
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+JOB_STATUS = {
+    "PENDING": "pending",
+    "IN_PROGRESS": "in_progress",
+    "COMPLETED": "completed",
+    "FAILED": "failed",
+}
+FINISHED_STATUSES = (JOB_STATUS["COMPLETED"], JOB_STATUS["FAILED"])
+
+
+class JobStore:
+    """Where async OCR jobs, their status and the queue of pending jobs live.
+
+    Job records are plain JSON-serializable dicts. A backend shared between processes
+    (SQLite here, Redis or similar elsewhere) lets any gunicorn worker answer status
+    polls and pick up queued jobs.
+
+    Every update bumps the record's "version", which lets clients wait for a change.
+    """
+
+    POLL_INTERVAL = 0.2
+    # Whether every process sees the same jobs and queue
+    SHARED = False
+
+    def create(self, job: dict, files_payload: list, max_queued: int) -> bool:
+        """Store a new pending job and queue its payload; False when max_queued jobs are waiting."""
+        raise NotImplementedError
+
+    def get(self, job_id: str, include_results: bool = True):
+        """Return a copy of the job record, or None.
+
+        Without include_results, "results" may be left out.
+        """
+        raise NotImplementedError
+
+    def get_results(self, job_id: str, offset: int = 0, limit=None):
+        """Return (number of results, results[offset:offset + limit]) of a job, or None.
+
+        Backends that keep results per file read only the requested ones.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        results = job.get("results") or []
+        return len(results), results[offset : None if limit is None else offset + limit]
+
+    def update(self, job_id: str, **fields):
+        """Merge fields into the job record."""
+        raise NotImplementedError
+
+    def delete(self, job_id: str):
+        raise NotImplementedError
+
+    def wait(self, job_id: str, version: int, timeout: float, include_results: bool = True):
+        """Return the job once its version differs from version, or as it is after timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id, include_results)
+            remaining = deadline - time.monotonic()
+            if job is None or job.get("version", 0) != version or remaining <= 0:
+                return job
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+
+    def wait_any(self, versions: dict, timeout: float) -> list:
+        """Wait up to timeout seconds for any of the {job_id: version} jobs to change or disappear.
+
+        Returns the ids of those that did, empty on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = []
+            for job_id, version in versions.items():
+                job = self.get(job_id, include_results=False)
+                if job is None or job.get("version", 0) != version:
+                    changed.append(job_id)
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+
+    def claim(self, timeout: float):
+        """Take the oldest pending job as (job_id, files_payload), waiting up to timeout seconds."""
+        raise NotImplementedError
+
+    def queue_length(self) -> int:
+        raise NotImplementedError
+
+    def queue_position(self, job_id: str):
+        """1-based position of a pending job in the queue, or None if it isn't queued."""
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    """Jobs in a dict of this process; only the worker that accepted a job can see it.
+
+    Finished jobs are dropped ttl seconds after they finish and, least recently polled
+    first, once more than max_jobs are kept or their results exceed max_result_bytes.
+    With a spill_dir, results over the byte budget are written there gzip-compressed, a
+    file per input file, and read back when the job (or some of its results) is next requested.
+    """
+
+    def __init__(
+        self, jobs=None, ttl=None, max_jobs=None, max_result_bytes=None, spill_dir=None, **kwargs
+    ):
+        # Claim leases (lease, max_attempts) only apply to shared stores: jobs here die with
+        # their process
+        self.jobs = jobs if jobs is not None else {}
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.max_result_bytes = max_result_bytes
+        self.spill_dir = spill_dir
+        # Finished jobs in least recently used order:
+        # job_id -> {finished_at, result_bytes, spill_path, result_count}
+        self.finished = collections.OrderedDict()
+
+    def create(self, job, files_payload, max_queued):
+        with self.cond:
+            to_spill = self._evict()
+            if len(self.queue) >= max_queued:
+                accepted = False
+            else:
+                self.jobs[job["job_id"]] = job
+                self.queue.append((job["job_id"], files_payload))
+                self.cond.notify()
+                accepted = True
+        self._spill(to_spill)
+        return accepted
+
+    def get(self, job_id, include_results=True):
+        with self.cond:
+            job, meta = self._lookup(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            spill_path = meta and meta["spill_path"]
+        if spill_path and include_results:
+            # Read outside the lock; the spilled copy stays on disk rather than back in memory
+            try:
+                job["results"] = [
+                    self._read_spilled(spill_path, index) for index in range(meta["result_count"])
+                ]
+            except (OSError, ValueError):
+                job["results"] = []
+                job["error"] = job.get("error") or "Job results are no longer available"
+        return job
+
+    def get_results(self, job_id, offset=0, limit=None):
+        stop = None if limit is None else offset + limit
+        with self.cond:
+            job, meta = self._lookup(job_id)
+            if job is None:
+                return None
+            if not (meta and meta["spill_path"]):
+                results = job.get("results") or []
+                return len(results), results[offset:stop]
+            spill_path, count = meta["spill_path"], meta["result_count"]
+        results = []
+        for index in range(count)[offset:stop]:
+            try:
+                results.append(self._read_spilled(spill_path, index))
+            except (OSError, ValueError):
+                results.append({"error": "Job results are no longer available"})
+        return count, results
+
+    def update(self, job_id, **fields):
+        finishing = fields.get("status") in FINISHED_STATUSES
+        result_bytes = 0
+        if finishing and self.max_result_bytes:
+            # Sized outside the lock: serializing large results would stall every poll and claim
+            if "results" in fields:
+                results = fields["results"]
+            else:
+                with self.cond:
+                    results = self.jobs.get(job_id, {}).get("results")
+            result_bytes = len(json.dumps(results or []))
+        to_spill = []
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job["version"] = job.get("version", 0) + 1
+            self.cond.notify_all()
+            if finishing and job_id not in self.finished:
+                self.finished[job_id] = {
+                    "finished_at": time.time(),
+                    "result_bytes": result_bytes,
+                    "spill_path": None,
+                    "result_count": 0,
+                }
+                to_spill = self._evict()
+        self._spill(to_spill)
+
+    def delete(self, job_id):
+        with self.cond:
+            self._drop(job_id)
+            self.queue = collections.deque(item for item in self.queue if item[0] != job_id)
+
+    def wait(self, job_id, version, timeout, include_results=True):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                job = self.jobs.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job.get("version", 0) != version or remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+        return self.get(job_id, include_results)
+
+    def wait_any(self, versions, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                changed = [
+                    job_id
+                    for job_id, version in versions.items()
+                    if job_id not in self.jobs or self.jobs[job_id].get("version", 0) != version
+                ]
+                remaining = deadline - time.monotonic()
+                if changed or remaining <= 0:
+                    return changed
+                self.cond.wait(remaining)
+
+    def claim(self, timeout):
+        with self.cond:
+            if not self.queue:
+                self.cond.wait(timeout)
+            if not self.queue:
+                return None
+            return self.queue.popleft()
+
+    def queue_length(self):
+        with self.cond:
+            return len(self.queue)
+
+    def queue_position(self, job_id):
+        with self.cond:
+            for position, (queued_id, _) in enumerate(self.queue, start=1):
+                if queued_id == job_id:
+                    return position
+        return None
+
+    def _lookup(self, job_id):
+        # Called with the lock held: (job, finished meta or None), dropping the job if it expired
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None, None
+        meta = self.finished.get(job_id)
+        if meta is not None:
+            if self._expired(meta, time.time()):
+                self._drop(job_id)
+                return None, None
+            self.finished.move_to_end(job_id)
+        return job, meta
+
+    def _expired(self, meta, now) -> bool:
+        return self.ttl is not None and now - meta["finished_at"] > self.ttl
+
+    def _drop(self, job_id):
+        self.jobs.pop(job_id, None)
+        meta = self.finished.pop(job_id, None)
+        if meta and meta["spill_path"]:
+            shutil.rmtree(meta["spill_path"], ignore_errors=True)
+
+    @staticmethod
+    def _read_spilled(spill_path, index):
+        with gzip.open(os.path.join(spill_path, f"{index}.json.gz"), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _spill(self, to_spill):
+        # Writes results chosen by _evict to disk without the lock, then swaps them out of memory;
+        # a directory per job with a file per result, so a page of results reads only its files
+        for job_id, meta, results in to_spill:
+            path = os.path.join(self.spill_dir, job_id)
+            try:
+                os.makedirs(path, exist_ok=True)
+                for index, result in enumerate(results):
+                    with gzip.open(
+                        os.path.join(path, f"{index}.json.gz"), "wt", encoding="utf-8"
+                    ) as f:
+                        json.dump(result, f)
+            except OSError:
+                # Results stay in memory; _evict chose this job already and won't try it again
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            with self.cond:
+                if self.finished.get(job_id) is meta:
+                    self.jobs[job_id]["results"] = None
+                    meta.update(spill_path=path, result_count=len(results))
+                    continue
+            # Dropped while it was being written
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _evict(self) -> list:
+        # Called with the lock held; returns [(job_id, meta, results)] for _spill to write
+        # once it is released
+        to_spill = []
+        now = time.time()
+        for job_id in [
+            job_id for job_id, meta in self.finished.items() if self._expired(meta, now)
+        ]:
+            self._drop(job_id)
+        while self.max_jobs is not None and len(self.finished) > self.max_jobs:
+            self._drop(next(iter(self.finished)))
+        if not self.max_result_bytes:
+            return to_spill
+        in_memory = sum(meta["result_bytes"] for meta in self.finished.values())
+        for job_id, meta in list(self.finished.items()):
+            if in_memory <= self.max_result_bytes:
+                break
+            if not meta["result_bytes"]:
+                continue
+            in_memory -= meta["result_bytes"]
+            if self.spill_dir:
+                meta["result_bytes"] = 0
+                to_spill.append((job_id, meta, self.jobs[job_id].get("results") or []))
+            else:
+                self._drop(job_id)
+        return to_spill
+
+
+class SQLiteJobStore(JobStore):
+    """Jobs in a SQLite database in WAL mode, shared by every process on the host.
+
+    Put the file on tmpfs (e.g. /dev/shm) to keep it in shared memory. Results are kept
+    in a row per file, apart from the job record, so status polls and result pages only
+    read what they return.
+
+    A claimed job records the claiming process and a heartbeat, renewed by each update.
+    When that process has exited (a crashed or recycled worker) or the heartbeat is older
+    than lease seconds, the next claim puts the job back at the head of the queue, up to
+    max_attempts claims; after that it fails.
+    """
+
+    SHARED = True
+
+    def __init__(self, path: str, ttl=None, max_jobs=None, lease=None, max_attempts=3, **kwargs):
+        # Results live in the database file, not in worker memory, so only the TTL and the
+        # job count cap apply here.
+        self.path = path
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        with self._transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " job_id TEXT UNIQUE NOT NULL,"
+                " status TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " payload TEXT,"
+                " finished_at REAL)"
+            )
+            columns = [column[1] for column in db.execute("PRAGMA table_info(jobs)")]
+            for column, kind in (
+                ("finished_at", "REAL"),
+                ("claimed_by", "INTEGER"),
+                ("heartbeat", "REAL"),
+                ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+            ):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status_seq ON jobs (status, seq)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " job_id TEXT NOT NULL,"
+                " file_index INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " PRIMARY KEY (job_id, file_index))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process; connections must not cross a fork
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connection()
+        # Take the write lock up front so read-modify-write sequences are atomic
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def create(self, job, files_payload, max_queued):
+        with self._transaction() as db:
+            self._evict(db)
+            (queued,) = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_STATUS["PENDING"],)
+            ).fetchone()
+            if queued >= max_queued:
+                return False
+            job = dict(job)
+            results = job.pop("results", None)
+            db.execute(
+                "INSERT INTO jobs (job_id, status, data, payload) VALUES (?, ?, ?, ?)",
+                (job["job_id"], job["status"], json.dumps(job), json.dumps(files_payload)),
+            )
+            self._put_results(db, job["job_id"], results)
+        return True
+
+    def get(self, job_id, include_results=True):
+        db = self._connection()
+        row = db.execute(
+            "SELECT data, finished_at FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        job = json.loads(row[0])
+        if include_results:
+            job["results"] = [
+                json.loads(data)
+                for (data,) in db.execute(
+                    "SELECT data FROM results WHERE job_id = ? ORDER BY file_index", (job_id,)
+                )
+            ]
+        return job
+
+    def get_results(self, job_id, offset=0, limit=None):
+        db = self._connection()
+        row = db.execute("SELECT finished_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or self._expired(row[0]):
+            return None
+        (count,) = db.execute("SELECT COUNT(*) FROM results WHERE job_id = ?", (job_id,)).fetchone()
+        rows = db.execute(
+            "SELECT data FROM results WHERE job_id = ? AND file_index >= ?"
+            " ORDER BY file_index LIMIT ?",
+            (job_id, offset, -1 if limit is None else limit),
+        )
+        return count, [json.loads(data) for (data,) in rows]
+
+    def update(self, job_id, **fields):
+        with self._transaction() as db:
+            row = db.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            job = json.loads(row[0])
+            if "results" in fields:
+                fields = dict(fields)
+                self._put_results(db, job_id, fields.pop("results"))
+            job.update(fields)
+            job["version"] = job.get("version", 0) + 1
+            now = time.time()
+            finished_at = now if job["status"] in FINISHED_STATUSES else None
+            # Every update renews the claim's heartbeat; a finished job no longer needs its payload
+            db.execute(
+                "UPDATE jobs SET status = ?, data = ?, finished_at = COALESCE(finished_at, ?),"
+                " heartbeat = ?, payload = CASE WHEN ? IS NULL THEN payload END WHERE job_id = ?",
+                (job["status"], json.dumps(job), finished_at, now, finished_at, job_id),
+            )
+
+    def delete(self, job_id):
+        with self._transaction() as db:
+            db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            db.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+
+    def _expired(self, finished_at) -> bool:
+        return self.ttl is not None and bool(finished_at) and time.time() - finished_at > self.ttl
+
+    @staticmethod
+    def _put_results(db, job_id, results):
+        db.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+        db.executemany(
+            "INSERT INTO results (job_id, file_index, data) VALUES (?, ?, ?)",
+            ((job_id, index, json.dumps(result)) for index, result in enumerate(results or [])),
+        )
+
+    def claim(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._transaction() as db:
+                self._reclaim(db)
+                row = db.execute(
+                    "SELECT job_id, payload FROM jobs WHERE status = ? ORDER BY seq LIMIT 1",
+                    (JOB_STATUS["PENDING"],),
+                ).fetchone()
+                if row is not None:
+                    # Marking it in progress in the same transaction keeps other workers off it; the
+                    # payload stays until the job finishes, in case it has to be claimed again
+                    db.execute(
+                        "UPDATE jobs SET status = ?, claimed_by = ?, heartbeat = ?,"
+                        " attempts = attempts + 1, data = json_set(data, '$.status', ?,"
+                        " '$.version', COALESCE(json_extract(data, '$.version'), 0) + 1)"
+                        " WHERE job_id = ?",
+                        (
+                            JOB_STATUS["IN_PROGRESS"],
+                            os.getpid(),
+                            time.time(),
+                            JOB_STATUS["IN_PROGRESS"],
+                            row[0],
+                        ),
+                    )
+                    return row[0], json.loads(row[1])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.POLL_INTERVAL)
+
+    def _reclaim(self, db):
+        # Requeues (or fails) in-progress jobs whose claimant has exited or stopped
+        # renewing its lease
+        now = time.time()
+        abandoned = [
+            (job_id, attempts)
+            for job_id, claimed_by, heartbeat, attempts in db.execute(
+                "SELECT job_id, claimed_by, heartbeat, attempts FROM jobs WHERE status = ?",
+                (JOB_STATUS["IN_PROGRESS"],),
+            ).fetchall()
+            if not process_alive(claimed_by)
+            or (self.lease is not None and now - (heartbeat or 0) > self.lease)
+        ]
+        for job_id, attempts in abandoned:
+            if attempts >= self.max_attempts:
+                error = f"Job was abandoned by {attempts} workers"
+                db.execute(
+                    "UPDATE jobs SET status = ?, claimed_by = NULL, payload = NULL,"
+                    " finished_at = ?, data = json_set(data, '$.status', ?, '$.error', ?,"
+                    " '$.version', COALESCE(json_extract(data, '$.version'), 0) + 1)"
+                    " WHERE job_id = ?",
+                    (JOB_STATUS["FAILED"], now, JOB_STATUS["FAILED"], error, job_id),
+                )
+            else:
+                db.execute(
+                    "UPDATE jobs SET status = ?, claimed_by = NULL,"
+                    " data = json_set(data, '$.status', ?, '$.completed_files', 0,"
+                    " '$.version', COALESCE(json_extract(data, '$.version'), 0) + 1)"
+                    " WHERE job_id = ?",
+                    (JOB_STATUS["PENDING"], JOB_STATUS["PENDING"], job_id),
+                )
+
+    def _evict(self, db):
+        if self.ttl is not None:
+            db.execute("DELETE FROM jobs WHERE finished_at < ?", (time.time() - self.ttl,))
+        if self.max_jobs is not None:
+            db.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND seq NOT IN (SELECT seq"
+                " FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?)",
+                (self.max_jobs,),
+            )
+        db.execute("DELETE FROM results WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+
+    def queue_length(self):
+        (queued,) = (
+            self._connection()
+            .execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_STATUS["PENDING"],))
+            .fetchone()
+        )
+        return queued
+
+    def queue_position(self, job_id):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND seq <= "
+                "(SELECT seq FROM jobs WHERE job_id = ? AND status = ?)",
+                (JOB_STATUS["PENDING"], job_id, JOB_STATUS["PENDING"]),
+            )
+            .fetchone()
+        )
+        return row[0] or None
+
+
+def process_alive(pid) -> bool:
+    # Whether a process of this host with that pid is running (claims record the claiming pid; the
+    # metrics of gunicorn workers carry theirs)
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def create_job_store(url: str, jobs=None, **retention) -> JobStore:
+    # "memory" (default) or "sqlite:<path>"; retention takes the ttl/max_jobs/... arguments
+    if not url or url == "memory":
+        return MemoryJobStore(jobs, **retention)
+    if url.startswith("sqlite:"):
+        return SQLiteJobStore(url[len("sqlite:") :], **retention)
+    raise ValueError(f"Unknown job store: {url}")
@@ -1,22 +1,77 @@
 import os
+import io
 import pathlib
-import requests
 import datetime
+import importlib
 import re
 import uuid
+import urllib.parse
 import threading
 import base64
 import tempfile
 import shutil
+import hashlib
+import collections
+import contextlib
+import contextvars
+import fcntl
+import functools
+import subprocess
+import xml.etree.ElementTree as ET
+import json
+import gzip
+import time
+import itertools
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import pandas as pd
-import pdf2image
-import pytesseract
-from flask import Flask, jsonify, render_template, request, send_from_directory
-from langcodes import Language
-from PIL import Image
+from flask import Flask, jsonify, render_template, request, send_from_directory, stream_with_context
+from PIL import Image, ImageOps
 from werkzeug.utils import secure_filename
 
+from job_store import FINISHED_STATUSES, JOB_STATUS, create_job_store, process_alive
+
+
+class _LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    Keeps worker boot fast and small: the heavy dependencies are only loaded
+    by the first request that needs them (or by load_heavy_modules()).
+    """
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            module = importlib.import_module(self._name)
+            object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._load(), attr)
+
+
+langcodes = _LazyModule("langcodes")
+pdf2image = _LazyModule("pdf2image")
+pytesseract = _LazyModule("pytesseract")
+requests = _LazyModule("requests")
+
+
+def load_heavy_modules():
+    # Import everything _LazyModule defers, e.g. in a preloading gunicorn master so workers share it
+    for module in (langcodes, pdf2image, pytesseract, requests):
+        module._load()
+
+
 __author__ = "Santhosh Thottingal <santhosh.thottingal@gmail.com>"
 __source__ = "https://github.com/santhoshtr/tesseract-web"
 
@@ -24,98 +79,1540 @@ app = Flask(__name__)
 app.config["JSON_SORT_KEYS"] = False
 UPLOAD_FOLDER = "./static/uploads"
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
-app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_CONTENT_LENGTH", 10 * 1024 * 1024))
+# Image inputs up to this many bytes are decoded from memory; larger ones (and every PDF, which
+# the poppler tools read from a path) are spooled to a temp file in UPLOAD_FOLDER
+app.config["UPLOAD_SPOOL_THRESHOLD"] = int(
+    os.environ.get("UPLOAD_SPOOL_THRESHOLD", 8 * 1024 * 1024)
+)
+# URL inputs: connect/read timeouts in seconds, largest download, retries (with
+# exponential backoff starting at FETCH_BACKOFF seconds), kept-alive connections per
+# host, and concurrent downloads per async job
+app.config["FETCH_CONNECT_TIMEOUT"] = float(os.environ.get("FETCH_CONNECT_TIMEOUT", 5))
+app.config["FETCH_READ_TIMEOUT"] = float(os.environ.get("FETCH_READ_TIMEOUT", 30))
+app.config["FETCH_MAX_BYTES"] = int(os.environ.get("FETCH_MAX_BYTES", 50 * 1024 * 1024))
+app.config["FETCH_RETRIES"] = int(os.environ.get("FETCH_RETRIES", 3))
+app.config["FETCH_BACKOFF"] = float(os.environ.get("FETCH_BACKOFF", 0.5))
+app.config["FETCH_POOL_SIZE"] = int(os.environ.get("FETCH_POOL_SIZE", 10))
+app.config["FETCH_WORKERS"] = int(os.environ.get("FETCH_WORKERS", 8))
+# Longest a whole download may take in seconds, and how many files of an async job are downloaded
+# ahead of the ones being OCR'd
+app.config["FETCH_TOTAL_TIMEOUT"] = float(os.environ.get("FETCH_TOTAL_TIMEOUT", 120))
+app.config["FETCH_PREFETCH_WINDOW"] = int(os.environ.get("FETCH_PREFETCH_WINDOW", 4))
 app.config["SUPPORTED_FORMATS"] = ["png", "jpeg", "jpg", "bmp", "pnm", "gif", "tiff", "webp", "pdf"]
+# "subprocess" runs the tesseract binary per call, "tesserocr" keeps warm in-process
+# API handles, "auto" uses tesserocr when it is installed and falls back otherwise.
+app.config["OCR_ENGINE"] = os.environ.get("OCR_ENGINE", "auto")
+app.config["LANGUAGES_MAX_AGE"] = int(os.environ.get("LANGUAGES_MAX_AGE", 3600))
+# Number of pages of one document OCR'd concurrently (1 = sequential)
+app.config["OCR_PAGE_WORKERS"] = int(os.environ.get("OCR_PAGE_WORKERS", 1))
+# PDF pages rasterized per pdf2image call; bounds the rendered pages held in memory
+app.config["PDF_RENDER_CHUNK_SIZE"] = int(os.environ.get("PDF_RENDER_CHUNK_SIZE", 4))
+# Server-wide pdf2image defaults; dpi, grayscale and use_pdftocairo can be overridden per request
+app.config["PDF_RENDER_DPI"] = int(os.environ.get("PDF_RENDER_DPI", 200))
+app.config["PDF_RENDER_GRAYSCALE"] = os.environ.get("PDF_RENDER_GRAYSCALE", "0") == "1"
+app.config["PDF_RENDER_USE_PDFTOCAIRO"] = os.environ.get("PDF_RENDER_USE_PDFTOCAIRO", "0") == "1"
+app.config["PDF_RENDER_THREAD_COUNT"] = int(os.environ.get("PDF_RENDER_THREAD_COUNT", 1))
+# Render pages to files that Tesseract reads directly instead of decoding them into PIL images
+app.config["PDF_RENDER_TO_DISK"] = os.environ.get("PDF_RENDER_TO_DISK", "0") == "1"
+# Take text and word boxes from a PDF's embedded text layer and only OCR pages without one
+app.config["PDF_USE_TEXT_LAYER"] = os.environ.get("PDF_USE_TEXT_LAYER", "1") == "1"
+# Fewer words than this on a page means the text layer is treated as missing
+app.config["PDF_TEXT_LAYER_MIN_WORDS"] = int(os.environ.get("PDF_TEXT_LAYER_MIN_WORDS", 3))
+# On pages mostly covered by images (scans), the share of the page the text layer's word boxes must
+# cover; less means it is only a stamped header or similar and the page is OCR'd
+app.config["PDF_TEXT_LAYER_MIN_COVERAGE"] = float(
+    os.environ.get("PDF_TEXT_LAYER_MIN_COVERAGE", 0.1)
+)
+# OCR result cache keyed by file content and OCR parameters: entries kept in memory (0 disables
+# the cache), plus an optional directory shared by all workers and its entries' lifetime in seconds.
+app.config["OCR_CACHE_SIZE"] = int(os.environ.get("OCR_CACHE_SIZE", 128))
+# Most bytes of serialized results the in-memory tier holds, whatever the entry count (0 = no limit)
+app.config["OCR_CACHE_MAX_BYTES"] = int(os.environ.get("OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+app.config["OCR_CACHE_DIR"] = os.environ.get("OCR_CACHE_DIR", "")
+app.config["OCR_CACHE_DIR_MAX_AGE"] = int(os.environ.get("OCR_CACHE_DIR_MAX_AGE", 7 * 24 * 3600))
+# How image inputs come back: "base64" inlines the file as image_base64, "url"
+# links a stored copy and "thumbnail" a downscaled JPEG preview (image_url, served
+# from /api/artifacts). Requests can override it.
+app.config["IMAGE_OUTPUT"] = os.environ.get("IMAGE_OUTPUT", "base64")
+app.config["THUMBNAIL_SIZE"] = int(os.environ.get("THUMBNAIL_SIZE", 1024))
+# Seconds a stored image copy or thumbnail is kept after it was last produced
+app.config["ARTIFACT_MAX_AGE"] = int(os.environ.get("ARTIFACT_MAX_AGE", 24 * 3600))
+# Disk quota for all stored artifacts (least recently produced go
+# first, 0 = none) and how often it is enforced
+app.config["ARTIFACT_MAX_BYTES"] = int(os.environ.get("ARTIFACT_MAX_BYTES", 1024 * 1024 * 1024))
+app.config["ARTIFACT_SWEEP_INTERVAL"] = int(os.environ.get("ARTIFACT_SWEEP_INTERVAL", 300))
+# Processes of this app on the host (gunicorn workers pass their count to configure_process_count);
+# the job pools below default to their share of the cores so the host runs about one job per core.
+app.config["OCR_PROCESSES"] = max(1, int(os.environ.get("OCR_PROCESSES", 1)))
+_CORES_PER_PROCESS = max(1, (os.cpu_count() or 1) // app.config["OCR_PROCESSES"])
+# Async jobs run on a fixed pool of JOB_WORKERS threads; at most JOB_QUEUE_SIZE jobs wait
+# for a free worker before /api/async_ocr answers 429.
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", _CORES_PER_PROCESS))
+app.config["JOB_QUEUE_SIZE"] = int(os.environ.get("JOB_QUEUE_SIZE", 100))
+# Files of async jobs are OCR'd on a pool shared by all running jobs (1 = one file at a time)
+app.config["JOB_FILE_WORKERS"] = int(os.environ.get("JOB_FILE_WORKERS", _CORES_PER_PROCESS))
+# Synchronous /api/ocr and /api/v2/ocr requests OCR on a pool of this many threads, however many
+# requests the server's threads accept at once (0 = on the request thread, unbounded)
+app.config["SYNC_OCR_WORKERS"] = int(os.environ.get("SYNC_OCR_WORKERS", _CORES_PER_PROCESS))
+
+_PARALLELISM_KEYS = (
+    "OCR_PAGE_WORKERS", "JOB_FILE_WORKERS", "JOB_WORKERS", "SYNC_OCR_WORKERS", "OCR_PROCESSES"
+)
+if max(app.config[key] for key in _PARALLELISM_KEYS) > 1:
+    # Pages, files, jobs, requests or worker processes already run in parallel, so keep each
+    # Tesseract run single threaded to avoid oversubscribing the cores. Has to happen before
+    # libtesseract (tesserocr) is loaded.
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+try:
+    import tesserocr  # noqa: E402
+except ImportError:  # optional in-process engine, see OCR_ENGINE
+    tesserocr = None
+
+
+def configure_process_count(processes: int):
+    # Called in each gunicorn worker with the effective worker count, which gunicorn.conf.py can't
+    # know when it is imported (a --workers flag overrides it later). Explicit settings win, and the
+    # job pools must not have started yet.
+    if "OCR_PROCESSES" in os.environ:
+        return
+    app.config["OCR_PROCESSES"] = max(1, processes)
+    cores_per_process = max(1, (os.cpu_count() or 1) // app.config["OCR_PROCESSES"])
+    for key in ("JOB_WORKERS", "JOB_FILE_WORKERS", "SYNC_OCR_WORKERS"):
+        if key not in os.environ:
+            app.config[key] = cores_per_process
+    if max(app.config[key] for key in _PARALLELISM_KEYS) > 1:
+        # For the tesseract subprocesses; tesserocr has read it already when the import above ran
+        os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+# "memory" keeps jobs in OCR_JOBS of the accepting worker; "sqlite:<path>" shares them (and
+# the queue) between all workers of the host so any of them can answer polls and run jobs.
+app.config["JOB_STORE"] = os.environ.get("JOB_STORE", "memory")
+# Retention of finished jobs: seconds kept after finishing, how many are kept, and the total size of
+# their results held in memory (least recently polled jobs go first). With JOB_SPILL_DIR, results
+# over the size budget are moved to gzip files there instead of being dropped.
+app.config["JOB_TTL"] = int(os.environ.get("JOB_TTL", 3600))
+app.config["JOB_MAX_COUNT"] = int(os.environ.get("JOB_MAX_COUNT", 1000))
+app.config["JOB_MAX_RESULT_BYTES"] = int(os.environ.get("JOB_MAX_RESULT_BYTES", 256 * 1024 * 1024))
+app.config["JOB_SPILL_DIR"] = os.environ.get("JOB_SPILL_DIR", "")
+# Shared job stores: seconds a claimed job may go without progress before another worker takes it
+# over (its claiming process exiting frees it right away), and how many times a job is claimed
+# before it is failed
+app.config["JOB_LEASE"] = float(os.environ.get("JOB_LEASE", 3600))
+app.config["JOB_MAX_ATTEMPTS"] = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+# Longest a long-poll status request (?wait=) is held, and how
+# often an idle event stream sends a keepalive
+app.config["JOB_STATUS_MAX_WAIT"] = float(os.environ.get("JOB_STATUS_MAX_WAIT", 30))
+app.config["JOB_EVENTS_HEARTBEAT"] = float(os.environ.get("JOB_EVENTS_HEARTBEAT", 15))
+# Files (or pages of a file) per /api/ocr_results response unless ?limit= says otherwise
+app.config["JOB_RESULTS_PAGE_SIZE"] = int(os.environ.get("JOB_RESULTS_PAGE_SIZE", 10))
+# Directory where each gunicorn worker writes its metrics every METRICS_FLUSH_INTERVAL seconds,
+# so /metrics reports all workers (gunicorn.conf.py provides one per run if unset); unset,
+# /metrics only covers the process that answers it
+app.config["METRICS_DIR"] = os.environ.get("METRICS_DIR", "")
+app.config["METRICS_FLUSH_INTERVAL"] = float(os.environ.get("METRICS_FLUSH_INTERVAL", 10))
 
 OCR_JOBS = {}
-JOB_STATUS = {
-    "PENDING": "pending",
-    "IN_PROGRESS": "in_progress",
-    "COMPLETED": "completed",
-    "FAILED": "failed"
+JOB_STORE = create_job_store(
+    app.config["JOB_STORE"], OCR_JOBS,
+    ttl=app.config["JOB_TTL"],
+    max_jobs=app.config["JOB_MAX_COUNT"],
+    max_result_bytes=app.config["JOB_MAX_RESULT_BYTES"],
+    spill_dir=app.config["JOB_SPILL_DIR"] or None,
+    lease=app.config["JOB_LEASE"] or None,
+    max_attempts=app.config["JOB_MAX_ATTEMPTS"]
+)
+
+# Optional clean-up of image inputs before OCR (see _preprocess_image): EXIF
+# orientation, grayscale, and downscaling to PREPROCESS_TARGET_DPI (for images that
+# declare a higher DPI) and PREPROCESS_MAX_PIXELS
+app.config["PREPROCESS"] = os.environ.get("PREPROCESS", "0") == "1"
+app.config["PREPROCESS_TARGET_DPI"] = int(os.environ.get("PREPROCESS_TARGET_DPI", 300))
+app.config["PREPROCESS_MAX_PIXELS"] = int(os.environ.get("PREPROCESS_MAX_PIXELS", 8_000_000))
+# Binarization after preprocessing: none, otsu (global
+# threshold) or sauvola (local, for uneven lighting)
+app.config["PREPROCESS_BINARIZE"] = os.environ.get("PREPROCESS_BINARIZE", "none")
+
+# Extra Tesseract renderers that can be requested alongside text and word boxes,
+# mapped to the output extension pytesseract uses for them.
+OCR_OUTPUT_FORMATS = {"hocr": "hocr", "alto": "xml"}
+# Tesseract variables that turn on the renderer writing each output extension
+TESSERACT_RENDERER_VARIABLES = {
+    "tsv": "tessedit_create_tsv", "hocr": "tessedit_create_hocr", "xml": "tessedit_create_alto"
+}
+# Request fields forwarded from /api/ocr, /api/v2/ocr and async file entries to the OCR task
+OCR_OPTION_KEYS = (
+    "output_formats", "dpi", "grayscale", "use_pdftocairo", "use_text_layer", "image_output",
+    "ocr_data_format", "preprocess", "binarize", "pages", "crop"
+)
+IMAGE_OUTPUT_MODES = ("base64", "url", "thumbnail")
+# Content-addressed copies of inputs in UPLOAD_FOLDER: ocr_<sha256>.pdf for PDF previews,
+# img_<sha256>.<ext> and thumb_<sha256>_<size>.jpg for images
+ARTIFACT_NAME = re.compile(
+    r"(ocr_[0-9a-f]{64}\.pdf|img_[0-9a-f]{64}\.[a-z]+|thumb_[0-9a-f]{64}_\d+\.jpg)"
+)
+# PDF copies written by earlier versions (ocr_<uuid>_<name>);
+# only swept, never served from /api/artifacts
+LEGACY_ARTIFACT_NAME = re.compile(r"ocr_[0-9a-f]{32}_.+")
+# Per-file fields kept in job status summaries; the full results come from /api/ocr_results
+RESULT_SUMMARY_KEYS = (
+    "filename", "source", "language", "error", "cache_hit", "image_url", "start_time", "end_time",
+    "duration"
+)
+# Most jobs one /api/ocr_events?job_ids= stream may watch
+MAX_EVENT_STREAM_JOBS = 100
+OCR_DATA_COLUMNS = [
+    'level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num', 'left', 'top', 'width',
+    'height', 'conf', 'text'
+]
+OCR_DATA_INT_COLUMNS = OCR_DATA_COLUMNS[:10]
+# Shapes of the word boxes in "ocr_data": a dict per word, or a dict of parallel lists per column
+OCR_DATA_FORMATS = ("records", "columns")
+BINARIZE_METHODS = ("none", "otsu", "sauvola")
+# Sauvola window side in pixels (odd) and sensitivity, the usual values for text around 300 DPI
+SAUVOLA_WINDOW = 25
+SAUVOLA_K = 0.2
+# Header line the tsv renderer writes; GetTSVText() only returns the rows
+TSV_HEADER = "\t".join(OCR_DATA_COLUMNS) + "\n"
+# Metrics served by /metrics in the Prometheus text format, as name: (type, help)
+METRICS = {
+    "ocr_stage_seconds": (
+        "histogram",
+        "Seconds a file spent in each stage (download, decode, rasterize, preprocess, ocr, "
+        "serialize), summed over its pages"
+    ),
+    "ocr_files_total": ("counter", "Files processed, by outcome"),
+    "ocr_cache_lookups_total": (
+        "counter", "OCR result cache lookups, by the tier that answered (memory, disk) or miss"
+    ),
+    "ocr_tesseract_runs_total": ("counter", "Tesseract recognition passes, by engine"),
+    "ocr_tesseract_subprocesses": ("gauge", "Tesseract subprocesses currently running"),
+    "ocr_job_queue_depth": ("gauge", "Async jobs waiting for a job worker thread"),
+    "ocr_job_workers_active": ("gauge", "Job worker threads currently running a job"),
+    "ocr_job_workers": ("gauge", "Job worker threads started"),
+    "ocr_worker_processes": ("gauge", "Worker processes whose metrics are included"),
+}
+METRIC_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Per-process snapshots in METRICS_DIR; metrics_retired.json holds the totals of workers that exited
+METRICS_SNAPSHOT_NAME = re.compile(r"metrics_(\d+)\.json")
+
+# Tesseract version and language list, probed once per worker (see refresh_tesseract_info); "stale"
+# marks them for a re-probe on next use (see mark_tesseract_info_stale)
+_TESSERACT_INFO = {}
+_TESSERACT_INFO_LOCK = threading.Lock()
+
+# Async job worker threads (started lazily, per process) and a moving average of job durations
+_JOB_SCHEDULER = {
+    "pid": None, "workers": [], "active": 0, "avg_job_seconds": None, "stop": threading.Event()
 }
+_JOB_SCHEDULER_LOCK = threading.Lock()
+
+# In-memory tier of the OCR result cache, in LRU order: key -> (result, serialized size)
+_RESULT_CACHE = collections.OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+
+# Warm tesserocr API handles, one per worker thread and language (the API is not thread safe)
+_ENGINE_LOCAL = threading.local()
+
+# requests.Session per thread (sessions aren't thread safe), each pooling connections by host
+_FETCH_LOCAL = threading.local()
+
+# Background thread that expires artifacts and enforces the disk quota (started lazily, per process)
+_ARTIFACT_SWEEPER = {"pid": None, "thread": None}
+_ARTIFACT_SWEEPER_LOCK = threading.Lock()
+
+# Counters, gauges and histograms of this process by (name, labels); see _metrics_state
+_METRICS = {"pid": None, "counters": {}, "gauges": {}, "histograms": {}}
+_METRICS_LOCK = threading.Lock()
+# Stage timings of the file being processed (see _stage_timer), carried into page threads
+_STAGE_SECONDS = contextvars.ContextVar("stage_seconds", default=None)
+# Background thread that writes this process's metrics to METRICS_DIR (started lazily, per process)
+_METRICS_FLUSHER = {"pid": None, "thread": None}
+_METRICS_FLUSHER_LOCK = threading.Lock()
+
+# Shared thread pools by name ("page", "file"), as (executor, size), created on first use
+_EXECUTORS = {}
+_EXECUTORS_LOCK = threading.Lock()
 
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
 
-def get_tesseract_version_string() -> str:
+def _tesseract_cli(*args) -> str:
+    # Runs the tesseract binary directly: pytesseract's get_tesseract_version() and get_languages()
+    # remember their first answer for the life of the process, so they can't be re-probed
     try:
-        return str(pytesseract.get_tesseract_version())
+        completed = subprocess.run(
+            [pytesseract.pytesseract.tesseract_cmd, *args],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, timeout=30
+        )
+    except OSError:
+        raise pytesseract.TesseractNotFoundError() from None
+    return completed.stdout.decode("utf-8", "replace")
+
+
+def _probe_tesseract_version() -> str:
+    try:
+        version = re.search(r"\d+(?:\.\d+)*", _tesseract_cli("--version").split("\n", 1)[0])
+        return version.group() if version else "Unknown"
     except pytesseract.TesseractNotFoundError:
         return "Not Installed"
     except Exception as e:
         return f"Error: {e}"
 
 
-def pdf_to_img(pdf_file):
-    return pdf2image.convert_from_path(pdf_file)
+def _probe_languages() -> dict:
+    languages = {}
+    # The first line is 'List of available languages in "<tessdata dir>" (n):', then a code per line
+    lines = _tesseract_cli("--list-langs").splitlines()
+    tessdata = re.search(r'"(.+)"', lines[0]) if lines else None
+    alpha3codes = [line.strip() for line in lines[1:] if re.fullmatch(r"[a-z_]+", line.strip())]
+    for code in alpha3codes:
+        language = langcodes.Language.get(code)
 
+        languages[language.language] = language.autonym()
+    body = app.json.dumps({"languages": languages}).encode("utf-8")
+    return {
+        "languages": languages,
+        "json": body,
+        "etag": hashlib.sha1(body).hexdigest(),
+        "tessdata": tessdata.group(1) if tessdata else "",
+    }
+
+
+def _cached_tesseract_info(key: str, probe):
+    if _TESSERACT_INFO.get("stale"):
+        with _TESSERACT_INFO_LOCK:
+            if _TESSERACT_INFO.get("stale"):
+                _TESSERACT_INFO.clear()
+    value = _TESSERACT_INFO.get(key)
+    if value is None:
+        with _TESSERACT_INFO_LOCK:
+            value = _TESSERACT_INFO.get(key)
+            if value is None:
+                value = _TESSERACT_INFO[key] = probe()
+    return value
+
+
+def mark_tesseract_info_stale():
+    # Safe from a signal handler: takes no lock, the next request re-probes
+    _TESSERACT_INFO["stale"] = True
+
+
+def refresh_tesseract_info() -> dict:
+    # Drop the cached probes of this process (e.g. after installing traineddata) and probe again
+    with _TESSERACT_INFO_LOCK:
+        _TESSERACT_INFO.clear()
+    return {
+        "tesseract_version": get_tesseract_version_string(),
+        "languages": get_languages(),
+    }
+
+
+def get_tesseract_version_string() -> str:
+    return _cached_tesseract_info("version", _probe_tesseract_version)
+
+
+def pdf_page_count(pdf_file) -> int:
+    return pdf2image.pdfinfo_from_path(pdf_file)["Pages"]
+
+
+def pdf_page_sizes(pdf_file, page_numbers, dpi: int) -> dict:
+    # {page_num: (width, height)} in pixels of the pages as
+    # pdftoppm renders them at dpi, rotation included
+    completed = subprocess.run(
+        ["pdfinfo", "-f", str(min(page_numbers)), "-l", str(max(page_numbers)), pdf_file],
+        capture_output=True, timeout=60, check=True, text=True
+    )
+    sizes = {
+        int(page_num): (float(width), float(height))
+        for page_num, width, height in re.findall(
+            r"^Page\s+(\d+) size:\s+([\d.]+) x ([\d.]+)", completed.stdout, re.M
+        )
+    }
+    rotations = {
+        int(page_num): int(rotation)
+        for page_num, rotation in re.findall(r"^Page\s+(\d+) rot:\s+(\d+)", completed.stdout, re.M)
+    }
+    pixel_sizes = {}
+    for page_num in page_numbers:
+        width, height = sizes[page_num]
+        if rotations.get(page_num, 0) % 180:
+            width, height = height, width
+        pixel_sizes[page_num] = (math.ceil(width * dpi / 72), math.ceil(height * dpi / 72))
+    return pixel_sizes
+
+
+def _render_pdf_region(pdf_file, page_num: int, box: tuple, render_options: dict) -> Image:
+    # pdf2image can't crop, so regions are rendered by pdftoppm directly (in memory, whatever
+    # PDF_RENDER_TO_DISK and use_pdftocairo say); only the region's pixels are rasterized
+    left, top, right, bottom = box
+    command = [
+        "pdftoppm", "-r", str(render_options["dpi"]), "-f", str(page_num), "-l", str(page_num),
+        "-x", str(left), "-y", str(top), "-W", str(right - left), "-H", str(bottom - top)
+    ]
+    if render_options["grayscale"]:
+        command.append("-gray")
+    completed = subprocess.run(command + [pdf_file], capture_output=True, timeout=120, check=True)
+    image = Image.open(io.BytesIO(completed.stdout))
+    image.load()
+    return image
+
+
+def _page_chunks(page_numbers, chunk_size: int):
+    # Groups sorted page numbers into (first_page, last_page) runs of at most chunk_size pages
+    first = last = None
+    for page_num in page_numbers:
+        if first is not None and page_num == last + 1 and page_num - first < chunk_size:
+            last = page_num
+            continue
+        if first is not None:
+            yield first, last
+        first = last = page_num
+    if first is not None:
+        yield first, last
+
+
+def _bool_option(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _pdf_render_options(file_input: dict) -> dict:
+    # Server-wide rasterization settings with the per-request overrides applied
+    try:
+        dpi = int(file_input.get("dpi") or app.config["PDF_RENDER_DPI"])
+    except (TypeError, ValueError):
+        raise ValueError("dpi must be an integer") from None
+    if not 50 <= dpi <= 1200:
+        raise ValueError("dpi must be between 50 and 1200")
+    return {
+        "dpi": dpi,
+        "grayscale": _bool_option(file_input.get("grayscale", app.config["PDF_RENDER_GRAYSCALE"])),
+        "use_pdftocairo": _bool_option(
+            file_input.get("use_pdftocairo", app.config["PDF_RENDER_USE_PDFTOCAIRO"])
+        ),
+        "thread_count": app.config["PDF_RENDER_THREAD_COUNT"],
+    }
+
+
+def _release_page(page):
+    # Pages are PIL images, or file paths when rendered with PDF_RENDER_TO_DISK
+    if isinstance(page, str):
+        if os.path.exists(page):
+            os.remove(page)
+    else:
+        page.close()
+
+
+def pdf_to_img(pdf_file, page_numbers=None, render_options=None, crop_boxes=None):
+    # Lazily yields (page_num, page), rendering PDF_RENDER_CHUNK_SIZE pages at a time so
+    # memory stays bounded by the chunk size instead of the document length.
+    # With crop_boxes ({page_num: pixel box}) only those regions are rendered, a page at a time.
+    if page_numbers is None:
+        page_numbers = range(1, pdf_page_count(pdf_file) + 1)
+    render_options = render_options or _pdf_render_options({})
+    chunk_size = max(1, app.config["PDF_RENDER_CHUNK_SIZE"])
+
+    if crop_boxes:
+        for page_num in page_numbers:
+            with _stage_timer("rasterize"):
+                page = _render_pdf_region(pdf_file, page_num, crop_boxes[page_num], render_options)
+            yield page_num, page
+        return
+
+    if not app.config["PDF_RENDER_TO_DISK"]:
+        for first_page, last_page in _page_chunks(page_numbers, chunk_size):
+            with _stage_timer("rasterize"):
+                images = pdf2image.convert_from_path(
+                    pdf_file, first_page=first_page, last_page=last_page, **render_options
+                )
+            images.reverse()
+            page_num = first_page
+            while images:
+                # Pop so the chunk list doesn't keep already OCR'd pages alive
+                yield page_num, images.pop()
+                page_num += 1
+        return
+
+    # Uncompressed PNM files are cheap to write and Tesseract reads them without re-encoding
+    with tempfile.TemporaryDirectory(dir=app.config["UPLOAD_FOLDER"]) as output_folder:
+        for first_page, last_page in _page_chunks(page_numbers, chunk_size):
+            with _stage_timer("rasterize"):
+                paths = pdf2image.convert_from_path(
+                    pdf_file, first_page=first_page, last_page=last_page,
+                    output_folder=output_folder, paths_only=True, fmt="ppm", **render_options
+                )
+            for page_num, path in enumerate(paths, start=first_page):
+                yield page_num, path
+
+
+def _parse_output_formats(value) -> list:
+    # Accepts a list (JSON payloads) or a comma separated string (form fields)
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    formats = []
+    for fmt in value:
+        fmt = str(fmt).strip().lower()
+        if not fmt:
+            continue
+        if fmt not in OCR_OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {fmt}")
+        if fmt not in formats:
+            formats.append(fmt)
+    return formats
+
+
+def _extract_ocr_options(source) -> dict:
+    # Copy the OCR options present in a request form or JSON body into a file input dict
+    return {key: source.get(key) for key in OCR_OPTION_KEYS if source.get(key) is not None}
+
+
+def _use_tesserocr(extensions: list) -> bool:
+    if tesserocr is None or app.config["OCR_ENGINE"] == "subprocess":
+        return False
+    # tesserocr only renders hOCR and ALTO page fragments, not the complete documents the
+    # tesseract binary writes, so those requests go to the subprocess engine
+    return not {"hocr", "xml"} & set(extensions)
+
+
+def _get_tesserocr_api(lang_code: str):
+    apis = getattr(_ENGINE_LOCAL, "apis", None)
+    if apis is None:
+        apis = _ENGINE_LOCAL.apis = {}
+    api = apis.get(lang_code)
+    if api is None:
+        # Loading traineddata is the expensive part, so the handle is kept for the thread's lifetime
+        api = apis[lang_code] = tesserocr.PyTessBaseAPI(lang=lang_code)
+    return api
+
+
+def _run_tesserocr(image, lang_code: str, extensions: list) -> dict:
+    api = _get_tesserocr_api(lang_code)
+    try:
+        if isinstance(image, str):
+            api.SetImageFile(image)
+        else:
+            api.SetImage(image)
+        api.Recognize()
+        renderers = {
+            # The tesseract binary ends a page's text with its page separator, a form feed;
+            # match it so both engines give the same text
+            "txt": lambda: api.GetUTF8Text() + "\f",
+            "tsv": lambda: TSV_HEADER + api.GetTSVText(0),
+        }
+        return {ext: renderers[ext]().encode("utf-8") for ext in extensions}
+    finally:
+        api.Clear()
+
+
+def _run_tesseract(image, lang_code: str, extensions: list) -> dict:
+    # One recognition pass; Tesseract writes every requested renderer's output from it
+    with _stage_timer("ocr"):
+        if _use_tesserocr(extensions):
+            _count_metric("ocr_tesseract_runs_total", engine="tesserocr")
+            return _run_tesserocr(image, lang_code, extensions)
+        _count_metric("ocr_tesseract_runs_total", engine="subprocess")
+        _add_gauge("ocr_tesseract_subprocesses", 1)
+        try:
+            outputs = _run_tesseract_cli(image, extensions=extensions, lang=lang_code)
+        finally:
+            _add_gauge("ocr_tesseract_subprocesses", -1)
+    return dict(zip(extensions, outputs))
+
+
+def _run_tesseract_cli(image, extensions: list, lang: str) -> list:
+    # pytesseract's run_and_get_multiple_output puts all renderer variables behind a single -c, so
+    # tesseract reads every one after the first as a config file name and never writes ALTO. Each
+    # variable gets its own -c here; txt and hocr are also passed as config names by pytesseract.
+    config = " ".join(
+        f"-c {TESSERACT_RENDERER_VARIABLES[ext]}=1"
+        for ext in extensions if ext in TESSERACT_RENDERER_VARIABLES
+    )
+    cli = pytesseract.pytesseract
+    with cli.save(image) as (temp_name, input_filename):
+        cli.run_tesseract(input_filename, temp_name, " ".join(extensions), lang, config=config)
+        return [pathlib.Path(f"{temp_name}.{ext}").read_bytes() for ext in extensions]
+
+
+# Helper to get text and bounding box data from a single Tesseract run
+def _parse_tsv(tsv: bytes) -> dict:
+    # Word rows (those with text) of Tesseract's TSV as parallel lists per column
+    lines = tsv.decode("utf-8").splitlines()
+    header = lines[0].split("\t") if lines else OCR_DATA_COLUMNS
+    text_index = header.index("text")
+    rows = [line.split("\t") for line in lines[1:]]
+    rows = [row for row in rows if len(row) >= len(header) and row[text_index].strip()]
+    values = list(zip(*rows)) if rows else [()] * len(header)
+
+    columns = {}
+    for name in OCR_DATA_COLUMNS:
+        if name not in header:
+            columns[name] = [None] * len(rows)
+            continue
+        column = values[header.index(name)]
+        if name in OCR_DATA_INT_COLUMNS:
+            columns[name] = list(map(int, column))
+        elif name == "conf":
+            columns[name] = list(map(float, column))
+        else:
+            columns[name] = list(column)
+    return columns
+
+
+def _ocr_data_records(columns: dict) -> list:
+    words = zip(*(columns[name] for name in OCR_DATA_COLUMNS))
+    return [dict(zip(OCR_DATA_COLUMNS, word)) for word in words]
+
+
+def _ocr_data_columns(records: list) -> dict:
+    return {name: [word[name] for word in records] for name in OCR_DATA_COLUMNS}
+
+
+def _ocr_data_format(file_input: dict) -> str:
+    ocr_data_format = file_input.get("ocr_data_format") or "records"
+    if ocr_data_format not in OCR_DATA_FORMATS:
+        raise ValueError(
+            f"Unsupported ocr_data_format '{ocr_data_format}'. "
+            f"Supported: {', '.join(OCR_DATA_FORMATS)}"
+        )
+    return ocr_data_format
+
+
+def _get_ocr_data(image: Image, language: str, output_formats=(), ocr_data_format="records"):
+    lang_code = langcodes.Language.get(language).to_alpha3()
+    extensions = ["txt", "tsv"] + [OCR_OUTPUT_FORMATS[fmt] for fmt in output_formats]
+    outputs = _run_tesseract(image, lang_code, extensions)
+    text = outputs["txt"].decode("utf-8")
 
-# NEW: Helper to get text and bounding box data
-def _get_ocr_data(image: Image, language: str):
-    lang_code = Language.get(language).to_alpha3()
-    text = pytesseract.image_to_string(image, lang=lang_code)
-    
     # Get bounding box data
-    data = pytesseract.image_to_data(image, lang=lang_code, output_type=pytesseract.Output.DATAFRAME)
-    
+    columns = _parse_tsv(outputs["tsv"])
+
     # Get image dimensions for frontend scaling
-    width, height = image.size
-    
-    # Filter out empty rows and format as a list of dicts
-    ocr_data = data.dropna(subset=['text']) 
-    ocr_data = ocr_data[ocr_data['text'].str.strip() != ''] 
-    
-    required_cols = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num', 'left', 'top', 'width', 'height', 'conf', 'text']
-    for col in required_cols:
-        if col not in ocr_data.columns:
-            ocr_data[col] = None
-            
-    json_ready_data = ocr_data[required_cols].to_dict(orient='records')
-    
-    return {
-        "text": text, 
-        "ocr_data": json_ready_data,
+    if isinstance(image, str):
+        with Image.open(image) as image_file:  # only reads the header
+            width, height = image_file.size
+    else:
+        width, height = image.size
+
+    results = {
+        "text": text,
+        "ocr_data": columns if ocr_data_format == "columns" else _ocr_data_records(columns),
         "image_width": width,
         "image_height": height
     }
+    for fmt in output_formats:
+        results[fmt] = outputs[OCR_OUTPUT_FORMATS[fmt]].decode("utf-8")
+    return results
+
+
+def _page_entry(page_num: int, page_ocr_results: dict) -> dict:
+    # Per-page element of a result's "ocr_data" list
+    entry = {
+        "page_num": page_num,
+        "ocr_data": page_ocr_results["ocr_data"],
+        "image_width": page_ocr_results["image_width"],
+        "image_height": page_ocr_results["image_height"]
+    }
+    for fmt in OCR_OUTPUT_FORMATS:
+        if fmt in page_ocr_results:
+            entry[fmt] = page_ocr_results[fmt]
+    for key in ("text_source", "crop"):
+        if key in page_ocr_results:
+            entry[key] = page_ocr_results[key]
+    return entry
+
+
+def _preprocess_options(file_input: dict) -> dict:
+    binarize = file_input.get("binarize") or app.config["PREPROCESS_BINARIZE"]
+    if binarize not in BINARIZE_METHODS:
+        raise ValueError(
+            f"Unsupported binarize '{binarize}'. Supported: {', '.join(BINARIZE_METHODS)}"
+        )
+    # Binarizing implies the rest of the preprocessing
+    enabled = binarize != "none" or _bool_option(
+        file_input.get("preprocess", app.config["PREPROCESS"])
+    )
+    return {"enabled": enabled, "binarize": binarize if enabled else "none"}
+
+
+def _preprocess_scale(image: Image) -> float:
+    # Factor (<= 1) that brings the image down to PREPROCESS_TARGET_DPI and PREPROCESS_MAX_PIXELS
+    scale = 1.0
+    dpi = image.info.get("dpi")
+    if dpi and float(dpi[0]) > app.config["PREPROCESS_TARGET_DPI"]:
+        scale = app.config["PREPROCESS_TARGET_DPI"] / float(dpi[0])
+    pixels = image.width * image.height * scale * scale
+    if pixels > app.config["PREPROCESS_MAX_PIXELS"]:
+        scale *= (app.config["PREPROCESS_MAX_PIXELS"] / pixels) ** 0.5
+    return scale
+
+
+def _otsu_threshold(pixels):
+    import numpy as np
+
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    weight = np.cumsum(histogram)
+    mean = np.cumsum(histogram * np.arange(256))
+    total, total_mean = weight[-1], mean[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between_class_variance = (
+            (total_mean * weight - mean * total) ** 2 / (weight * (total - weight))
+        )
+    if not np.isfinite(between_class_variance).any():
+        return 127
+    return int(np.nanargmax(between_class_variance))
+
+
+def _sauvola_threshold(pixels):
+    # Local mean and standard deviation over SAUVOLA_WINDOW from integral images, so
+    # the cost doesn't depend on the window size
+    import numpy as np
+
+    height, width = pixels.shape
+    window = SAUVOLA_WINDOW
+    padded = np.pad(pixels.astype(np.float64), window // 2, mode="reflect")
+
+    def window_means(values):
+        integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+        integral[1:, 1:] = values.cumsum(0).cumsum(1)
+        sums = (integral[window:window + height, window:window + width]
+                - integral[:height, window:window + width]
+                - integral[window:window + height, :width] + integral[:height, :width])
+        return sums / (window * window)
+
+    mean = window_means(padded)
+    std = np.sqrt(np.maximum(window_means(padded * padded) - mean * mean, 0))
+    return mean * (1 + SAUVOLA_K * (std / 128 - 1))
+
+
+def _binarize(image: Image, method: str) -> Image:
+    try:
+        import numpy as np
+    except ImportError:
+        raise ValueError(
+            "binarize needs numpy; install it with `pip install .[preprocess]`"
+        ) from None
+    pixels = np.asarray(image.convert("L"))
+    threshold = _otsu_threshold(pixels) if method == "otsu" else _sauvola_threshold(pixels)
+    return Image.fromarray(np.where(pixels > threshold, 255, 0).astype(np.uint8))
+
+
+def _preprocess_image(image: Image, options: dict, resize=True):
+    # Returns (image, scale): upright and grayscale, downscaled by scale, binarized if asked for
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("L", "1"):
+        image = image.convert("L")
+    scale = _preprocess_scale(image) if resize else 1.0
+    if scale < 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if options["binarize"] != "none":
+        image = _binarize(image, options["binarize"])
+    return image, scale
+
+
+def _map_ocr_boxes(ocr_data, factor=1.0, offset=(0, 0)):
+    # Scales, then shifts, the box coordinates of records or columns in place
+    dx, dy = offset
+    shifts = {"left": dx, "top": dy, "width": 0, "height": 0}
+    if isinstance(ocr_data, dict):
+        for key, shift in shifts.items():
+            ocr_data[key] = [round(value * factor) + shift for value in ocr_data[key]]
+        return
+    for word in ocr_data:
+        for key, shift in shifts.items():
+            word[key] = round(word[key] * factor) + shift
+
+
+def _parse_pages(value):
+    # "1-3,5,9-" (or a list of page numbers and such ranges) as
+    # [(first, last)], last None for open ranges
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, str):
+        parts = value.split(",")
+    else:
+        parts = value if isinstance(value, list) else [value]
+    ranges = []
+    for part in parts:
+        match = re.fullmatch(r"(\d+)(?:\s*-\s*(\d*))?", str(part).strip())
+        if not match or int(match.group(1)) < 1 or (
+            match.group(2) and int(match.group(2)) < int(match.group(1))
+        ):
+            raise ValueError(f"Invalid page range '{part}'. Use e.g. 1-3,5,9-")
+        first = int(match.group(1))
+        last = first if match.group(2) is None else int(match.group(2)) if match.group(2) else None
+        ranges.append((first, last))
+    return ranges
+
+
+def _select_pages(ranges, page_count: int) -> list:
+    if ranges is None:
+        return list(range(1, page_count + 1))
+    selected = sorted({
+        page_num
+        for first, last in ranges
+        for page_num in range(first, min(last or page_count, page_count) + 1)
+    })
+    if not selected:
+        raise ValueError(f"No pages selected; the document has {page_count}")
+    return selected
+
+
+def _parse_crop(value):
+    # [left, top, width, height] from a list, a
+    # "left,top,width,height" string or a dict with those keys
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, dict):
+        value = [value.get(key) for key in ("left", "top", "width", "height")]
+    elif isinstance(value, str):
+        value = value.split(",")
+    try:
+        crop = [float(number) for number in value]
+    except (TypeError, ValueError):
+        crop = []
+    if len(crop) != 4 or min(crop) < 0 or crop[2] <= 0 or crop[3] <= 0:
+        raise ValueError(
+            "crop must be left,top,width,height in pixels, or as fractions (0-1) of the page"
+        )
+    return crop
+
+
+def _region_options(file_input: dict) -> dict:
+    return {
+        "pages": _parse_pages(file_input.get("pages")), "crop": _parse_crop(file_input.get("crop"))
+    }
+
+
+def _crop_box(crop: list, width: int, height: int) -> tuple:
+    # Pixel (left, top, right, bottom) of a crop on a width x height page, clipped to the page.
+    # A crop whose values are all at most 1 is in fractions of the page.
+    left, top, crop_width, crop_height = crop
+    if max(crop) <= 1:
+        left, crop_width = left * width, crop_width * width
+        top, crop_height = top * height, crop_height * height
+    box = (
+        max(0, round(left)), max(0, round(top)),
+        min(width, round(left + crop_width)), min(height, round(top + crop_height))
+    )
+    if box[2] <= box[0] or box[3] <= box[1]:
+        raise ValueError(f"crop {crop} lies outside the {width}x{height} page")
+    return box
+
+
+def _apply_crop(page_results: dict, box: tuple, page_size: tuple):
+    # OCR results of a cropped page back in full-page coordinates, with the crop reported alongside
+    _map_ocr_boxes(page_results["ocr_data"], offset=box[:2])
+    page_results["image_width"], page_results["image_height"] = page_size
+    page_results["crop"] = [box[0], box[1], box[2] - box[0], box[3] - box[1]]
+
+
+def _ocr_image(image: Image, language: str, output_formats=(), ocr_data_format="records",
+               preprocess=None, crop=None):
+    # _get_ocr_data with optional cropping and preprocessing; boxes and sizes stay in the
+    # coordinates of the (upright) input image so overlays line up
+    preprocess = preprocess if preprocess and preprocess["enabled"] else None
+    if preprocess is None and crop is None:
+        return _get_ocr_data(image, language, output_formats, ocr_data_format)
+    # EXIF orientations 5-8 are rotated by 90 degrees (0x0112 is the Orientation tag)
+    transposed = image.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+    upright_size = image.size[::-1] if transposed else image.size
+    box = None
+    if crop is not None:
+        # Crops are in the coordinates of the upright image, like the boxes of the result
+        image = ImageOps.exif_transpose(image)
+        box = _crop_box(crop, *upright_size)
+        image = image.crop(box)
+    scale = 1.0
+    if preprocess is not None:
+        with _stage_timer("preprocess"):
+            # hOCR and ALTO carry their own coordinates, so those requests aren't resized
+            image, scale = _preprocess_image(image, preprocess, resize=not output_formats)
+    results = _get_ocr_data(image, language, output_formats, ocr_data_format)
+    if scale < 1.0:
+        _map_ocr_boxes(results["ocr_data"], 1 / scale)
+    results["image_width"], results["image_height"] = upright_size
+    if box is not None:
+        _apply_crop(results, box, upright_size)
+    return results
 
 
 def ocr_core(image: Image, language="en"):
     # This function will now be a wrapper or can be removed if _get_ocr_data is used directly
     # For now, let's keep it to return only text for compatibility if needed.
     # The actual data extraction will happen in _process_single_ocr_task using _get_ocr_data
-    return pytesseract.image_to_string(image, lang=Language.get(language).to_alpha3())
+    return pytesseract.image_to_string(image, lang=langcodes.Language.get(language).to_alpha3())
+
+
+def _get_executor(name: str, workers: int) -> ThreadPoolExecutor:
+    with _EXECUTORS_LOCK:
+        executor, size = _EXECUTORS.get(name, (None, 0))
+        if size != workers:
+            if executor is not None:
+                executor.shutdown(wait=False)
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"ocr-{name}")
+            _EXECUTORS[name] = (executor, workers)
+        return executor
+
+
+def _run_sync_ocr(file_input: dict, **kwargs) -> dict:
+    # _process_single_ocr_task for a synchronous request, on the SYNC_OCR_WORKERS pool: the request
+    # threads mostly wait (long-polls, event streams, uploads), so only this pool bounds their OCR
+    workers = app.config["SYNC_OCR_WORKERS"]
+    if workers <= 0:
+        return _process_single_ocr_task(file_input, **kwargs)
+    future = _get_executor("sync", workers).submit(_process_single_ocr_task, file_input, **kwargs)
+    return future.result()
+
+
+def _map_pages(func, pages):
+    # Applies func to each page and yields the results in page order. With OCR_PAGE_WORKERS > 1
+    # pages run on the shared pool; threads are enough because the work happens in Tesseract,
+    # outside the GIL. At most OCR_PAGE_WORKERS pages are in flight, so a lazy `pages`
+    # iterable is only consumed as fast as it is OCR'd.
+    workers = app.config["OCR_PAGE_WORKERS"]
+    if workers <= 1:
+        for page in pages:
+            yield func(page)
+        return
+
+    executor = _get_executor("page", workers)
+    pending = collections.deque()
+    try:
+        for page in pages:
+            # The page's stage timings count towards the file (see _stage_timer)
+            pending.append(executor.submit(contextvars.copy_context().run, func, page))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _xml_children(element, tag: str):
+    # pdftotext output is XHTML, so every tag carries the XHTML namespace
+    return [child for child in element if child.tag.rsplit("}", 1)[-1] == tag]
+
+
+def _usable_text_layer(words: list) -> bool:
+    if len(words) < app.config["PDF_TEXT_LAYER_MIN_WORDS"]:
+        return False
+    # Fonts without a unicode mapping extract as replacement characters or symbol soup
+    chars = "".join(word["text"] for word in words)
+    readable = sum(1 for char in chars if char.isalnum())
+    return "\ufffd" not in chars and readable >= len(chars) / 2
+
+
+def _page_range_args(first_page: int, last_page) -> list:
+    # poppler's -f/-l options for the pages first_page to last_page (None: to the end)
+    return ["-f", str(first_page)] + (["-l", str(last_page)] if last_page else [])
+
+
+def pdf_image_coverage(pdf_file, first_page=1, last_page=None) -> dict:
+    # {page_num: area in square points drawn with images}, from poppler's pdfimages; a page
+    # mostly covered by an image is a scan, whatever text a digital header or stamp adds to it
+    try:
+        completed = subprocess.run(
+            ["pdfimages", "-list", *_page_range_args(first_page, last_page), pdf_file],
+            capture_output=True, timeout=60, check=True, text=True
+        )
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    areas = {}
+    for row in completed.stdout.splitlines():
+        # page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+        columns = row.split()
+        if len(columns) < 14 or not columns[0].isdigit() or columns[2] != "image":
+            continue
+        try:
+            width = int(columns[3]) / float(columns[12]) * 72
+            height = int(columns[4]) / float(columns[13]) * 72
+        except (ValueError, ZeroDivisionError):
+            continue
+        areas[int(columns[0])] = areas.get(int(columns[0]), 0.0) + width * height
+    return areas
+
+
+def _text_layer_coverage(words: list, page_width: float, page_height: float) -> float:
+    covered = sum(word["width"] * word["height"] for word in words)
+    return min(1.0, covered / (page_width * page_height or 1))
+
 
+def pdf_text_layer(pdf_file, dpi: int, first_page=1, last_page=None) -> dict:
+    # Returns {page_num: page results} for the pages (of first_page to last_page) with a usable
+    # embedded text layer, with word boxes scaled to the pixel grid the page would have been
+    # rasterized at. Uses poppler's pdftotext, which is installed alongside pdftoppm.
+    try:
+        completed = subprocess.run(
+            [
+                "pdftotext", "-bbox-layout", "-enc", "UTF-8",
+                *_page_range_args(first_page, last_page), pdf_file, "-"
+            ],
+            capture_output=True, timeout=120, check=True
+        )
+        doc = ET.fromstring(completed.stdout)
+    except (OSError, subprocess.SubprocessError, ET.ParseError):
+        return {}
+
+    scale = dpi / 72.0
+    pages = {}
+    image_areas = None
+    body = _xml_children(doc, "body")
+    doc_pages = _xml_children(_xml_children(body[0], "doc")[0], "page") if body else []
+    for page_num, page in enumerate(doc_pages, start=first_page):
+        words = []
+        text = []
+        block_num = 0
+        for flow in _xml_children(page, "flow"):
+            block_num += 1
+            for par_num, block in enumerate(_xml_children(flow, "block"), start=1):
+                for line_num, line in enumerate(_xml_children(block, "line"), start=1):
+                    line_words = []
+                    for word_num, word in enumerate(_xml_children(line, "word"), start=1):
+                        word_text = (word.text or "").strip()
+                        if not word_text:
+                            continue
+                        x_min, y_min = float(word.get("xMin")), float(word.get("yMin"))
+                        x_max, y_max = float(word.get("xMax")), float(word.get("yMax"))
+                        words.append({
+                            "level": 5, "page_num": 1, "block_num": block_num, "par_num": par_num,
+                            "line_num": line_num, "word_num": word_num,
+                            "left": round(x_min * scale), "top": round(y_min * scale),
+                            "width": round((x_max - x_min) * scale),
+                            "height": round((y_max - y_min) * scale),
+                            "conf": 100.0, "text": word_text
+                        })
+                        line_words.append(word_text)
+                    if line_words:
+                        text.append(" ".join(line_words) + "\n")
+                # Blank line after each paragraph, like Tesseract's text output
+                if text and text[-1] != "\n":
+                    text.append("\n")
+        if not _usable_text_layer(words):
+            continue
+        width, height = float(page.get("width")), float(page.get("height"))
+        if image_areas is None:
+            # Only listed once some page has text worth checking
+            image_areas = pdf_image_coverage(pdf_file, first_page, last_page)
+        if (image_areas.get(page_num, 0) >= width * height / 2
+                and _text_layer_coverage(words, width * scale, height * scale)
+                < app.config["PDF_TEXT_LAYER_MIN_COVERAGE"]):
+            continue
+        pages[page_num] = {
+            "text": "".join(text),
+            "ocr_data": words,
+            "image_width": round(width * scale),
+            "image_height": round(height * scale),
+            "text_source": "pdf_text_layer"
+        }
+    return pages
+
+
+def _words_text(words: list) -> str:
+    # Plain text of word boxes in reading order: a line per line, a blank line after each paragraph
+    text = []
+    previous = None
+    for word in words:
+        line = (word["block_num"], word["par_num"], word["line_num"])
+        if previous is not None:
+            text.append(" " if line == previous else "\n" if line[:2] == previous[:2] else "\n\n")
+        text.append(word["text"])
+        previous = line
+    return ("".join(text) + "\n\n") if text else ""
+
+
+def _crop_text_layer_page(page_results: dict, box: tuple) -> dict:
+    # The words of a text-layer page whose centre falls inside the crop, and their text
+    left, top, right, bottom = box
+    words = [
+        word for word in page_results["ocr_data"]
+        if left <= word["left"] + word["width"] / 2 < right
+        and top <= word["top"] + word["height"] / 2 < bottom
+    ]
+    return {
+        **page_results, "text": _words_text(words), "ocr_data": words,
+        "crop": [left, top, right - left, bottom - top]
+    }
+
+
+def pdf_to_text(pdf_file_path: str, language="en", output_formats=(), render_options=None,
+                use_text_layer=False, ocr_data_format="records", region=None) -> list:
+    # Returns a list of {"page_num", "text", "ocr_data", ...} dicts, one per page. region
+    # ({"pages", "crop"}, see _region_options) limits the work to some pages or a part of each.
+    pages, crop = (region["pages"], region["crop"]) if region else (None, None)
+    render_options = render_options or _pdf_render_options({})
+    page_numbers = _select_pages(pages, pdf_page_count(pdf_file_path)) if pages or crop else None
+    page_sizes = crop_boxes = {}
+    if crop:
+        page_sizes = pdf_page_sizes(pdf_file_path, page_numbers, render_options["dpi"])
+        crop_boxes = {page_num: _crop_box(crop, *page_sizes[page_num]) for page_num in page_numbers}
+
+    def ocr_page(numbered_page):
+        page_num, page = numbered_page
+        try:
+            page_ocr_results = _get_ocr_data(page, language, output_formats, ocr_data_format)
+        finally:
+            _release_page(page)
+        if page_num in crop_boxes:
+            _apply_crop(page_ocr_results, crop_boxes[page_num], page_sizes[page_num])
+        return {"text": page_ocr_results["text"], **_page_entry(page_num, page_ocr_results)}
+
+    # hOCR/ALTO only come out of Tesseract, so those requests OCR every page
+    if not use_text_layer or output_formats:
+        pages = pdf_to_img(pdf_file_path, page_numbers, render_options, crop_boxes)
+        return list(_map_pages(ocr_page, pages))
 
-def pdf_to_text(pdf_file_path: str, language="en") -> str:
-    # This function now needs to return a list of {"text": ..., "ocr_data": ...} per page
+    with _stage_timer("decode"):
+        # Only the span of the selected pages is extracted
+        span = (min(page_numbers), max(page_numbers)) if page_numbers else ()
+        text_layer = pdf_text_layer(pdf_file_path, render_options["dpi"], *span)
+    page_numbers = page_numbers or range(1, pdf_page_count(pdf_file_path) + 1)
+    # Only the pages without a text layer are rasterized and OCR'd
+    ocr_results = _map_pages(
+        ocr_page,
+        pdf_to_img(
+            pdf_file_path, [n for n in page_numbers if n not in text_layer], render_options,
+            crop_boxes
+        )
+    )
     all_page_results = []
-    images = pdf_to_img(pdf_file_path)
-    for _pg, img in enumerate(images):
-        page_ocr_results = _get_ocr_data(img, language)
-        all_page_results.append({
-            "page_num": _pg + 1,
-            "text": page_ocr_results["text"],
-            "ocr_data": page_ocr_results["ocr_data"],
-            "image_width": page_ocr_results["image_width"],
-            "image_height": page_ocr_results["image_height"]
-        })
-    return all_page_results # Returns a list of dictionaries per page
+    for page_num in page_numbers:
+        if page_num in text_layer:
+            page_results = text_layer[page_num]
+            if page_num in crop_boxes:
+                page_results = _crop_text_layer_page(page_results, crop_boxes[page_num])
+            if ocr_data_format == "columns":
+                page_results = {
+                    **page_results, "ocr_data": _ocr_data_columns(page_results["ocr_data"])
+                }
+            all_page_results.append(
+                {"text": page_results["text"], **_page_entry(page_num, page_results)}
+            )
+        else:
+            all_page_results.append(next(ocr_results))
+    return all_page_results
 
 
-def get_languages() -> dict:
-    languages = {}
-    alpha3codes = pytesseract.get_languages()
-    for code in alpha3codes:
-        language = Language.get(code)
+def image_frames(image: Image, page_numbers=None):
+    # Lazily yields (page_num, frame) for the frames of a multi-frame image (TIFF, GIF, WebP),
+    # or only those in page_numbers. Each frame is decoded into its own image when it is
+    # reached, so memory stays bounded like PDF chunks.
+    if page_numbers is None:
+        page_numbers = range(1, image.n_frames + 1)
+    for page_num in page_numbers:
+        with _stage_timer("decode"):
+            image.seek(page_num - 1)
+            page = image.copy()
+        yield page_num, page
+
+
+def image_to_text(image: Image, language="en", output_formats=(), ocr_data_format="records",
+                  preprocess=None, region=None) -> list:
+    # Returns a list of {"page_num", "text", "ocr_data", ...} dicts, one per frame
+    pages, crop = (region["pages"], region["crop"]) if region else (None, None)
+
+    def ocr_page(numbered_page):
+        page_num, page = numbered_page
+        try:
+            page_ocr_results = _ocr_image(
+                page, language, output_formats, ocr_data_format, preprocess, crop
+            )
+        finally:
+            _release_page(page)
+        return {"text": page_ocr_results["text"], **_page_entry(page_num, page_ocr_results)}
+
+    page_numbers = _select_pages(pages, image.n_frames) if pages else None
+    return list(_map_pages(ocr_page, image_frames(image, page_numbers)))
+
+
+def _input_digest(data, path: str) -> str:
+    return hashlib.sha256(data).hexdigest() if data is not None else _file_digest(path)
 
-        languages[language.language] = language.autonym()
-    return languages
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _traineddata_stamps(lang_code: str) -> list:
+    # [code, size, mtime] of each traineddata file a Tesseract language code uses, so that
+    # installing a different model changes the cache key of results made with the old one
+    try:
+        tessdata = _cached_tesseract_info("languages", _probe_languages)["tessdata"]
+    except pytesseract.TesseractNotFoundError:
+        return []
+    stamps = []
+    for code in lang_code.split("+"):
+        try:
+            stat = os.stat(os.path.join(tessdata, f"{code}.traineddata"))
+        except OSError:
+            continue
+        stamps.append([code, stat.st_size, stat.st_mtime_ns])
+    return stamps
+
+
+def _ocr_engine_params(language: str, output_formats: list) -> dict:
+    # What produced a result besides the request's options: results of another Tesseract
+    # version, engine or model aren't reused
+    extensions = ["txt", "tsv"] + [OCR_OUTPUT_FORMATS[name] for name in output_formats]
+    return {
+        "tesseract_version": get_tesseract_version_string(),
+        "engine": "tesserocr" if _use_tesserocr(extensions) else "subprocess",
+        "traineddata": _traineddata_stamps(langcodes.Language.get(language).to_alpha3()),
+    }
+
+
+def _result_cache_key(file_digest: str, params: dict) -> str:
+    encoded_params = json.dumps(params, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(file_digest.encode("ascii") + b"\0" + encoded_params).hexdigest()
+
+
+def _result_cache_path(key: str) -> str:
+    return os.path.join(app.config["OCR_CACHE_DIR"], key[:2], f"{key}.json.gz")
+
+
+def _result_cache_get(key: str):
+    with _RESULT_CACHE_LOCK:
+        entry = _RESULT_CACHE.get(key)
+        if entry is not None:
+            _RESULT_CACHE.move_to_end(key)
+    value = entry[0] if entry is not None else None
+    if value is None and app.config["OCR_CACHE_DIR"]:
+        entry = _result_cache_disk_get(key)
+        if entry is not None:
+            value = entry[0]
+            _result_cache_remember(key, *entry)
+            _count_metric("ocr_cache_lookups_total", result="disk")
+            return value
+    _count_metric("ocr_cache_lookups_total", result="memory" if value is not None else "miss")
+    return value
+
+
+def _result_cache_disk_get(key: str):
+    # (result, serialized size), the size being what the memory tier budgets by
+    path = _result_cache_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > app.config["OCR_CACHE_DIR_MAX_AGE"]:
+            os.remove(path)
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            encoded = f.read()
+        return json.loads(encoded), len(encoded)
+    except (OSError, ValueError):
+        return None
+
+
+def _result_cache_remember(key: str, value: dict, size: int):
+    # size is the entry's serialized length, a stand-in for the memory it holds
+    max_bytes = app.config["OCR_CACHE_MAX_BYTES"]
+    if max_bytes and size > max_bytes:
+        return
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = (value, size)
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > app.config["OCR_CACHE_SIZE"]:
+            _RESULT_CACHE.popitem(last=False)
+        if max_bytes:
+            total = sum(entry_size for _, entry_size in _RESULT_CACHE.values())
+            while total > max_bytes:
+                total -= _RESULT_CACHE.popitem(last=False)[1][1]
+
+
+def _result_cache_put(key: str, value: dict):
+    # Serialized once, to size the memory entry and to write the disk one
+    encoded = json.dumps(value)
+    _result_cache_remember(key, value, len(encoded))
+    if not app.config["OCR_CACHE_DIR"]:
+        return
+    path = _result_cache_path(key)
+    temp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so other workers never read a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            f.write(encoded)
+        os.replace(temp_path, path)
+    except OSError:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _image_output_mode(file_input: dict) -> str:
+    mode = file_input.get("image_output") or app.config["IMAGE_OUTPUT"]
+    if mode not in IMAGE_OUTPUT_MODES:
+        raise ValueError(
+            f"Unsupported image_output '{mode}'. Supported: {', '.join(IMAGE_OUTPUT_MODES)}"
+        )
+    return mode
+
+
+def _artifact_expired(path: str) -> bool:
+    return time.time() - os.path.getmtime(path) > app.config["ARTIFACT_MAX_AGE"]
+
+
+def _sweep_artifacts():
+    # Remove expired artifacts, then the least recently produced ones while over the disk quota.
+    # Only names this module writes are touched.
+    now = time.time()
+    kept = []
+    with os.scandir(app.config["UPLOAD_FOLDER"]) as entries:
+        for entry in entries:
+            name = entry.name
+            if not (ARTIFACT_NAME.fullmatch(name) or LEGACY_ARTIFACT_NAME.fullmatch(name)):
+                continue
+            try:
+                stat = entry.stat()
+                if now - stat.st_mtime > app.config["ARTIFACT_MAX_AGE"]:
+                    os.remove(entry.path)
+                else:
+                    kept.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                pass  # Removed by another worker
+    total = sum(size for _, size, _ in kept)
+    max_bytes = app.config["ARTIFACT_MAX_BYTES"]
+    for _, size, path in sorted(kept):
+        if not max_bytes or total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _artifact_sweeper():
+    while True:
+        try:
+            _sweep_artifacts()
+        except OSError:
+            pass
+        time.sleep(app.config["ARTIFACT_SWEEP_INTERVAL"])
+
+
+def _ensure_artifact_sweeper():
+    # One sweeper per process; a forked worker starts its own
+    with _ARTIFACT_SWEEPER_LOCK:
+        if _ARTIFACT_SWEEPER["pid"] == os.getpid():
+            return
+        thread = threading.Thread(target=_artifact_sweeper, name="artifact-sweeper", daemon=True)
+        thread.start()
+        _ARTIFACT_SWEEPER.update(pid=os.getpid(), thread=thread)
+
+
+def _artifact_url(name: str) -> str:
+    _ensure_artifact_sweeper()
+    return f"/api/artifacts/{name}"
+
+
+def _store_artifact(name: str, write) -> str:
+    # Stores a content-addressed file once (write(path) produces it) and returns its URL;
+    # producing it again only renews its expiry.
+    path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        fd, temp_path = tempfile.mkstemp(dir=app.config["UPLOAD_FOLDER"], suffix=".tmp")
+        os.close(fd)
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return _artifact_url(name)
+
+
+def _store_file_artifact(name: str, filepath: str, owned: bool) -> str:
+    # Like _store_artifact for an existing file: a temp file of ours is moved into place. A
+    # caller's file is copied, never linked, so renewing the artifact's expiry can't touch the
+    # caller's mtime and later edits to their file can't change the artifact.
+    path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+    if owned and not os.path.exists(path):
+        try:
+            os.replace(filepath, path)
+            os.utime(path)
+            return _artifact_url(name)
+        except OSError:
+            pass
+    return _store_artifact(name, lambda temp_path: shutil.copyfile(filepath, temp_path))
+
+
+def _store_image_artifact(data, filepath: str, file_extension: str, digest: str, mode: str,
+                          owned: bool) -> str:
+    # The image is either in memory (data) or at filepath
+    if mode == "url":
+        name = f"img_{digest}.{file_extension}"
+        if data is None:
+            return _store_file_artifact(name, filepath, owned)
+        return _store_artifact(name, lambda path: pathlib.Path(path).write_bytes(data))
+
+    size = app.config["THUMBNAIL_SIZE"]
+
+    def write_thumbnail(path):
+        with Image.open(filepath if data is None else io.BytesIO(data)) as image:
+            image.thumbnail((size, size))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(path, "JPEG", quality=85)
+
+    return _store_artifact(f"thumb_{digest}_{size}.jpg", write_thumbnail)
+
+
+def _spool_input(chunks, suffix: str):
+    # Collects an input's bytes in memory, moving them to a temp file once they pass
+    # UPLOAD_SPOOL_THRESHOLD (or straight away for PDFs). Returns (data, path), one of them None.
+    threshold = -1 if suffix == ".pdf" else app.config["UPLOAD_SPOOL_THRESHOLD"]
+    buffered, size = [], 0
+    temp_file = None
+    try:
+        for chunk in itertools.chain(chunks, [b""]):
+            if temp_file is None and size + len(chunk) > threshold:
+                temp_file = tempfile.NamedTemporaryFile(
+                    delete=False, suffix=suffix, dir=app.config["UPLOAD_FOLDER"]
+                )
+                temp_file.writelines(buffered)
+                buffered = None
+            if temp_file is None:
+                buffered.append(chunk)
+                size += len(chunk)
+            else:
+                temp_file.write(chunk)
+    except BaseException:
+        if temp_file is not None:
+            temp_file.close()
+            os.remove(temp_file.name)
+        raise
+    if temp_file is None:
+        return b"".join(buffered), None
+    temp_file.close()
+    return None, temp_file.name
+
+
+def _fetch_session():
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    settings = (
+        app.config["FETCH_RETRIES"], app.config["FETCH_BACKOFF"], app.config["FETCH_POOL_SIZE"]
+    )
+    session = getattr(_FETCH_LOCAL, "session", None)
+    if session is None or _FETCH_LOCAL.settings != settings or _FETCH_LOCAL.pid != os.getpid():
+        retries, backoff, pool_size = settings
+        retry = Retry(
+            total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",), raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _FETCH_LOCAL.session, _FETCH_LOCAL.settings = session, settings
+        _FETCH_LOCAL.pid = os.getpid()
+    return session
+
+
+def _fetch_url(url: str) -> dict:
+    # Downloads a URL input into memory or a temp file (see _spool_input);
+    # returns {"data", "path", "suffix", "seconds"}
+    started = time.perf_counter()
+    max_bytes = app.config["FETCH_MAX_BYTES"]
+    timeout = (app.config["FETCH_CONNECT_TIMEOUT"], app.config["FETCH_READ_TIMEOUT"])
+    with _fetch_session().get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+
+        suffix = pathlib.Path(urllib.parse.urlparse(url).path).suffix.lower()
+        if not suffix: # try to guess from content type if no suffix
+            content_type = response.headers.get('Content-Type')
+            if content_type and 'pdf' in content_type:
+                suffix = '.pdf'
+            elif content_type and 'image' in content_type:
+                suffix = '.png' # Default to png if image
+
+        too_large = ValueError(f"Download exceeds the maximum size of {max_bytes} bytes")
+        if int(response.headers.get("Content-Length") or 0) > max_bytes:
+            raise too_large
+        # The read timeout only bounds the wait for each chunk;
+        # a server trickling bytes is cut off here
+        deadline = started + app.config["FETCH_TOTAL_TIMEOUT"]
+
+        def chunks():
+            received = 0
+            for chunk in response.iter_content(chunk_size=65536):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise too_large
+                if time.perf_counter() > deadline:
+                    raise ValueError(
+                        f"Download took longer than {app.config['FETCH_TOTAL_TIMEOUT']:g} seconds"
+                    )
+                yield chunk
+
+        data, path = _spool_input(chunks(), suffix)
+    return {"data": data, "path": path, "suffix": suffix, "seconds": time.perf_counter() - started}
+
+
+def _ocr_file(filepath, file_extension: str, language: str, output_formats: list,
+              render_options: dict, use_text_layer: bool, ocr_data_format: str = "records",
+              preprocess=None, region=None) -> dict:
+    # Returns {"text", "ocr_data"} for a PDF on disk, or an image on disk or in a file object
+    if file_extension == "pdf":
+        # pdf_to_text returns list of dicts per page
+        page_results = pdf_to_text(
+            filepath, language, output_formats, render_options, use_text_layer, ocr_data_format,
+            region
+        )
+    else:
+        with _stage_timer("decode"):
+            image_obj = Image.open(filepath)
+            # Multi-page TIFFs (faxes, scans) and animated
+            # GIF/WebP are OCR'd frame by frame as pages
+            multi_frame = getattr(image_obj, "is_animated", False)
+            if not multi_frame:
+                image_obj.load()
+        if not multi_frame:
+            if region and region["pages"]:
+                _select_pages(region["pages"], 1)  # rejects ranges that leave out the only page
+            crop = region["crop"] if region else None
+            image_ocr_results = _ocr_image(
+                image_obj, language, output_formats, ocr_data_format, preprocess, crop
+            )
+            # Wrap in list for consistency
+            return {
+                "text": image_ocr_results["text"], "ocr_data": [_page_entry(1, image_ocr_results)]
+            }
+        page_results = image_to_text(
+            image_obj, language, output_formats, ocr_data_format, preprocess, region
+        )
+
+    full_text = []
+    all_ocr_data = []
+    for page_res in page_results:
+        full_text.append(page_res.pop("text"))
+        all_ocr_data.append(page_res)
+    return {"text": "\n".join(full_text), "ocr_data": all_ocr_data}
+
+
+def get_languages() -> dict:
+    return _cached_tesseract_info("languages", _probe_languages)["languages"]
 
 
 # NEW: Helper function to process a single OCR task (used by both sync and async)
-def _process_single_ocr_task(file_input: dict, job_id: str = None) -> dict:
+def _process_single_ocr_task(file_input: dict, job_id: str = None,
+                             owns_filepath: bool = False) -> dict:
+    # owns_filepath hands a "filepath" input over to the task (a temp file of the caller's): it is
+    # moved into the artifacts or deleted like our own temp files, instead of copied and left alone
     result = {
         "filename": file_input.get("filename", "unknown_file"),
         "source": file_input.get("url", "base64_data"),
@@ -123,99 +1620,125 @@ def _process_single_ocr_task(file_input: dict, job_id: str = None) -> dict:
         "text": None,
         "error": None,
         "image_base64": None,
+        "cache_hit": False,
         "ocr_data": [] # Moved to end
     }
     temp_filepath = None
+    owned = owns_filepath or "filepath" not in file_input
+    data = None  # The input's bytes while it is small enough to stay in memory
+    suffix = ""
     start_time = datetime.datetime.now()
+    # Seconds per stage for /metrics, added to by _stage_timer here and in the page threads
+    stage_seconds = {}
+    stage_context = _STAGE_SECONDS.set(stage_seconds)
 
     try:
         language = file_input.get("language", "en")
+        output_formats = _parse_output_formats(file_input.get("output_formats"))
 
         # Handle direct filepath if provided (for internal sync calls)
         if "filepath" in file_input:
             temp_filepath = file_input["filepath"]
             result["source"] = f"filepath://{temp_filepath}"
             result["filename"] = file_input.get("filename", pathlib.Path(temp_filepath).name)
+            suffix = pathlib.Path(temp_filepath).suffix.lower()
+
+        elif "data" in file_input:
+            # Bytes of an upload already read into memory (for internal sync calls)
+            result["filename"] = secure_filename(file_input.get("filename", "upload"))
+            result["source"] = "upload"
+            suffix = pathlib.Path(result["filename"]).suffix.lower()
+            data, temp_filepath = _spool_input([file_input["data"]], suffix)
 
         elif "url" in file_input:
             url = file_input["url"]
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            
-            suffix = pathlib.Path(url).suffix.lower()
-            if not suffix: # try to guess from content type if no suffix
-                content_type = response.headers.get('Content-Type')
-                if content_type and 'pdf' in content_type:
-                    suffix = '.pdf'
-                elif content_type and 'image' in content_type:
-                    suffix = '.png' # Default to png if image
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=app.config["UPLOAD_FOLDER"]) as temp_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    temp_file.write(chunk)
-                temp_filepath = temp_file.name
-            result["filename"] = secure_filename(pathlib.Path(url).name) # Use URL's name for result
+            # Async jobs start downloads ahead of OCR (see _PrefetchWindow)
+            prefetch = file_input.get("prefetch")
+            fetched = prefetch() if prefetch is not None else _fetch_url(url)
+            data, temp_filepath, suffix = fetched["data"], fetched["path"], fetched["suffix"]
+            stage_seconds["download"] = fetched["seconds"]
+            # Use URL's name for result
+            result["filename"] = secure_filename(pathlib.Path(urllib.parse.urlparse(url).path).name)
             result["source"] = url
             
         elif "base64" in file_input and "filename" in file_input:
             encoded_data = file_input["base64"]
-            decoded_data = base64.b64decode(encoded_data)
+            with _stage_timer("decode"):
+                decoded_data = base64.b64decode(encoded_data)
             
             filename = secure_filename(file_input["filename"])
             suffix = pathlib.Path(filename).suffix.lower()
             
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=app.config["UPLOAD_FOLDER"]) as temp_file:
-                temp_file.write(decoded_data)
-                temp_filepath = temp_file.name
+            data, temp_filepath = _spool_input([decoded_data], suffix)
             result["filename"] = filename
             result["source"] = "base64_data"
         else:
             raise ValueError("Invalid file input: must contain 'filepath', 'url', or 'base64' with 'filename'")
 
-        if not temp_filepath:
+        if not temp_filepath and data is None:
             raise ValueError("No file path determined for OCR processing.")
 
-        file_extension = pathlib.Path(temp_filepath).suffix.lower().lstrip('.')
+        file_extension = suffix.lstrip('.')
         if file_extension not in app.config["SUPPORTED_FORMATS"]:
             raise ValueError("File format not supported")
 
-        if file_extension == "pdf":
-            # pdf_to_text now returns list of dicts per page
-            page_results = pdf_to_text(temp_filepath, language) 
-            full_text = []
-            all_ocr_data = []
-            for page_res in page_results:
-                full_text.append(page_res["text"])
-                all_ocr_data.append({
-                    "page_num": page_res["page_num"], 
-                    "ocr_data": page_res["ocr_data"],
-                    "image_width": page_res["image_width"],
-                    "image_height": page_res["image_height"]
-                })
-            result["text"] = "\n".join(full_text)
-            result["ocr_data"] = all_ocr_data
-            
-            # For PDF, move the temporary file to a permanent name in static/uploads for frontend display
-            # We use a unique prefix to avoid collisions
-            unique_filename = f"ocr_{uuid.uuid4().hex}_{result['filename']}"
-            permanent_filepath = os.path.join(app.config["UPLOAD_FOLDER"], unique_filename)
-            shutil.copy(temp_filepath, permanent_filepath)
-            result["source"] = f"/static/uploads/{unique_filename}"
-            
-        else:
-            image_obj = Image.open(temp_filepath)
-            image_ocr_results = _get_ocr_data(image_obj, language)
-            result["text"] = image_ocr_results["text"]
-            result["ocr_data"] = [{
-                "page_num": 1, 
-                "ocr_data": image_ocr_results["ocr_data"],
-                "image_width": image_ocr_results["image_width"],
-                "image_height": image_ocr_results["image_height"]
-            }] # Wrap in list for consistency
-
-            # Convert image to base64 for frontend display
-            with open(temp_filepath, "rb") as image_file:
-                encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
+        render_options = _pdf_render_options(file_input)
+        use_text_layer = _bool_option(
+            file_input.get("use_text_layer", app.config["PDF_USE_TEXT_LAYER"])
+        )
+        image_output = _image_output_mode(file_input)
+        ocr_data_format = _ocr_data_format(file_input)
+        preprocess = _preprocess_options(file_input)
+        region = _region_options(file_input)
+
+        digest = cache_key = None
+        if app.config["OCR_CACHE_SIZE"] > 0:
+            lookup_start = time.perf_counter()
+            digest = _input_digest(data, temp_filepath)
+            cache_key = _result_cache_key(digest, {
+                "format": file_extension,
+                "language": language,
+                "output_formats": output_formats,
+                "dpi": render_options["dpi"],
+                "grayscale": render_options["grayscale"],
+                "use_pdftocairo": render_options["use_pdftocairo"],
+                "use_text_layer": use_text_layer,
+                "ocr_data_format": ocr_data_format,
+                "preprocess": preprocess,
+                "region": region,
+                **_ocr_engine_params(language, output_formats),
+            })
+            ocr_results = _result_cache_get(cache_key)
+            result["cache_hit"] = ocr_results is not None
+            result["cache_lookup_time"] = f"{(time.perf_counter() - lookup_start) * 1000:.2f}ms"
+        if not result["cache_hit"]:
+            ocr_results = _ocr_file(
+                temp_filepath if data is None else io.BytesIO(data), file_extension, language,
+                output_formats, render_options, use_text_layer, ocr_data_format, preprocess, region
+            )
+            if cache_key:
+                _result_cache_put(cache_key, ocr_results)
+        result["text"] = ocr_results["text"]
+        result["ocr_data"] = ocr_results["ocr_data"]
+
+        with _stage_timer("serialize"):
+            if file_extension == "pdf":
+                # Keep the PDF for the frontend's preview, stored once per content
+                digest = digest or _input_digest(data, temp_filepath)
+                result["source"] = _store_file_artifact(f"ocr_{digest}.pdf", temp_filepath, owned)
+
+            elif image_output != "base64":
+                # Link a stored copy (or preview) instead of inlining the file in the response
+                result["image_url"] = _store_image_artifact(
+                    data, temp_filepath, file_extension,
+                    digest or _input_digest(data, temp_filepath), image_output, owned
+                )
+
+            else:
+                # Convert image to base64 for frontend display
+                if data is None:
+                    data = pathlib.Path(temp_filepath).read_bytes()
+                encoded_image = base64.b64encode(data).decode('utf-8')
                 result["image_base64"] = f"data:image/{file_extension};base64,{encoded_image}"
 
     except pytesseract.TesseractNotFoundError:
@@ -227,7 +1750,14 @@ def _process_single_ocr_task(file_input: dict, job_id: str = None) -> dict:
     except Exception as e:
         result["error"] = f"An unexpected error occurred: {e}"
     finally:
-        if temp_filepath and os.path.exists(temp_filepath) and "filepath" not in file_input: # Only delete if we created it
+        _STAGE_SECONDS.reset(stage_context)
+        file_extension = suffix.lstrip(".")
+        _record_file_metrics(
+            result,
+            file_extension if file_extension in app.config["SUPPORTED_FORMATS"] else "other",
+            stage_seconds
+        )
+        if temp_filepath and os.path.exists(temp_filepath) and owned: # Only delete if we own it
             os.remove(temp_filepath)
         
         end_time = datetime.datetime.now()
@@ -239,28 +1769,450 @@ def _process_single_ocr_task(file_input: dict, job_id: str = None) -> dict:
     
     return result
 
+
+def _result_summary(result: dict) -> dict:
+    summary = {key: result[key] for key in RESULT_SUMMARY_KEYS if key in result}
+    summary["page_count"] = len(result.get("ocr_data") or [])
+    return summary
+
+
+class _PrefetchWindow:
+    """Downloads the URL inputs of one async job on the shared fetch pool.
+
+    Downloads start in input order and stay at most FETCH_PREFETCH_WINDOW files ahead of
+    the OCR tasks taking them, so a job with many URLs doesn't hold all of them at once.
+    """
+
+    def __init__(self, urls: list):
+        # urls: [(file index, url)] in input order
+        self.executor = _get_executor("fetch", app.config["FETCH_WORKERS"])
+        self.size = max(1, app.config["FETCH_PREFETCH_WINDOW"])
+        self.lock = threading.Lock()
+        self.waiting = collections.deque(urls)
+        self.started = {}
+        with self.lock:
+            self._fill()
+
+    def _fill(self):
+        # Called with the lock held
+        while self.waiting and len(self.started) < self.size:
+            index, url = self.waiting.popleft()
+            self.started[index] = self.executor.submit(_fetch_url, url)
+
+    def take(self, index: int, url: str) -> dict:
+        # The download of file index for its OCR task; fetched
+        # right away if the window hadn't reached it
+        with self.lock:
+            future = self.started.pop(index, None)
+            if future is None:
+                self.waiting = collections.deque(item for item in self.waiting if item[0] != index)
+            self._fill()
+        return future.result() if future is not None else _fetch_url(url)
+
+    def close(self):
+        # Starts no more downloads; those no OCR task took are removed once they finish
+        with self.lock:
+            self.waiting.clear()
+            futures, self.started = list(self.started.values()), {}
+        for future in futures:
+            if not future.cancel():
+                future.add_done_callback(self._discard)
+
+    @staticmethod
+    def _discard(future):
+        if future.exception() is None:
+            path = future.result()["path"]
+            if path and os.path.exists(path):
+                os.remove(path)
+
+
+def _prefetch_urls(files_payload: list):
+    # Each URL entry gets a "prefetch" callable returning its
+    # download; returns the entries and their window
+    urls = [
+        (index, file_input["url"]) for index, file_input in enumerate(files_payload)
+        if "url" in file_input and "filepath" not in file_input
+    ]
+    window = _PrefetchWindow(urls)
+    entries = list(files_payload)
+    for index, url in urls:
+        entries[index] = {
+            **files_payload[index], "prefetch": functools.partial(window.take, index, url)
+        }
+    return entries, window
+
+
 # NEW: Background worker function
 def _process_ocr_job(job_id, files_payload):
-    OCR_JOBS[job_id]["status"] = JOB_STATUS["IN_PROGRESS"]
-    all_results = []
+    JOB_STORE.update(
+        job_id, status=JOB_STATUS["IN_PROGRESS"], total_files=len(files_payload), completed_files=0
+    )
+    files_payload, prefetch_window = _prefetch_urls(files_payload)
+    all_results = [None] * len(files_payload)
+    completed_files = 0
     job_overall_start_time = datetime.datetime.now()
+    final_fields = {}
+    futures = {}
 
     try:
-        for file_input in files_payload:
-            single_file_result = _process_single_ocr_task(file_input, job_id)
-            all_results.append(single_file_result)
-        
-        OCR_JOBS[job_id]["results"] = all_results
-        OCR_JOBS[job_id]["status"] = JOB_STATUS["COMPLETED"]
+        workers = app.config["JOB_FILE_WORKERS"]
+        if workers <= 1:
+            for index, file_input in enumerate(files_payload):
+                all_results[index] = _process_single_ocr_task(file_input, job_id)
+                completed_files += 1
+                JOB_STORE.update(job_id, completed_files=completed_files)
+        else:
+            # Fan the files out on the shared pool and keep the results in input order
+            executor = _get_executor("file", workers)
+            futures = {
+                executor.submit(_process_single_ocr_task, file_input, job_id): index
+                for index, file_input in enumerate(files_payload)
+            }
+            for future in as_completed(futures):
+                all_results[futures[future]] = future.result()
+                completed_files += 1
+                JOB_STORE.update(job_id, completed_files=completed_files)
+
+        final_fields = {
+            "results": all_results,
+            "result_summaries": [_result_summary(result) for result in all_results],
+            "status": JOB_STATUS["COMPLETED"]
+        }
     except Exception as e:
-        OCR_JOBS[job_id]["status"] = JOB_STATUS["FAILED"]
-        OCR_JOBS[job_id]["error"] = f"Job processing failed: {e}"
+        final_fields = {"status": JOB_STATUS["FAILED"], "error": f"Job processing failed: {e}"}
+        for future in futures:
+            future.cancel()
     finally:
+        prefetch_window.close()
         job_overall_end_time = datetime.datetime.now()
         job_overall_duration = (job_overall_end_time - job_overall_start_time).total_seconds() * 1000
-        OCR_JOBS[job_id]["overall_start_time"] = job_overall_start_time.isoformat()
-        OCR_JOBS[job_id]["overall_end_time"] = job_overall_end_time.isoformat()
-        OCR_JOBS[job_id]["overall_duration"] = f"{job_overall_duration:.2f}ms"
+        JOB_STORE.update(
+            job_id,
+            overall_start_time=job_overall_start_time.isoformat(),
+            overall_end_time=job_overall_end_time.isoformat(),
+            overall_duration=f"{job_overall_duration:.2f}ms",
+            **final_fields
+        )
+
+
+def _job_worker(stop: threading.Event):
+    while not stop.is_set():
+        # Re-read JOB_STORE each time round so a reconfigured store is picked up
+        claimed = JOB_STORE.claim(timeout=1.0)
+        if claimed is None:
+            continue
+        job_id, files_payload = claimed
+        with _JOB_SCHEDULER_LOCK:
+            _JOB_SCHEDULER["active"] += 1
+        started = time.monotonic()
+        try:
+            _process_ocr_job(job_id, files_payload)
+        finally:
+            elapsed = time.monotonic() - started
+            with _JOB_SCHEDULER_LOCK:
+                _JOB_SCHEDULER["active"] -= 1
+                average = _JOB_SCHEDULER["avg_job_seconds"]
+                _JOB_SCHEDULER["avg_job_seconds"] = (
+                    elapsed if average is None else 0.8 * average + 0.2 * elapsed
+                )
+
+
+def _ensure_job_workers():
+    # Threads don't survive a fork, so a process that inherited the scheduler state
+    # (gunicorn preload) starts its own workers.
+    with _JOB_SCHEDULER_LOCK:
+        if _JOB_SCHEDULER["pid"] != os.getpid():
+            _JOB_SCHEDULER.update(pid=os.getpid(), workers=[], active=0, stop=threading.Event())
+        workers = _JOB_SCHEDULER["workers"]
+        while len(workers) < max(1, app.config["JOB_WORKERS"]):
+            worker = threading.Thread(
+                target=_job_worker, args=(_JOB_SCHEDULER["stop"],), name=f"ocr-job-{len(workers)}",
+                daemon=True
+            )
+            worker.start()
+            workers.append(worker)
+
+
+def _stop_job_workers(timeout=None):
+    # Workers finish their current job and exit; the next submission starts a fresh pool
+    with _JOB_SCHEDULER_LOCK:
+        workers = _JOB_SCHEDULER["workers"]
+        _JOB_SCHEDULER["stop"].set()
+        _JOB_SCHEDULER.update(workers=[], stop=threading.Event())
+    for worker in workers:
+        worker.join(timeout)
+
+
+def _submit_job(job: dict, files_payload) -> bool:
+    # Stores and queues the job for the worker pool; False when the queue is full
+    if not JOB_STORE.create(job, files_payload, app.config["JOB_QUEUE_SIZE"]):
+        return False
+    _ensure_job_workers()
+    return True
+
+
+def _job_queue_estimate(job_id=None) -> dict:
+    # Queue position (1 = next to run) and a rough ETA from the recent average job duration
+    position = JOB_STORE.queue_position(job_id) if job_id else None
+    if position is None:
+        position = JOB_STORE.queue_length() + 1
+    with _JOB_SCHEDULER_LOCK:
+        average = _JOB_SCHEDULER["avg_job_seconds"]
+    workers = max(1, app.config["JOB_WORKERS"])
+    eta = None if average is None else round(-(-position // workers) * average, 2)
+    return {"queue_position": position, "eta_seconds": eta}
+
+
+def _metrics_state() -> dict:
+    # Caller holds _METRICS_LOCK. A forked worker starts from zero
+    # instead of repeating the master's numbers.
+    if _METRICS["pid"] != os.getpid():
+        _METRICS.update(pid=os.getpid(), counters={}, gauges={}, histograms={})
+    return _METRICS
+
+
+def _count_metric(name: str, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _METRICS_LOCK:
+        counters = _metrics_state()["counters"]
+        counters[key] = counters.get(key, 0) + amount
+
+
+def _add_gauge(name: str, amount, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _METRICS_LOCK:
+        gauges = _metrics_state()["gauges"]
+        gauges[key] = gauges.get(key, 0) + amount
+
+
+def _observe_metric(name: str, value: float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _METRICS_LOCK:
+        histograms = _metrics_state()["histograms"]
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = {
+                "buckets": [0] * len(METRIC_BUCKETS), "sum": 0.0, "count": 0
+            }
+        for index, bound in enumerate(METRIC_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+@contextlib.contextmanager
+def _stage_timer(stage: str):
+    # Adds the time spent in the block to the stage totals of the file being processed, if any
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds = _STAGE_SECONDS.get()
+        if stage_seconds is not None:
+            with _METRICS_LOCK:
+                stage_seconds[stage] = stage_seconds.get(stage, 0.0) + time.perf_counter() - started
+
+
+def _record_file_metrics(result: dict, input_type: str, stage_seconds: dict):
+    # Failed inputs may name any language, so only languages Tesseract accepted become label values
+    labels = {
+        "language": result["language"] if not result["error"] else "unknown",
+        "input_type": input_type,
+    }
+    with _METRICS_LOCK:
+        stage_seconds = dict(stage_seconds)
+    for stage, seconds in stage_seconds.items():
+        _observe_metric("ocr_stage_seconds", seconds, stage=stage, **labels)
+    _count_metric("ocr_files_total", outcome="error" if result["error"] else "ok", **labels)
+    _ensure_metrics_flusher()
+
+
+def _metrics_snapshot() -> dict:
+    # This process's metrics as JSON-serializable lists, with the job scheduler gauges read now
+    with _JOB_SCHEDULER_LOCK:
+        own_scheduler = _JOB_SCHEDULER["pid"] == os.getpid()
+        active = _JOB_SCHEDULER["active"] if own_scheduler else 0
+        workers = len(_JOB_SCHEDULER["workers"]) if own_scheduler else 0
+    queue_depth = JOB_STORE.queue_length()
+    with _METRICS_LOCK:
+        state = _metrics_state()
+        return {
+            "pid": os.getpid(),
+            "counters": [
+                [name, labels, value] for (name, labels), value in state["counters"].items()
+            ],
+            "gauges": [
+                [name, labels, value] for (name, labels), value in state["gauges"].items()
+            ] + [
+                ["ocr_job_queue_depth", [], queue_depth],
+                ["ocr_job_workers_active", [], active],
+                ["ocr_job_workers", [], workers],
+            ],
+            "histograms": [
+                [name, labels, histogram["buckets"], histogram["sum"], histogram["count"]]
+                for (name, labels), histogram in state["histograms"].items()
+            ],
+        }
+
+
+def _merge_metrics(snapshots: list) -> dict:
+    # Sums snapshots into {"counters", "gauges", "histograms"} keyed by (name, labels)
+    merged = {"counters": {}, "gauges": {}, "histograms": {}}
+    for snapshot in snapshots:
+        for kind in ("counters", "gauges"):
+            for name, labels, value in snapshot.get(kind, []):
+                key = (name, tuple(map(tuple, labels)))
+                merged[kind][key] = merged[kind].get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot.get("histograms", []):
+            key = (name, tuple(map(tuple, labels)))
+            histogram = merged["histograms"].setdefault(
+                key, {"buckets": [0] * len(METRIC_BUCKETS), "sum": 0.0, "count": 0}
+            )
+            histogram["buckets"] = [a + b for a, b in zip(histogram["buckets"], buckets)]
+            histogram["sum"] += total
+            histogram["count"] += count
+    return merged
+
+
+def _metrics_snapshot_lists(merged: dict) -> dict:
+    # The inverse of _merge_metrics for a single snapshot
+    return {
+        "counters": [[name, labels, value] for (name, labels), value in merged["counters"].items()],
+        "gauges": [[name, labels, value] for (name, labels), value in merged["gauges"].items()],
+        "histograms": [
+            [name, labels, histogram["buckets"], histogram["sum"], histogram["count"]]
+            for (name, labels), histogram in merged["histograms"].items()
+        ],
+    }
+
+
+def _write_metrics_file(path: str, snapshot: dict):
+    # Write then rename so a scrape never reads a partial snapshot
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _flush_metrics():
+    directory = app.config["METRICS_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    _write_metrics_file(os.path.join(directory, f"metrics_{os.getpid()}.json"), _metrics_snapshot())
+
+
+def _metrics_flusher():
+    while True:
+        try:
+            _flush_metrics()
+        except OSError:
+            pass
+        time.sleep(app.config["METRICS_FLUSH_INTERVAL"])
+
+
+def _ensure_metrics_flusher():
+    # One flusher per process; a forked worker starts its own
+    if not app.config["METRICS_DIR"]:
+        return
+    with _METRICS_FLUSHER_LOCK:
+        if _METRICS_FLUSHER["pid"] == os.getpid():
+            return
+        thread = threading.Thread(target=_metrics_flusher, name="metrics-flusher", daemon=True)
+        thread.start()
+        _METRICS_FLUSHER.update(pid=os.getpid(), thread=thread)
+
+
+def _read_metrics_file(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _collect_metrics() -> dict:
+    # Merged metrics of every worker: this one's live numbers, the snapshots the
+    # others flushed to METRICS_DIR, and the counters and histograms of workers
+    # that have exited (their gauges are dropped)
+    local = _metrics_snapshot()
+    directory = app.config["METRICS_DIR"]
+    if not directory:
+        merged = _merge_metrics([local])
+        merged["gauges"][("ocr_worker_processes", ())] = 1
+        return merged
+
+    os.makedirs(directory, exist_ok=True)
+    retired_path = os.path.join(directory, "metrics_retired.json")
+    live = [local]
+    # Scrapes by different workers take turns, so a dead worker's numbers are retired exactly once
+    with open(os.path.join(directory, "metrics.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _write_metrics_file(os.path.join(directory, f"metrics_{os.getpid()}.json"), local)
+        retired = _read_metrics_file(retired_path) or {}
+        dead_paths = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = METRICS_SNAPSHOT_NAME.fullmatch(entry.name)
+                if not match or int(match.group(1)) == os.getpid():
+                    continue
+                snapshot = _read_metrics_file(entry.path)
+                if snapshot is None:
+                    continue
+                if process_alive(int(match.group(1))):
+                    live.append(snapshot)
+                else:
+                    dead = {key: snapshot.get(key, []) for key in ("counters", "histograms")}
+                    retired = _metrics_snapshot_lists(_merge_metrics([retired, dead]))
+                    dead_paths.append(entry.path)
+        if dead_paths:
+            _write_metrics_file(retired_path, retired)
+            for path in dead_paths:
+                os.remove(path)
+
+    if JOB_STORE.SHARED:
+        # Every worker sees the same queue; count it once
+        for snapshot in live[1:]:
+            snapshot["gauges"] = [
+                gauge for gauge in snapshot["gauges"] if gauge[0] != "ocr_job_queue_depth"
+            ]
+    merged = _merge_metrics(live + [retired])
+    merged["gauges"][("ocr_worker_processes", ())] = len(live)
+    return merged
+
+
+def _format_metric_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _render_metrics(merged: dict) -> str:
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        series = merged["histograms" if kind == "histogram" else kind + "s"]
+        for (series_name, labels), value in sorted(series.items()):
+            if series_name != name:
+                continue
+            if kind != "histogram":
+                lines.append(f"{name}{_format_metric_labels(labels)} {value}")
+                continue
+            for bound, count in zip(METRIC_BUCKETS, value["buckets"]):
+                bucket_labels = _format_metric_labels(labels + (("le", str(bound)),))
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+            bucket_labels = _format_metric_labels(labels + (("le", "+Inf"),))
+            lines.append(f"{name}_bucket{bucket_labels} {value['count']}")
+            lines.append(f"{name}_sum{_format_metric_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_format_metric_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
 
 
 @app.route('/favicon.ico')
@@ -269,6 +2221,21 @@ def favicon():
                                'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
 
+@app.route("/api/artifacts/<name>", methods=["GET"])
+def artifact(name):
+    # Stored copies are content-addressed, so clients may cache them for as long as they like
+    path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+    if not ARTIFACT_NAME.fullmatch(name) or not os.path.exists(path):
+        return jsonify({"error": "Not Found", "message": f"Artifact {name} not found."}), 404
+    if _artifact_expired(path):
+        os.remove(path)
+        return jsonify({"error": "Not Found", "message": f"Artifact {name} has expired."}), 404
+    response = send_from_directory(app.config["UPLOAD_FOLDER"], name, max_age=365 * 24 * 3600)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     return render_template("index.html", languages=get_languages(), tesseract_version=get_tesseract_version_string())
@@ -276,7 +2243,25 @@ def index():
 
 @app.route("/api/languages", methods=["GET"])
 def listSupportedLanguages():
-    return jsonify(languages=get_languages())
+    # Served from the JSON precomputed at probe time, revalidated by ETag
+    info = _cached_tesseract_info("languages", _probe_languages)
+    response = app.response_class(info["json"], mimetype="application/json")
+    response.set_etag(info["etag"])
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["LANGUAGES_MAX_AGE"]
+    return response.make_conditional(request)
+
+
+@app.route("/api/tesseract_info/refresh", methods=["POST"])
+def refreshTesseractInfo():
+    info = refresh_tesseract_info()
+    return jsonify(tesseract_version=info["tesseract_version"], languages=len(info["languages"]))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    body = _render_metrics(_collect_metrics())
+    return app.response_class(body, content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.route("/api/ocr", methods=["POST"])
@@ -294,17 +2279,20 @@ def ocr():
         if file_extension not in app.config["SUPPORTED_FORMATS"]:
             raise ValueError("File format not supported")
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}", dir=app.config["UPLOAD_FOLDER"]) as temp_file:
-            file_input_obj.save(temp_file.name)
-            temp_filepath = temp_file.name
+        # Small images are decoded straight from the request
+        # body; PDFs and large images are spooled once
+        chunks = iter(lambda: file_input_obj.stream.read(65536), b"")
+        data, temp_filepath = _spool_input(chunks, f".{file_extension}")
         
         processed_file_input = {
-            "filepath": temp_filepath,
+            **({"filepath": temp_filepath} if data is None else {"data": data}),
             "filename": filename,
-            "language": language
+            "language": language,
+            **_extract_ocr_options(request.form)
         }
         
-        single_result = _process_single_ocr_task(processed_file_input)
+        # The task owns the spooled file: a PDF is moved into the artifacts rather than copied
+        single_result = _run_sync_ocr(processed_file_input, owns_filepath=True)
         
         end_time_overall = datetime.datetime.now()
         duration_overall = (end_time_overall - start_time_overall).total_seconds() * 1000
@@ -341,6 +2329,7 @@ def ocr():
             duration=f"{duration_overall:.2f}ms"
         ), 500
     finally:
+        # Normally the task has moved or deleted it already
         if temp_filepath and os.path.exists(temp_filepath):
             os.remove(temp_filepath)
 
@@ -359,11 +2348,12 @@ def ocr_v2():
     
     file_input = {
         "url": request.json['url'],
-        "language": request.json.get('language', 'en')
+        "language": request.json.get('language', 'en'),
+        **_extract_ocr_options(request.json)
     }
 
     try:
-        single_result = _process_single_ocr_task(file_input)
+        single_result = _run_sync_ocr(file_input)
         status_code = 200 if not single_result["error"] else 400
         return jsonify(single_result), status_code
 
@@ -389,6 +2379,19 @@ def ocr_v2():
         ), 500
 
 
+def _queue_full_response():
+    estimate = _job_queue_estimate()
+    retry_after = max(1, round(estimate["eta_seconds"] or 5))
+    response = jsonify(
+        error="Job queue is full, retry later",
+        queue_size=app.config["JOB_QUEUE_SIZE"],
+        tesseract_version=get_tesseract_version_string()
+    )
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
 # NEW: Async Multi-File OCR Endpoint
 @app.route("/api/async_ocr", methods=["POST"])
 def async_ocr():
@@ -397,21 +2400,22 @@ def async_ocr():
     
     files_payload = request.json['files']
     job_id = str(uuid.uuid4())
-    
-    OCR_JOBS[job_id] = {
+
+    job = {
         "job_id": job_id,
         "status": JOB_STATUS["PENDING"],
         "results": [],
+        "total_files": len(files_payload),
+        "completed_files": 0,
         "overall_start_time": datetime.datetime.now().isoformat(), # Set immediately
         "overall_end_time": None,
         "overall_duration": None,
         "error": None
     }
-    
-    thread = threading.Thread(target=_process_ocr_job, args=(job_id, files_payload))
-    thread.daemon = True # Allow main program to exit even if thread is running
-    thread.start()
-    
+
+    if not _submit_job(job, files_payload):
+        return _queue_full_response()
+
     return jsonify({
         "job_id": job_id,
         "status": JOB_STATUS["PENDING"],
@@ -419,13 +2423,204 @@ def async_ocr():
         "tesseract_version": get_tesseract_version_string()
     }), 202 # 202 Accepted
 
+
+def _full_view() -> bool:
+    # ?view=full returns whole job records with every result, as before summaries existed
+    return request.args.get("view") == "full"
+
+
+def _get_job(job_id, full: bool):
+    return JOB_STORE.get(job_id, include_results=full)
+
+
+def _job_view(job_id, job_data, full: bool):
+    job_data.setdefault("version", 0)
+    summaries = job_data.pop("result_summaries", None)
+    if not full:
+        # Status, counts and timing, with a short summary per file instead of its OCR output
+        if summaries is None:
+            summaries = [_result_summary(result) for result in job_data.get("results") or []]
+        job_data["results"] = summaries
+    if job_data["status"] == JOB_STATUS["PENDING"]:
+        job_data.update(_job_queue_estimate(job_id))
+    return job_data
+
+
+def _job_etag(job_id, job_data, full: bool) -> str:
+    # Changes whenever the job record does, or a pending job moves up the queue
+    view = "full" if full else "summary"
+    return f"{job_id}-{job_data['version']}-{job_data.get('queue_position') or 0}-{view}"
+
+
+def _client_has_job_state(job_id, job_data, full: bool) -> bool:
+    # The client names the state it holds by ?version= or by the ETag of its last response
+    version = request.args.get("version", type=int)
+    if version is not None:
+        return version == job_data["version"]
+    return request.if_none_match.contains(_job_etag(job_id, job_data, full))
+
+
+def _job_not_found(job_id):
+    return jsonify({"status": "not_found", "message": f"Job {job_id} not found."}), 404
+
+
 # NEW: Job Status Endpoint
 @app.route("/api/ocr_status/<job_id>", methods=["GET"])
 def ocr_status(job_id):
-    job_data = OCR_JOBS.get(job_id)
-    if job_data:
-        return jsonify(job_data), 200
-    return jsonify({"status": "not_found", "message": f"Job {job_id} not found."}), 404
+    # Long-poll: with ?wait=<seconds> and a state the client already has, the request is held
+    # until the job changes (200) or the wait runs out (304).
+    full = _full_view()
+    job_data = _get_job(job_id, full)
+    if not job_data:
+        return _job_not_found(job_id)
+    job_data = _job_view(job_id, job_data, full)
+    wait = min(request.args.get("wait", 0, type=float), app.config["JOB_STATUS_MAX_WAIT"])
+    if wait > 0 and _client_has_job_state(job_id, job_data, full):
+        job_data = JOB_STORE.wait(job_id, job_data["version"], wait, include_results=full)
+        if not job_data:
+            return _job_not_found(job_id)
+        job_data = _job_view(job_id, job_data, full)
+    if _client_has_job_state(job_id, job_data, full):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(job_data)
+    response.set_etag(_job_etag(job_id, job_data, full))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _job_events(job_ids: list, full: bool, client_etags: set):
+    # Server-sent events for a set of jobs: a "status" event with a job's record each time it
+    # changes ("not_found" for unknown or expired jobs), ending once all of them have finished. The
+    # event id lists the ETags of every job's current state, so a reconnecting EventSource
+    # (Last-Event-ID) isn't sent states it already has.
+    heartbeat = app.config["JOB_EVENTS_HEARTBEAT"]
+    etags = {}
+    versions = {}
+    to_read = list(job_ids)
+    while to_read:
+        sent = False
+        for job_id in to_read:
+            job_data = _get_job(job_id, full)
+            versions.pop(job_id, None)
+            if not job_data:
+                etags.pop(job_id, None)
+                payload = json.dumps({"job_id": job_id, "status": "not_found"})
+                yield f"event: not_found\ndata: {payload}\n\n"
+                sent = True
+                continue
+            job_data = _job_view(job_id, job_data, full)
+            etags[job_id] = _job_etag(job_id, job_data, full)
+            if etags[job_id] not in client_etags:
+                client_etags.add(etags[job_id])
+                event_id = ",".join(etags.values())
+                payload = json.dumps({"job_id": job_id, **job_data})
+                yield f"id: {event_id}\nevent: status\ndata: {payload}\n\n"
+                sent = True
+            if job_data["status"] not in FINISHED_STATUSES:
+                versions[job_id] = job_data["version"]
+        if not versions:
+            return
+        if not sent:
+            yield ": keepalive\n\n"
+        # Jobs that changed; after a quiet heartbeat re-read
+        # them all, as pending jobs move up the queue
+        to_read = JOB_STORE.wait_any(versions, heartbeat) or list(versions)
+
+
+def _event_stream(job_ids: list, full: bool):
+    client_etags = set(filter(None, request.headers.get("Last-Event-ID", "").split(",")))
+    return app.response_class(
+        stream_with_context(_job_events(job_ids, full, client_etags)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route("/api/ocr_events/<job_id>", methods=["GET"])
+def ocr_events(job_id):
+    full = _full_view()
+    if not _get_job(job_id, full):
+        return _job_not_found(job_id)
+    return _event_stream([job_id], full)
+
+
+@app.route("/api/ocr_events", methods=["GET"])
+def ocr_events_multi():
+    # One stream for all the jobs a client watches (?job_ids=a,b,...): browsers allow only a few
+    # connections per origin, and every open stream holds a gunicorn thread
+    requested = (job_id.strip() for job_id in request.args.get("job_ids", "").split(","))
+    job_ids = list(dict.fromkeys(filter(None, requested)))
+    if not job_ids or len(job_ids) > MAX_EVENT_STREAM_JOBS:
+        return jsonify(
+            {"error": f"Pass between 1 and {MAX_EVENT_STREAM_JOBS} job ids in job_ids."}
+        ), 400
+    return _event_stream(job_ids, _full_view())
+
+
+def _select_result_fields(result: dict, fields: list, boxes: bool) -> dict:
+    if fields:
+        result = {key: result[key] for key in fields if key in result}
+    if not boxes and result.get("ocr_data"):
+        # Keep each page's size and other outputs, drop its per-word boxes
+        result = {**result, "ocr_data": [
+            {key: value for key, value in page.items() if key != "ocr_data"}
+            for page in result["ocr_data"]
+        ]}
+    return result
+
+
+@app.route("/api/ocr_results/<job_id>", methods=["GET"])
+@app.route("/api/ocr_results/<job_id>/<int:file_index>", methods=["GET"])
+def ocr_results(job_id, file_index=None):
+    # The results of a finished job: ?offset=&limit= page through its files, or through
+    # the pages of one file when a file index is given. ?fields=text,... keeps only
+    # those result fields and ?boxes=0 leaves out the per-word boxes. Only the requested
+    # files' results are read from the job store.
+    job_data = JOB_STORE.get(job_id, include_results=False)
+    if not job_data:
+        return _job_not_found(job_id)
+    if job_data["status"] not in FINISHED_STATUSES:
+        return jsonify(
+            {"status": job_data["status"], "message": f"Job {job_id} has not finished yet."}
+        ), 409
+
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = max(1, request.args.get("limit", app.config["JOB_RESULTS_PAGE_SIZE"], type=int))
+    fields = [field.strip() for field in request.args.get("fields", "").split(",") if field.strip()]
+    boxes = _bool_option(request.args.get("boxes", True))
+
+    if file_index is None:
+        selected = JOB_STORE.get_results(job_id, offset, limit)
+        if selected is None:
+            return _job_not_found(job_id)
+        total_files, results = selected
+        return jsonify({
+            "job_id": job_id,
+            "status": job_data["status"],
+            "total_files": total_files,
+            "offset": offset,
+            "limit": limit,
+            "results": [
+                {"file_index": index, **_select_result_fields(result, fields, boxes)}
+                for index, result in enumerate(results, start=offset)
+            ]
+        })
+
+    selected = JOB_STORE.get_results(job_id, file_index, 1)
+    if not selected or not selected[1]:
+        return jsonify(
+            {"status": "not_found", "message": f"File {file_index} not found in job {job_id}."}
+        ), 404
+    result = selected[1][0]
+    pages = result.get("ocr_data") or []
+    return jsonify({
+        "file_index": file_index,
+        "total_pages": len(pages),
+        "offset": offset,
+        "limit": limit,
+        **_select_result_fields({**result, "ocr_data": pages[offset:offset + limit]}, fields, boxes)
+    })
 
 
 @app.errorhandler(400)
@@ -170,11 +170,14 @@ function drawBoundingBoxes(pageData, originalWidth, originalHeight) {
     });
 }
 
+// Image results link a stored copy (image_url) or, from older servers, inline it (image_base64)
+const imageSource = (fileResult) => fileResult.image_url || fileResult.image_base64;
+
 async function drawOCRData(fileResult) {
     console.log("drawOCRData called with:", fileResult);
     if (!fileResult) return;
     
-    if (fileResult.image_base64) {
+    if (imageSource(fileResult)) {
         console.log("Detected Image result");
         // Single image result - ocr_data is the array of page results
         state.currentOcrResults = fileResult.ocr_data; 
@@ -192,7 +195,7 @@ async function drawOCRData(fileResult) {
             ocrPdf.classList.add('hidden');
             pdfControls.classList.add('hidden');
         };
-        img.src = fileResult.image_base64;
+        img.src = imageSource(fileResult);
     } else if (Array.isArray(fileResult)) {
         console.log("Detected PDF result (array)");
         // PDF result (array of page results) - we take the first file's page results
@@ -244,24 +247,14 @@ document.onpaste = (event) => {
 
 // --- Job Dashboard & Async OCR Logic ---
 let activeJobs = {};
-const POLL_INTERVAL = 1000;
-let pollingIntervalId = null;
+let watchedJobs = new Set();
+let jobEventSource = null;
 let dashboardIntervals = {};
 
-function startPolling() {
-    if (!pollingIntervalId) pollingIntervalId = setInterval(updateJobDashboard, POLL_INTERVAL);
-    updateJobDashboard();
-}
-
-function stopPolling() {
-    if (pollingIntervalId) { clearInterval(pollingIntervalId); pollingIntervalId = null; }
-}
-
 function updateJobDashboard() {
     const jobListEl = document.querySelector("#job-list");
     document.querySelector("#job-dashboard").classList.remove('hidden'); 
 
-    let hasActivePollingJobs = false;
     const sortedJobIds = Object.keys(activeJobs).sort((a, b) => {
         const timeA = new Date(activeJobs[a].overall_start_time || 0).getTime();
         const timeB = new Date(activeJobs[b].overall_start_time || 0).getTime();
@@ -273,42 +266,68 @@ function updateJobDashboard() {
     } else {
         const noJobsMsg = jobListEl.querySelector(".no-jobs-message");
         if (noJobsMsg) noJobsMsg.remove();
-        sortedJobIds.forEach((jobId, index) => {
-            displayJob(jobId, activeJobs[jobId], index + 1);
-            if (activeJobs[jobId].status === 'pending' || activeJobs[jobId].status === 'in_progress') hasActivePollingJobs = true;
-        });
+        sortedJobIds.forEach((jobId, index) => displayJob(jobId, activeJobs[jobId], index + 1));
     }
+}
 
-    if (!hasActivePollingJobs) stopPolling();
-    else {
-        sortedJobIds.forEach(jobId => {
-            if ((activeJobs[jobId].status === 'pending' || activeJobs[jobId].status === 'in_progress') && !jobId.startsWith('sync-')) pollJobStatus(jobId);
-        });
+// One event stream for all unfinished jobs (browsers only allow a few connections per origin): the server
+// pushes a "status" event whenever one of them changes, and the stream is reopened when a job is added
+function watchJob(jobId) {
+    if (watchedJobs.has(jobId)) return;
+    watchedJobs.add(jobId);
+    openJobEvents();
+}
+
+function unwatchJob(jobId) {
+    watchedJobs.delete(jobId);
+    if (watchedJobs.size === 0 && jobEventSource) {
+        jobEventSource.close();
+        jobEventSource = null;
     }
 }
 
-async function pollJobStatus(jobId) {
+function openJobEvents() {
+    if (jobEventSource) jobEventSource.close();
+    const source = new EventSource(`/api/ocr_events?job_ids=${[...watchedJobs].map(encodeURIComponent).join(',')}`);
+    jobEventSource = source;
+    source.addEventListener('status', (event) => {
+        const jobData = JSON.parse(event.data);
+        const jobId = jobData.job_id;
+        activeJobs[jobId] = { ...activeJobs[jobId], ...jobData };
+        if (jobData.status === 'completed' || jobData.status === 'failed') {
+            unwatchJob(jobId);
+            updateTimingInfoDisplay(jobId);
+            if (jobData.results?.length > 0) fetchJobResults(jobId, jobData.results.length);
+        }
+        updateJobDashboard();
+    });
+    source.addEventListener('not_found', (event) => unwatchJob(JSON.parse(event.data).job_id));
+    source.onerror = (error) => {
+        // EventSource reconnects by itself unless the server refused the stream
+        if (source.readyState === EventSource.CLOSED && jobEventSource === source) {
+            jobEventSource = null;
+            console.error("Job events error:", error);
+        }
+    };
+}
+
+// Status events carry per-file summaries; the OCR output itself comes from the results endpoint
+async function fetchJobResults(jobId, fileCount) {
     try {
-        const response = await fetch(`/api/ocr_status/${jobId}`);
-        const jobData = await response.json();
-        if (response.ok) {
-            activeJobs[jobId] = { ...activeJobs[jobId], ...jobData };
-            if (jobData.status === 'completed' || jobData.status === 'failed') {
-                updateTimingInfoDisplay(jobId);
-                if (jobData.results?.length > 0) {
-                    // Show full JSON of all results in the textarea
-                    resultTextarea.value = JSON.stringify(jobData.results, null, 2);
-                    
-                    const firstResult = jobData.results[0];
-                    if (firstResult.image_base64) {
-                        drawOCRData(firstResult);
-                    } else {
-                        drawOCRData(jobData.results);
-                    }
-                }
-            }
+        const response = await fetch(`/api/ocr_results/${jobId}?limit=${fileCount}`);
+        const resultsData = await response.json();
+        if (!response.ok) return;
+        activeJobs[jobId] = { ...activeJobs[jobId], results: resultsData.results };
+        // Show full JSON of all results in the textarea
+        resultTextarea.value = JSON.stringify(resultsData.results, null, 2);
+
+        const firstResult = resultsData.results[0];
+        if (imageSource(firstResult)) {
+            drawOCRData(firstResult);
+        } else {
+            drawOCRData(resultsData.results);
         }
-    } catch (error) { console.error("Polling error:", error); }
+    } catch (error) { console.error("Results error:", error); }
 }
 
 function displayJob(jobId, jobData, jobIndex) {
@@ -329,12 +348,13 @@ function displayJob(jobId, jobData, jobIndex) {
             <span class="job-col job-col-duration"></span>
         `;
         jobEl.onclick = () => {
+            const jobData = activeJobs[jobId];
             updateTimingInfoDisplay(jobId);
             if (jobData.results?.length > 0) {
                 resultTextarea.value = JSON.stringify(jobData.results, null, 2);
                 
                 const firstResult = jobData.results[0];
-                if (firstResult.image_base64) {
+                if (imageSource(firstResult)) {
                     drawOCRData(firstResult);
                 } else {
                     drawOCRData(jobData.results);
@@ -345,8 +365,8 @@ function displayJob(jobId, jobData, jobIndex) {
 
     jobEl.querySelector('.job-col-number').textContent = `${jobIndex}.`;
     jobEl.querySelector('.job-col-id').textContent = jobId.substring(0, 8);
-    const totalFiles = (jobData.files || []).length || (jobData.results || []).length || 0;
-    const completedFiles = (jobData.results || []).filter(res => !res.error).length;
+    const totalFiles = jobData.total_files || (jobData.files || []).length || (jobData.results || []).length || 0;
+    const completedFiles = jobData.completed_files ?? (jobData.results || []).filter(res => !res.error).length;
     jobEl.querySelector('.job-col-progress').textContent = `${completedFiles}/${totalFiles}`;
     
     let mainFilename = "N/A";
@@ -421,11 +441,11 @@ function doOCR(){
     data.append('file', state.file);
     data.append('language', language);
     data.append('job_id', jobId);
+    data.append('image_output', 'url');
     
     activeJobs[jobId] = { job_id: jobId, status: 'in_progress', results: [], overall_start_time: new Date().toISOString(), overall_end_time: null, overall_duration: null, error: null, files: [{ filename: state.file.name, language: language }] };
-    displayJob(jobId, activeJobs[jobId]);
+    updateJobDashboard();
     updateTimingInfoDisplay(jobId);
-    startPolling();
 
     fetch('/api/ocr', { method: 'POST', body: data })
     .then(response => {
@@ -435,10 +455,10 @@ function doOCR(){
     })
     .then(result => {
         activeJobs[jobId] = { ...activeJobs[jobId], status: result.error ? 'failed' : 'completed', results: [{ ...result, filename: state.file.name }], overall_start_time: result.start_time || activeJobs[jobId].overall_start_time, overall_end_time: result.end_time || new Date().toISOString(), overall_duration: result.duration, error: result.error };
-                displayJob(jobId, activeJobs[jobId]);
+                updateJobDashboard();
                 updateTimingInfoDisplay(jobId);
         
-                if (result.image_base64) {
+                if (imageSource(result)) {
                     resultEl.value = JSON.stringify(result, null, 2);
                     drawOCRData(result);
                 } else {
@@ -453,7 +473,7 @@ function doOCR(){
     .catch(error => {
         document.querySelector('main').classList.remove('scanning');
         activeJobs[jobId] = { ...activeJobs[jobId], status: 'failed', overall_end_time: new Date().toISOString(), overall_duration: 'N/A', error: error.message || error };
-        displayJob(jobId, activeJobs[jobId]);
+        updateJobDashboard();
         resultEl.value = `Error: ${error.message || error}`;
     });
 }
@@ -472,7 +492,7 @@ async function submitAsyncOCR(){
             reader.onerror = error => reject(error);
             reader.readAsDataURL(file);
         });
-        filesPayload.push({ filename: file.name, base64: base64String, language: document.getElementById('source_lang').value });
+        filesPayload.push({ filename: file.name, base64: base64String, language: document.getElementById('source_lang').value, image_output: 'url' });
     }
 
     try {
@@ -482,9 +502,9 @@ async function submitAsyncOCR(){
         if (response.ok) {
             const jobId = jsonResponse.job_id;
             activeJobs[jobId] = { job_id: jobId, status: jsonResponse.status, results: [], overall_start_time: new Date().toISOString(), overall_end_time: null, overall_duration: null, error: null, files: filesPayload };
-            displayJob(jobId, activeJobs[jobId]);
+            updateJobDashboard();
             updateTimingInfoDisplay(jobId);
-            startPolling();
+            watchJob(jobId);
             document.querySelector("#resulttext").value = jsonResponse.message;
         }
     } catch (error) { document.querySelector('main').classList.remove('scanning'); console.error("Async submit error:", error); }
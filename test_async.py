@@ -1,7 +1,6 @@
 
 import requests
 import base64
-import time
 import os
 
 # Helper to read file as base64
@@ -29,22 +28,33 @@ print(f"Response: {job_data}")
 
 if resp.status_code == 202:
     job_id = job_data["job_id"]
-    # 2. Poll for results
-    for i in range(10):
-        print(f"Polling attempt {i+1} for job {job_id}...")
-        status_resp = requests.get(f"http://127.0.0.1:5000/api/ocr_status/{job_id}")
+    # 2. Long-poll for results: each request is held until the job changes (or 30s pass)
+    etag = None
+    while True:
+        print(f"Waiting for job {job_id}...")
+        headers = {"If-None-Match": etag} if etag else {}
+        status_resp = requests.get(
+            f"http://127.0.0.1:5000/api/ocr_status/{job_id}", params={"wait": 30}, headers=headers
+        )
+        if status_resp.status_code == 304:
+            continue
+        etag = status_resp.headers.get("ETag")
         status_data = status_resp.json()
         print(f"Status: {status_data['status']}")
-        if status_data['status'] in ['completed', 'failed']:
+        if status_data['status'] in ['completed', 'failed', 'not_found']:
             print("Job finished!")
-            print(f"Results keys: {status_data.keys()}")
             if 'results' in status_data:
                 print(f"Number of results: {len(status_data['results'])}")
-                if len(status_data['results']) > 0:
-                    print(f"First result keys: {status_data['results'][0].keys()}")
+                # The status holds per-file summaries; the OCR
+                # output comes from the results endpoint
+                results_resp = requests.get(
+                    f"http://127.0.0.1:5000/api/ocr_results/{job_id}", params={"boxes": 0}
+                )
+                results = results_resp.json().get("results", [])
+                if len(results) > 0:
+                    print(f"First result keys: {results[0].keys()}")
             else:
                 print("MISSING 'results' key in response!")
             break
-        time.sleep(2)
 else:
     print("Failed to submit job")
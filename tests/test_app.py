@@ -1,13 +1,22 @@
 import os
 import io
 import json
+import base64
+import hashlib
 from unittest.mock import patch, MagicMock
 import pytest
 import time # NEW: For potential sleep in async tests
 import datetime # NEW: For simulating times in async job results
+import threading
+import subprocess
 
 # Import the Flask app instance from your main application file
-from ocr import app, UPLOAD_FOLDER, OCR_JOBS, JOB_STATUS, _process_single_ocr_task, _process_ocr_job # NEW IMPORTS
+from ocr import (  # NEW IMPORTS
+    app, UPLOAD_FOLDER, OCR_JOBS, JOB_STATUS, _process_single_ocr_task, _process_ocr_job,
+    _get_ocr_data, _ENGINE_LOCAL, _TESSERACT_INFO, pdf_to_text, pdf_to_img, _RESULT_CACHE
+)
+from PIL import Image
+import ocr
 
 # Define a consistent mocked Tesseract version
 MOCKED_TESSERACT_VERSION = "5.5.0-mock"
@@ -255,15 +264,9 @@ def test_api_v2_ocr_unsupported_format(mock_process_single_ocr_task, mock_get_te
 # NEW: Tests for async multi-file OCR endpoint
 
 @patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
-@patch('ocr.threading.Thread')
-@patch('ocr.OCR_JOBS') # Mock the global OCR_JOBS to control its state
-def test_async_ocr_submit_success(mock_ocr_jobs, mock_thread, mock_get_tesseract_version_string, client):
-    # Setup mock for _process_ocr_job to be passed to thread
-    mock_ocr_jobs.__setitem__ = MagicMock() # Allow setting items on the mock dict
-
-    # Prepare a dummy response for _process_single_ocr_task if it were called by _process_ocr_job
-    # However, for this test, we are only verifying thread creation, not its execution
-    
+@patch('ocr._ensure_job_workers') # Keep the job on the queue instead of running it
+def test_async_ocr_submit_success(mock_ensure_job_workers, mock_get_tesseract_version_string,
+                                  client):
     files_payload = [
         {"url": "http://example.com/image1.png", "language": "en"},
         {"base64": "JVBERi0x...", "filename": "image2.pdf", "language": "fr"},
@@ -278,14 +281,18 @@ def test_async_ocr_submit_success(mock_ocr_jobs, mock_thread, mock_get_tesseract
     assert 'tesseract_version' in json_data
     assert json_data['tesseract_version'] == MOCKED_TESSERACT_VERSION
 
-    # Verify that a thread was started with the correct target and arguments
-    mock_thread.assert_called_once()
-    args, kwargs = mock_thread.call_args
-    mock_thread_instance = mock_thread.return_value # Get the mock instance returned by the constructor
-    assert kwargs['target'] == _process_ocr_job
-    assert kwargs['args'][0] == json_data['job_id']
-    assert kwargs['args'][1] == files_payload
-    assert mock_thread_instance.daemon is True # Check the daemon attribute on the instance
+    # The job waits on the bounded queue for the worker pool
+    job_id = json_data['job_id']
+    try:
+        assert (job_id, files_payload) in ocr.JOB_STORE.queue
+        mock_ensure_job_workers.assert_called_once()
+
+        status = json.loads(client.get(f'/api/ocr_status/{job_id}').data)
+        assert status['status'] == 'pending'
+        assert status['queue_position'] == ocr.JOB_STORE.queue_length()
+        assert 'eta_seconds' in status
+    finally:
+        ocr.JOB_STORE.delete(job_id)
 
 @patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
 def test_async_ocr_invalid_payload(mock_get_tesseract_version_string, client):
@@ -340,7 +347,7 @@ def test_ocr_status_completed(mock_get_tesseract_version_string, client):
         "error": None
     }
 
-    response = client.get(f'/api/ocr_status/{test_job_id}')
+    response = client.get(f'/api/ocr_status/{test_job_id}?view=full')
     assert response.status_code == 200
     json_data = json.loads(response.data)
     assert json_data['job_id'] == test_job_id
@@ -425,15 +432,9 @@ def test_api_v2_ocr_unsupported_format(mock_process_single_ocr_task, mock_get_te
 # NEW: Tests for async multi-file OCR endpoint
 
 @patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
-@patch('ocr.threading.Thread')
-@patch('ocr.OCR_JOBS') # Mock the global OCR_JOBS to control its state
-def test_async_ocr_submit_success(mock_ocr_jobs, mock_thread, mock_get_tesseract_version_string, client):
-    # Setup mock for _process_ocr_job to be passed to thread
-    mock_ocr_jobs.__setitem__ = MagicMock() # Allow setting items on the mock dict
-
-    # Prepare a dummy response for _process_single_ocr_task if it were called by _process_ocr_job
-    # However, for this test, we are only verifying thread creation, not its execution
-    
+@patch('ocr._ensure_job_workers') # Keep the job on the queue instead of running it
+def test_async_ocr_submit_success(mock_ensure_job_workers, mock_get_tesseract_version_string,
+                                  client):
     files_payload = [
         {"url": "http://example.com/image1.png", "language": "en"},
         {"base64": "JVBERi0x...", "filename": "image2.pdf", "language": "fr"},
@@ -448,14 +449,18 @@ def test_async_ocr_submit_success(mock_ocr_jobs, mock_thread, mock_get_tesseract
     assert 'tesseract_version' in json_data
     assert json_data['tesseract_version'] == MOCKED_TESSERACT_VERSION
 
-    # Verify that a thread was started with the correct target and arguments
-    mock_thread.assert_called_once()
-    args, kwargs = mock_thread.call_args
-    mock_thread_instance = mock_thread.return_value # Get the mock instance returned by the constructor
-    assert kwargs['target'] == _process_ocr_job
-    assert kwargs['args'][0] == json_data['job_id']
-    assert kwargs['args'][1] == files_payload
-    assert mock_thread_instance.daemon is True # Check the daemon attribute on the instance
+    # The job waits on the bounded queue for the worker pool
+    job_id = json_data['job_id']
+    try:
+        assert (job_id, files_payload) in ocr.JOB_STORE.queue
+        mock_ensure_job_workers.assert_called_once()
+
+        status = json.loads(client.get(f'/api/ocr_status/{job_id}').data)
+        assert status['status'] == 'pending'
+        assert status['queue_position'] == ocr.JOB_STORE.queue_length()
+        assert 'eta_seconds' in status
+    finally:
+        ocr.JOB_STORE.delete(job_id)
 
 @patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
 def test_async_ocr_invalid_payload(mock_get_tesseract_version_string, client):
@@ -510,7 +515,7 @@ def test_ocr_status_completed(mock_get_tesseract_version_string, client):
         "error": None
     }
 
-    response = client.get(f'/api/ocr_status/{test_job_id}')
+    response = client.get(f'/api/ocr_status/{test_job_id}?view=full')
     assert response.status_code == 200
     json_data = json.loads(response.data)
     assert json_data['job_id'] == test_job_id
@@ -558,3 +563,1625 @@ def test_ocr_status_not_found(mock_get_tesseract_version_string, client):
 def cleanup_patches():
     yield
     patch.stopall()
+
+
+# Canned Tesseract outputs for tests that exercise _get_ocr_data
+MOCKED_TSV = (
+    "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\t"
+    "left\ttop\twidth\theight\tconf\ttext\n"
+    "1\t1\t0\t0\t0\t0\t0\t0\t200\t100\t-1\t\n"
+    "4\t1\t1\t1\t1\t0\t10\t10\t120\t20\t-1\t\n"
+    "5\t1\t1\t1\t1\t1\t10\t10\t50\t20\t96.5\tHello\n"
+    "5\t1\t1\t1\t1\t2\t70\t10\t60\t20\t91.25\tworld\n"
+).encode()
+
+
+@patch('ocr.tesserocr', None)
+@patch('ocr.pytesseract.image_to_data')
+@patch('ocr.pytesseract.image_to_string')
+@patch('ocr._run_tesseract_cli')
+def test_get_ocr_data_single_tesseract_pass(mock_run_multiple, mock_image_to_string,
+                                            mock_image_to_data):
+    mock_run_multiple.return_value = [b"Hello world\n\x0c", MOCKED_TSV, b"<html>hocr</html>"]
+
+    results = _get_ocr_data(Image.new("RGB", (200, 100), "white"), "en", ["hocr"])
+
+    mock_run_multiple.assert_called_once()
+    assert mock_run_multiple.call_args.kwargs['extensions'] == ["txt", "tsv", "hocr"]
+    assert mock_run_multiple.call_args.kwargs['lang'] == "eng"
+    mock_image_to_string.assert_not_called()
+    mock_image_to_data.assert_not_called()
+
+    assert results["text"] == "Hello world\n\x0c"
+    assert results["hocr"] == "<html>hocr</html>"
+    assert (results["image_width"], results["image_height"]) == (200, 100)
+    assert [word["text"] for word in results["ocr_data"]] == ["Hello", "world"]
+    assert results["ocr_data"][0] == {
+        "level": 5, "page_num": 1, "block_num": 1, "par_num": 1, "line_num": 1, "word_num": 1,
+        "left": 10, "top": 10, "width": 50, "height": 20, "conf": 96.5, "text": "Hello"
+    }
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+def test_process_single_ocr_task_rejects_unknown_output_format(mock_get_tesseract_version_string,
+                                                               client):
+    result = _process_single_ocr_task({
+        "base64": "aGVsbG8=",
+        "filename": "image.png",
+        "output_formats": "hocr,docx"
+    })
+    assert result["error"] == "Unsupported output format: docx"
+
+
+@patch('ocr._run_tesseract_cli')
+@patch('ocr.tesserocr')
+def test_get_ocr_data_reuses_warm_tesserocr_api(mock_tesserocr, mock_run_multiple):
+    api = mock_tesserocr.PyTessBaseAPI.return_value
+    api.GetUTF8Text.return_value = "Hello world\n"
+    api.GetTSVText.return_value = MOCKED_TSV.decode().split("\n", 1)[1]
+    _ENGINE_LOCAL.apis = {}
+    try:
+        image = Image.new("RGB", (200, 100), "white")
+        first = _get_ocr_data(image, "en")
+        second = _get_ocr_data(image, "en")
+    finally:
+        _ENGINE_LOCAL.apis = {}
+
+    mock_tesserocr.PyTessBaseAPI.assert_called_once_with(lang="eng")
+    assert api.Recognize.call_count == 2
+    mock_run_multiple.assert_not_called()
+    assert first["text"] == second["text"] == "Hello world\n\x0c"
+    assert [word["text"] for word in first["ocr_data"]] == ["Hello", "world"]
+
+
+@patch('ocr._run_tesseract_cli')
+@patch('ocr.tesserocr')
+def test_get_ocr_data_renders_hocr_and_alto_with_the_tesseract_binary(mock_tesserocr,
+                                                                      mock_run_multiple):
+    hocr = (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<html><body><div class="ocr_page"></div></body></html>\n'
+    )
+    mock_run_multiple.return_value = [b"Hello world\n", MOCKED_TSV, hocr]
+    results = _get_ocr_data(Image.new("RGB", (200, 100), "white"), "en", ["hocr"])
+
+    mock_tesserocr.PyTessBaseAPI.assert_not_called()
+    assert mock_run_multiple.call_args.kwargs["extensions"] == ["txt", "tsv", "hocr"]
+    assert results["text"] == "Hello world\n"
+    assert ocr._use_tesserocr(["txt", "tsv", "xml"]) is False
+    assert ocr._use_tesserocr(["txt", "tsv"]) is True
+
+
+@patch('ocr.tesserocr', None)
+@patch('ocr._run_tesseract_cli')
+def test_get_ocr_data_falls_back_to_subprocess_without_tesserocr(mock_run_multiple):
+    mock_run_multiple.return_value = [b"Hello world\n", MOCKED_TSV]
+    results = _get_ocr_data(Image.new("RGB", (200, 100), "white"), "en")
+    mock_run_multiple.assert_called_once()
+    assert results["text"] == "Hello world\n"
+
+
+TESSERACT_STUB = """#!{python}
+# Writes what tesseract would for the renderers it is asked for: -c <variable>=1, or a config name
+import json, sys
+args = sys.argv[1:]
+base, options = args[1], args[2:]
+json.dump(args, open({argv!r}, "w"))
+variables, configs = set(), set()
+while options:
+    option = options.pop(0)
+    if option in ("-l", "--psm", "--oem"):
+        options.pop(0)
+    elif option == "-c":
+        variables.add(options.pop(0))
+    else:
+        configs.add(option)
+renderers = {{"txt": ("txt", None), "tsv": ("tsv", "tessedit_create_tsv=1"),
+             "hocr": ("hocr", "tessedit_create_hocr=1"), "xml": ("alto", "tessedit_create_alto=1")}}
+for ext, (config, variable) in renderers.items():
+    if config in configs or variable in variables:
+        open(base + "." + ext, "w").write(ext + " output")
+"""
+
+
+@patch('ocr.tesserocr', None)
+def test_run_tesseract_writes_every_requested_renderer(tmp_path):
+    import sys
+    stub = tmp_path / "tesseract"
+    argv = tmp_path / "argv.json"
+    stub.write_text(TESSERACT_STUB.format(python=sys.executable, argv=str(argv)))
+    stub.chmod(0o755)
+    extensions = ["txt", "tsv", "hocr", "xml"]
+    with patch.object(ocr.pytesseract.pytesseract, "tesseract_cmd", str(stub)):
+        outputs = ocr._run_tesseract(Image.new("RGB", (40, 20), "white"), "eng", extensions)
+
+    assert outputs == {ext: f"{ext} output".encode() for ext in extensions}
+    args = json.loads(argv.read_text())
+    for variable in ("tessedit_create_tsv=1", "tessedit_create_hocr=1", "tessedit_create_alto=1"):
+        assert args[args.index(variable) - 1] == "-c"
+    assert args[args.index("-l") + 1] == "eng"
+
+
+def _fake_tesseract_cli(*args):
+    if args == ("--version",):
+        return "tesseract 5.3.0-1\n leptonica-1.82.0\n"
+    return 'List of available languages in "/usr/share/tessdata/" (2):\neng\nfra\n'
+
+
+@patch('ocr._tesseract_cli', side_effect=_fake_tesseract_cli)
+def test_tesseract_info_is_probed_once_and_refreshable(mock_tesseract_cli, client):
+    def probes(flag):
+        return [call.args for call in mock_tesseract_cli.call_args_list].count((flag,))
+
+    _TESSERACT_INFO.clear()
+    try:
+        first = client.get('/api/languages')
+        assert first.status_code == 200
+        assert json.loads(first.data) == {"languages": {"en": "English", "fr": "français"}}
+        assert first.headers['ETag']
+        assert 'max-age' in first.headers['Cache-Control']
+
+        revalidated = client.get('/api/languages', headers={'If-None-Match': first.headers['ETag']})
+        assert revalidated.status_code == 304
+
+        assert client.get('/').status_code == 200
+        assert client.get('/').status_code == 200
+        assert probes("--list-langs") == 1
+        assert probes("--version") == 1
+
+        response = client.post('/api/tesseract_info/refresh')
+        assert response.status_code == 200
+        assert json.loads(response.data) == {"tesseract_version": "5.3.0", "languages": 2}
+        assert probes("--list-langs") == 2
+        assert probes("--version") == 2
+
+        # What a SIGHUP does: only a flag, the probes run again on next use
+        ocr.mark_tesseract_info_stale()
+        assert probes("--version") == 2
+        assert ocr.get_tesseract_version_string() == "5.3.0"
+        assert probes("--version") == 3
+        assert "stale" not in _TESSERACT_INFO
+    finally:
+        _TESSERACT_INFO.clear()
+
+
+@patch('ocr._get_ocr_data')
+@patch('ocr.pdf_to_img')
+def test_pdf_to_text_parallel_pages_keep_page_order(mock_pdf_to_img, mock_get_ocr_data):
+    pages = [Image.new("RGB", (10 + i, 10), "white") for i in range(6)]
+    mock_pdf_to_img.return_value = iter(enumerate(pages, start=1))
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def fake_ocr(image, language, output_formats, ocr_data_format="records"):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        # Earlier pages finish last to make out-of-order completion likely
+        time.sleep(0.01 * (20 - image.size[0]))
+        with lock:
+            running["now"] -= 1
+        return {
+            "text": f"page {image.size[0] - 9}", "ocr_data": [], "image_width": image.size[0],
+            "image_height": 10
+        }
+
+    mock_get_ocr_data.side_effect = fake_ocr
+    app.config["OCR_PAGE_WORKERS"] = 3
+    try:
+        results = pdf_to_text("document.pdf", "en")
+    finally:
+        app.config["OCR_PAGE_WORKERS"] = 1
+
+    assert [page["page_num"] for page in results] == [1, 2, 3, 4, 5, 6]
+    assert [page["text"] for page in results] == [f"page {i}" for i in range(1, 7)]
+    assert 1 < running["max"] <= 3
+
+
+@patch('ocr.pdf2image.convert_from_path')
+@patch('ocr.pdf2image.pdfinfo_from_path', return_value={"Pages": 5})
+def test_pdf_to_img_renders_pages_in_chunks(mock_pdfinfo, mock_convert_from_path):
+    mock_convert_from_path.side_effect = lambda pdf_file, first_page, last_page, **kwargs: [
+        Image.new("RGB", (page_num, 10)) for page_num in range(first_page, last_page + 1)
+    ]
+    app.config["PDF_RENDER_CHUNK_SIZE"] = 2
+    try:
+        pages = pdf_to_img("document.pdf")
+        page_num, image = next(pages)
+        assert (page_num, image.size[0]) == (1, 1)
+        # Only the first chunk has been rendered so far
+        assert mock_convert_from_path.call_count == 1
+        rest = [(page_num, image.size[0]) for page_num, image in pages]
+    finally:
+        app.config["PDF_RENDER_CHUNK_SIZE"] = 4
+
+    assert rest == [(2, 2), (3, 3), (4, 4), (5, 5)]
+    calls = mock_convert_from_path.call_args_list
+    chunks = [(c.kwargs['first_page'], c.kwargs['last_page']) for c in calls]
+    assert chunks == [(1, 2), (3, 4), (5, 5)]
+
+
+@patch('ocr._get_ocr_data')
+@patch('ocr.pdf2image.convert_from_path')
+@patch('ocr.pdf2image.pdfinfo_from_path', return_value={"Pages": 2})
+def test_pdf_to_text_renders_to_disk_with_request_options(mock_pdfinfo, mock_convert_from_path,
+                                                          mock_get_ocr_data):
+    def fake_convert(pdf_file, first_page, last_page, output_folder, paths_only, fmt, **kwargs):
+        paths = []
+        for page_num in range(first_page, last_page + 1):
+            path = os.path.join(output_folder, f"page-{page_num}.pgm")
+            Image.new("L", (30, 40)).save(path)
+            paths.append(path)
+        return paths
+
+    seen_pages = []
+
+    def fake_ocr(page, language, output_formats, ocr_data_format="records"):
+        seen_pages.append(page)
+        assert os.path.exists(page)
+        return {"text": "", "ocr_data": [], "image_width": 30, "image_height": 40}
+
+    mock_convert_from_path.side_effect = fake_convert
+    mock_get_ocr_data.side_effect = fake_ocr
+    app.config["PDF_RENDER_TO_DISK"] = True
+    try:
+        render_options = ocr._pdf_render_options({"dpi": "150", "grayscale": "true"})
+        results = pdf_to_text("document.pdf", "en", (), render_options)
+    finally:
+        app.config["PDF_RENDER_TO_DISK"] = False
+
+    assert [page["page_num"] for page in results] == [1, 2]
+    kwargs = mock_convert_from_path.call_args.kwargs
+    assert kwargs['dpi'] == 150
+    assert kwargs['grayscale'] is True
+    assert kwargs['use_pdftocairo'] is False
+    assert kwargs['paths_only'] is True
+    # Tesseract got file paths, and the rendered files are gone afterwards
+    assert all(isinstance(page, str) for page in seen_pages)
+    assert not any(os.path.exists(page) for page in seen_pages)
+
+
+def test_pdf_render_options_reject_invalid_dpi():
+    with pytest.raises(ValueError):
+        ocr._pdf_render_options({"dpi": "5000"})
+
+
+MOCKED_PDFTOTEXT_BBOX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+  "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title></title></head>
+<body>
+<doc>
+  <page width="612.000000" height="792.000000">
+    <flow>
+      <block xMin="72.0" yMin="72.0" xMax="300.0" yMax="100.0">
+        <line xMin="72.0" yMin="72.0" xMax="300.0" yMax="86.0">
+          <word xMin="72.0" yMin="72.0" xMax="108.0" yMax="86.0">Born</word>
+          <word xMin="111.0" yMin="72.0" xMax="150.0" yMax="86.0">digital</word>
+        </line>
+        <line xMin="72.0" yMin="88.0" xMax="300.0" yMax="100.0">
+          <word xMin="72.0" yMin="88.0" xMax="120.0" yMax="100.0">PDF&amp;text</word>
+        </line>
+      </block>
+    </flow>
+  </page>
+  <page width="612.000000" height="792.000000">
+  </page>
+</doc>
+</body>
+</html>
+"""
+
+
+MOCKED_PDFIMAGES_LIST = (
+    "page   num  type   width height color comp bpc  enc interp  object ID x-ppi y-ppi size ratio\n"
+    "--------------------------------------------------------------------------------------------\n"
+    "   2     0 image    1700  2200  gray    1   8  jpeg   no         9  0   200   200  312K 8.5%\n"
+)
+
+
+@patch('ocr._get_ocr_data')
+@patch('ocr.pdf_to_img')
+@patch('ocr.pdf_page_count', return_value=2)
+@patch('ocr.subprocess.run')
+def test_pdf_to_text_uses_embedded_text_layer(mock_run, mock_page_count, mock_pdf_to_img,
+                                              mock_get_ocr_data):
+    mock_run.side_effect = lambda command, **kwargs: MagicMock(
+        stdout=MOCKED_PDFTOTEXT_BBOX if command[0] == "pdftotext" else MOCKED_PDFIMAGES_LIST
+    )
+    mock_pdf_to_img.return_value = iter([(2, Image.new("RGB", (10, 10)))])
+    mock_get_ocr_data.return_value = {
+        "text": "scanned page\n", "ocr_data": [], "image_width": 1700, "image_height": 2200
+    }
+
+    render_options = ocr._pdf_render_options({"dpi": 144})
+    results = pdf_to_text("document.pdf", "en", (), render_options, use_text_layer=True)
+
+    assert mock_run.call_args_list[0].args[0][:2] == ["pdftotext", "-bbox-layout"]
+    # Only the page without a text layer is rasterized and OCR'd
+    assert list(mock_pdf_to_img.call_args.args[1]) == [2]
+    mock_get_ocr_data.assert_called_once()
+
+    first, second = results
+    assert first["text"] == "Born digital\nPDF&text\n\n"
+    assert first["text_source"] == "pdf_text_layer"
+    assert (first["image_width"], first["image_height"]) == (1224, 1584)
+    assert first["ocr_data"][0] == {
+        "level": 5, "page_num": 1, "block_num": 1, "par_num": 1, "line_num": 1, "word_num": 1,
+        "left": 144, "top": 144, "width": 72, "height": 28, "conf": 100.0, "text": "Born"
+    }
+    assert second["page_num"] == 2
+    assert second["text"] == "scanned page\n"
+    assert "text_source" not in second
+
+
+@patch('ocr.subprocess.run')
+def test_pdf_text_layer_ignores_header_on_scanned_page(mock_run):
+    # Page 1 is a full-page scan whose only text is the small digital header
+    listing = MOCKED_PDFIMAGES_LIST.replace("   2     0 image", "   1     0 image")
+    mock_run.side_effect = lambda command, **kwargs: MagicMock(
+        stdout=MOCKED_PDFTOTEXT_BBOX if command[0] == "pdftotext" else listing
+    )
+    assert ocr.pdf_image_coverage("document.pdf") == {1: pytest.approx(612 * 792)}
+    assert ocr.pdf_text_layer("document.pdf", 72) == {}
+
+    # A scan with an OCR'd text layer over most of it keeps using that layer
+    with patch.dict(app.config, {"PDF_TEXT_LAYER_MIN_COVERAGE": 0.001}):
+        assert list(ocr.pdf_text_layer("document.pdf", 72)) == [1]
+
+
+@patch('ocr.subprocess.run')
+def test_pdf_text_layer_reads_only_the_page_span(mock_run):
+    mock_run.side_effect = lambda command, **kwargs: MagicMock(
+        stdout=MOCKED_PDFTOTEXT_BBOX if command[0] == "pdftotext" else ""
+    )
+    # pdftotext numbers its output from the first page it was asked for
+    assert list(ocr.pdf_text_layer("document.pdf", 72, 7, 8)) == [7]
+    commands = [call.args[0] for call in mock_run.call_args_list]
+    assert commands[0][-6:] == ["-f", "7", "-l", "8", "document.pdf", "-"]
+    assert commands[1] == ["pdfimages", "-list", "-f", "7", "-l", "8", "document.pdf"]
+
+
+def _png_base64(size=(40, 20)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "white").save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._get_ocr_data')
+def test_process_single_ocr_task_caches_results_by_content(mock_get_ocr_data,
+                                                           mock_get_tesseract_version_string,
+                                                           client):
+    mock_get_ocr_data.return_value = {
+        "text": "Cached", "ocr_data": [], "image_width": 40, "image_height": 20
+    }
+    file_input = {"base64": _png_base64(), "filename": "image.png", "language": "en"}
+    _RESULT_CACHE.clear()
+    try:
+        first = _process_single_ocr_task(dict(file_input))
+        second = _process_single_ocr_task(dict(file_input, filename="renamed.png"))
+        other_language = _process_single_ocr_task(dict(file_input, language="fr"))
+    finally:
+        _RESULT_CACHE.clear()
+
+    assert first["error"] is None and first["cache_hit"] is False
+    assert second["cache_hit"] is True
+    assert second["text"] == "Cached"
+    assert second["cache_lookup_time"].endswith("ms")
+    assert second["image_base64"].startswith("data:image/png;base64,")
+    assert other_language["cache_hit"] is False
+    assert mock_get_ocr_data.call_count == 2
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._get_ocr_data')
+def test_result_cache_disk_tier_is_shared(mock_get_ocr_data, mock_get_tesseract_version_string,
+                                          client, tmp_path):
+    mock_get_ocr_data.return_value = {
+        "text": "On disk", "ocr_data": [], "image_width": 40, "image_height": 20
+    }
+    file_input = {"base64": _png_base64(), "filename": "image.png", "language": "en"}
+    app.config["OCR_CACHE_DIR"] = str(tmp_path)
+    _RESULT_CACHE.clear()
+    try:
+        _process_single_ocr_task(dict(file_input))
+        # Another worker starts with an empty memory tier
+        _RESULT_CACHE.clear()
+        result = _process_single_ocr_task(dict(file_input))
+    finally:
+        app.config["OCR_CACHE_DIR"] = ""
+        _RESULT_CACHE.clear()
+
+    assert result["cache_hit"] is True
+    assert result["text"] == "On disk"
+    assert mock_get_ocr_data.call_count == 1
+    assert list(tmp_path.glob("*/*.json.gz"))
+
+
+@patch('ocr.get_tesseract_version_string')
+@patch('ocr._get_ocr_data')
+def test_result_cache_key_covers_tesseract_version_and_traineddata(
+        mock_get_ocr_data, mock_get_tesseract_version_string, client, tmp_path):
+    mock_get_ocr_data.return_value = {
+        "text": "Cached", "ocr_data": [], "image_width": 40, "image_height": 20
+    }
+    mock_get_tesseract_version_string.return_value = "5.3.0"
+    traineddata = tmp_path / "eng.traineddata"
+    traineddata.write_bytes(b"model")
+    file_input = {"base64": _png_base64(), "filename": "image.png", "language": "en"}
+    _RESULT_CACHE.clear()
+    try:
+        with patch('ocr._cached_tesseract_info', return_value={"tessdata": str(tmp_path)}):
+            _process_single_ocr_task(dict(file_input))
+            assert _process_single_ocr_task(dict(file_input))["cache_hit"] is True
+            mock_get_tesseract_version_string.return_value = "5.4.1"
+            assert _process_single_ocr_task(dict(file_input))["cache_hit"] is False
+            traineddata.write_bytes(b"a retrained model")
+            assert _process_single_ocr_task(dict(file_input))["cache_hit"] is False
+    finally:
+        _RESULT_CACHE.clear()
+
+    assert mock_get_ocr_data.call_count == 3
+
+
+def test_result_cache_evicts_by_bytes(client):
+    _RESULT_CACHE.clear()
+    try:
+        with patch.dict(app.config, {"OCR_CACHE_MAX_BYTES": 250}):
+            for key in ("a", "b", "c"):
+                ocr._result_cache_put(key, {"text": key * 80, "ocr_data": []})
+            ocr._result_cache_put("huge", {"text": "x" * 1000, "ocr_data": []})
+            assert list(_RESULT_CACHE) == ["b", "c"]
+            assert ocr._result_cache_get("b")["text"] == "b" * 80
+    finally:
+        _RESULT_CACHE.clear()
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._ensure_job_workers')
+def test_async_ocr_full_queue_returns_429(mock_ensure_job_workers,
+                                          mock_get_tesseract_version_string, client):
+    app.config["JOB_QUEUE_SIZE"] = 1
+    try:
+        accepted = client.post(
+            '/api/async_ocr', json={"files": [{"url": "http://example.com/a.png"}]}
+        )
+        rejected = client.post(
+            '/api/async_ocr', json={"files": [{"url": "http://example.com/b.png"}]}
+        )
+    finally:
+        app.config["JOB_QUEUE_SIZE"] = 100
+        for job_id, _ in list(ocr.JOB_STORE.queue):
+            ocr.JOB_STORE.delete(job_id)
+
+    assert accepted.status_code == 202
+    assert rejected.status_code == 429
+    assert int(rejected.headers['Retry-After']) >= 1
+    assert json.loads(rejected.data)['error'] == "Job queue is full, retry later"
+
+
+@patch('ocr._process_single_ocr_task')
+def test_job_workers_run_queued_jobs(mock_process_single_ocr_task):
+    mock_process_single_ocr_task.return_value = {"text": "done", "error": None}
+    job_ids = [f"test-pool-job-{i}" for i in range(3)]
+    app.config["JOB_WORKERS"] = 2
+    try:
+        for job_id in job_ids:
+            job = {"job_id": job_id, "status": JOB_STATUS["PENDING"], "results": [], "error": None}
+            assert ocr._submit_job(job, [{"url": "http://example.com/a.png"}])
+        deadline = time.time() + 5
+        while time.time() < deadline and any(
+            OCR_JOBS[j]["status"] != JOB_STATUS["COMPLETED"] for j in job_ids
+        ):
+            time.sleep(0.01)
+        assert all(OCR_JOBS[j]["status"] == JOB_STATUS["COMPLETED"] for j in job_ids)
+        assert ocr._JOB_SCHEDULER["avg_job_seconds"] is not None
+    finally:
+        ocr._stop_job_workers(timeout=5)
+        app.config["JOB_WORKERS"] = os.cpu_count() or 1
+        for job_id in job_ids:
+            OCR_JOBS.pop(job_id, None)
+
+
+@patch('ocr._process_single_ocr_task')
+def test_process_ocr_job_fans_out_files_in_input_order(mock_process_single_ocr_task):
+    job_id = "test-fan-out-job-id"
+    files_payload = [{"url": f"http://example.com/{i}.png"} for i in range(5)]
+    release = threading.Event()
+    progress = []
+
+    def fake_task(file_input, task_job_id):
+        index = int(file_input["url"].rsplit("/", 1)[1].split(".")[0])
+        if index == 0:
+            # Hold the first file until the others have finished
+            release.wait(5)
+        else:
+            progress.append(index)
+            if len(progress) == 4:
+                release.set()
+        return {"text": f"file {index}", "error": None}
+
+    mock_process_single_ocr_task.side_effect = fake_task
+    OCR_JOBS[job_id] = {
+        "job_id": job_id, "status": JOB_STATUS["PENDING"], "results": [], "error": None
+    }
+    app.config["JOB_FILE_WORKERS"] = 3
+    try:
+        _process_ocr_job(job_id, files_payload)
+        job = OCR_JOBS[job_id]
+        assert job["status"] == JOB_STATUS["COMPLETED"]
+        assert [result["text"] for result in job["results"]] == [f"file {i}" for i in range(5)]
+        assert job["completed_files"] == job["total_files"] == 5
+    finally:
+        app.config["JOB_FILE_WORKERS"] = os.cpu_count() or 1
+        OCR_JOBS.pop(job_id, None)
+
+
+def test_sqlite_job_store_is_shared_between_workers(tmp_path):
+    from job_store import SQLiteJobStore
+    path = str(tmp_path / "jobs.db")
+    accepting_worker, other_worker = SQLiteJobStore(path), SQLiteJobStore(path)
+    for job_id in ("job-a", "job-b"):
+        job = {"job_id": job_id, "status": JOB_STATUS["PENDING"], "results": [], "error": None}
+        files = [{"url": f"http://example.com/{job_id}.png"}]
+        assert accepting_worker.create(job, files, max_queued=2)
+    full_job = {"job_id": "job-c", "status": JOB_STATUS["PENDING"], "results": [], "error": None}
+    assert not accepting_worker.create(full_job, [], max_queued=2)
+
+    assert other_worker.get("job-b")["status"] == JOB_STATUS["PENDING"]
+    assert other_worker.queue_position("job-b") == 2
+
+    job_id, files_payload = other_worker.claim(timeout=0)
+    assert job_id == "job-a"
+    assert files_payload == [{"url": "http://example.com/job-a.png"}]
+    assert accepting_worker.get("job-a")["status"] == JOB_STATUS["IN_PROGRESS"]
+    assert accepting_worker.queue_position("job-b") == 1
+
+    other_worker.update(
+        "job-a", status=JOB_STATUS["COMPLETED"], results=[{"text": "done"}, {"text": "too"}]
+    )
+    assert accepting_worker.get("job-a")["results"] == [{"text": "done"}, {"text": "too"}]
+    assert "results" not in accepting_worker.get("job-a", include_results=False)
+    # Results are stored per file, so a page of them reads only those rows
+    assert accepting_worker.get_results("job-a", 1, 5) == (2, [{"text": "too"}])
+    assert accepting_worker.get_results("job-x") is None
+    assert accepting_worker.claim(timeout=0)[0] == "job-b"
+    assert accepting_worker.claim(timeout=0) is None
+
+
+def test_sqlite_job_store_reclaims_abandoned_jobs(tmp_path):
+    from job_store import SQLiteJobStore
+    path = str(tmp_path / "jobs.db")
+    store = SQLiteJobStore(path, lease=60, max_attempts=2)
+    store.create(
+        {"job_id": "job-a", "status": JOB_STATUS["PENDING"], "results": []}, [{"url": "a.png"}], 10
+    )
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+
+    def abandon():
+        store._connection().execute(
+            "UPDATE jobs SET claimed_by = ? WHERE job_id = 'job-a'", (dead.pid,)
+        )
+
+    assert store.claim(timeout=0) == ("job-a", [{"url": "a.png"}])
+    # Claimed by a live process with a fresh heartbeat: nobody else takes it
+    assert store.claim(timeout=0) is None
+
+    # The claiming worker exited: the next claim takes the job over, payload and all
+    abandon()
+    assert store.claim(timeout=0) == ("job-a", [{"url": "a.png"}])
+    assert store.get("job-a")["status"] == JOB_STATUS["IN_PROGRESS"]
+
+    # A stale heartbeat counts as abandoned too, and after max_attempts claims the job fails
+    store._connection().execute("UPDATE jobs SET heartbeat = 0 WHERE job_id = 'job-a'")
+    assert store.claim(timeout=0) is None
+    job = store.get("job-a")
+    assert job["status"] == JOB_STATUS["FAILED"]
+    assert job["error"] == "Job was abandoned by 2 workers"
+
+    # Finished jobs drop their payload and are never reclaimed
+    store.create(
+        {"job_id": "job-b", "status": JOB_STATUS["PENDING"], "results": []}, [{"url": "b.png"}], 10
+    )
+    store.claim(timeout=0)
+    store.update("job-b", status=JOB_STATUS["COMPLETED"], results=[])
+    payload = store._connection().execute("SELECT payload FROM jobs WHERE job_id = 'job-b'")
+    assert payload.fetchone() == (None,)
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+def test_ocr_status_served_from_shared_job_store(mock_get_tesseract_version_string, client,
+                                                 tmp_path):
+    from job_store import SQLiteJobStore
+    path = str(tmp_path / "jobs.db")
+    accepting_worker = SQLiteJobStore(path)
+    accepting_worker.create(
+        {"job_id": "shared-job", "status": JOB_STATUS["PENDING"], "results": []}, [], 10
+    )
+    accepting_worker.update(
+        "shared-job", status=JOB_STATUS["COMPLETED"], results=[{"text": "Hello"}]
+    )
+    with patch('ocr.JOB_STORE', SQLiteJobStore(path)):
+        response = client.get('/api/ocr_status/shared-job?view=full')
+    assert response.status_code == 200
+    json_data = json.loads(response.data)
+    assert json_data['status'] == JOB_STATUS["COMPLETED"]
+    assert json_data['results'] == [{"text": "Hello"}]
+
+
+def test_memory_job_store_evicts_finished_jobs(tmp_path):
+    from job_store import MemoryJobStore
+    store = MemoryJobStore(max_jobs=2, max_result_bytes=60, spill_dir=str(tmp_path))
+    for job_id in ("job-a", "job-b", "job-c"):
+        store.create({"job_id": job_id, "status": JOB_STATUS["PENDING"], "results": []}, [], 10)
+        store.claim(timeout=0)
+    store.update("job-a", status=JOB_STATUS["COMPLETED"], results=[{"text": "a" * 20}])
+    store.update("job-b", status=JOB_STATUS["COMPLETED"], results=[{"text": "b" * 20}])
+
+    # Over the byte budget: the least recently polled job's results move to disk
+    assert store.jobs["job-a"]["results"] is None
+    assert store.jobs["job-b"]["results"] == [{"text": "b" * 20}]
+    assert store.get("job-a")["results"] == [{"text": "a" * 20}]
+    assert store.jobs["job-a"]["results"] is None
+    spill_files = list(tmp_path.iterdir())
+    assert len(spill_files) == 1
+    assert [path.name for path in spill_files[0].iterdir()] == ["0.json.gz"]
+    assert store.get_results("job-a", 0, 1) == (1, [{"text": "a" * 20}])
+    assert store.get_results("job-a", 1) == (1, [])
+
+    # Over the count cap: the least recently polled finished job is dropped
+    store.update("job-c", status=JOB_STATUS["FAILED"], error="boom")
+    assert store.get("job-b") is None
+    assert store.get("job-a")["results"] == [{"text": "a" * 20}]
+    assert store.get("job-c")["status"] == JOB_STATUS["FAILED"]
+
+    store.ttl = 0
+    store.finished["job-a"]["finished_at"] -= 1
+    assert store.get("job-a") is None
+    assert not spill_files[0].exists()
+
+
+def test_memory_job_store_serializes_results_outside_the_lock(tmp_path):
+    import job_store
+    from job_store import MemoryJobStore
+    store = MemoryJobStore(max_result_bytes=10, spill_dir=str(tmp_path))
+    store.create({"job_id": "job-a", "status": JOB_STATUS["PENDING"], "results": []}, [], 10)
+    held = []
+
+    def lock_is_free():
+        # Asked from another thread, since the store's condition is reentrant
+        free = []
+
+        def try_lock():
+            free.append(store.cond.acquire(blocking=False))
+            if free[0]:
+                store.cond.release()
+
+        probe = threading.Thread(target=try_lock)
+        probe.start()
+        probe.join()
+        return free[0]
+
+    real_dumps, real_dump = json.dumps, json.dump
+
+    def dumps(*args, **kwargs):
+        held.append(not lock_is_free())
+        return real_dumps(*args, **kwargs)
+
+    def dump(*args, **kwargs):
+        held.append(not lock_is_free())
+        return real_dump(*args, **kwargs)
+
+    with patch.object(job_store.json, "dumps", side_effect=dumps), \
+            patch.object(job_store.json, "dump", side_effect=dump):
+        store.update("job-a", status=JOB_STATUS["COMPLETED"], results=[{"text": "a" * 20}])
+    # Sized and spilled, both without holding the lock
+    assert held == [False, False]
+    assert store.jobs["job-a"]["results"] is None
+    assert store.get("job-a")["results"] == [{"text": "a" * 20}]
+
+
+def test_sqlite_job_store_expires_finished_jobs(tmp_path):
+    from job_store import SQLiteJobStore
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"), ttl=3600, max_jobs=1)
+    for job_id in ("job-a", "job-b"):
+        store.create({"job_id": job_id, "status": JOB_STATUS["PENDING"], "results": []}, [], 10)
+        store.update(job_id, status=JOB_STATUS["COMPLETED"])
+    store.create({"job_id": "job-c", "status": JOB_STATUS["PENDING"], "results": []}, [], 10)
+    assert store.get("job-a") is None
+    assert store.get("job-b")["status"] == JOB_STATUS["COMPLETED"]
+    assert store.get("job-c")["status"] == JOB_STATUS["PENDING"]
+
+    store.ttl = -1
+    assert store.get("job-b") is None
+
+
+def test_ocr_status_long_poll(client):
+    test_job_id = "test-long-poll-job-id"
+    OCR_JOBS[test_job_id] = {
+        "job_id": test_job_id, "status": JOB_STATUS["IN_PROGRESS"], "results": []
+    }
+    try:
+        response = client.get(f'/api/ocr_status/{test_job_id}')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert json.loads(response.data)['version'] == 0
+
+        response = client.get(
+            f'/api/ocr_status/{test_job_id}?wait=0.05', headers={'If-None-Match': etag}
+        )
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+
+        finish = threading.Timer(
+            0.1, ocr.JOB_STORE.update, args=(test_job_id,),
+            kwargs={"status": JOB_STATUS["COMPLETED"], "results": [{"text": "Hello"}]}
+        )
+        finish.start()
+        response = client.get(
+            f'/api/ocr_status/{test_job_id}?wait=5', headers={'If-None-Match': etag}
+        )
+        finish.join()
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        json_data = json.loads(response.data)
+        assert json_data['status'] == JOB_STATUS["COMPLETED"]
+        assert json_data['version'] == 1
+
+        assert client.get(f'/api/ocr_status/{test_job_id}?version=1').status_code == 304
+    finally:
+        ocr.JOB_STORE.delete(test_job_id)
+
+
+def test_ocr_events_stream(client):
+    test_job_id = "test-events-job-id"
+    OCR_JOBS[test_job_id] = {
+        "job_id": test_job_id, "status": JOB_STATUS["IN_PROGRESS"], "results": []
+    }
+    finish = threading.Timer(
+        0.1, ocr.JOB_STORE.update, args=(test_job_id,),
+        kwargs={"status": JOB_STATUS["COMPLETED"], "results": [{"text": "Hello"}]}
+    )
+    try:
+        finish.start()
+        response = client.get(f'/api/ocr_events/{test_job_id}')
+        finish.join()
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        events = [
+            event for event in response.get_data(as_text=True).split("\n\n")
+            if event.startswith("id:")
+        ]
+        statuses = [json.loads(event.split("data: ", 1)[1])["status"] for event in events]
+        assert statuses == [JOB_STATUS["IN_PROGRESS"], JOB_STATUS["COMPLETED"]]
+    finally:
+        ocr.JOB_STORE.delete(test_job_id)
+
+    assert client.get('/api/ocr_events/non-existent-job-id').status_code == 404
+
+
+def test_ocr_events_stream_for_several_jobs(client):
+    first, second = "test-events-job-1", "test-events-job-2"
+    for job_id in (first, second):
+        OCR_JOBS[job_id] = {"job_id": job_id, "status": JOB_STATUS["IN_PROGRESS"], "results": []}
+    finish_first = threading.Timer(
+        0.1, ocr.JOB_STORE.update, args=(first,), kwargs={"status": JOB_STATUS["COMPLETED"]}
+    )
+    finish_second = threading.Timer(
+        0.2, ocr.JOB_STORE.update, args=(second,), kwargs={"status": JOB_STATUS["FAILED"]}
+    )
+    try:
+        finish_first.start()
+        finish_second.start()
+        response = client.get(f'/api/ocr_events?job_ids={first},missing-job,{second}')
+        assert response.status_code == 200
+        events = [
+            event for event in response.get_data(as_text=True).split("\n\n") if "data: " in event
+        ]
+        finish_first.join()
+        finish_second.join()
+        updates = [json.loads(event.split("data: ", 1)[1]) for event in events]
+        assert [(update["job_id"], update["status"]) for update in updates] == [
+            (first, JOB_STATUS["IN_PROGRESS"]), ("missing-job", "not_found"),
+            (second, JOB_STATUS["IN_PROGRESS"]),
+            (first, JOB_STATUS["COMPLETED"]), (second, JOB_STATUS["FAILED"]),
+        ]
+        # The last event id names the final state of both jobs,
+        # so reconnecting with it sends nothing new
+        last_event = [event for event in events if event.startswith("id: ")][-1]
+        last_id = last_event.split("\n")[0][len("id: "):]
+        assert len(last_id.split(",")) == 2
+        response = client.get(
+            f'/api/ocr_events?job_ids={first},{second}', headers={"Last-Event-ID": last_id}
+        )
+        assert "data: " not in response.get_data(as_text=True)
+    finally:
+        ocr.JOB_STORE.delete(first)
+        ocr.JOB_STORE.delete(second)
+
+    assert client.get('/api/ocr_events?job_ids=').status_code == 400
+
+
+def test_ocr_status_summary_and_paginated_results(client):
+    test_job_id = "test-results-job-id"
+    page = {"page_num": 1,
+            "ocr_data": [{"text": "Hello", "left": 1, "top": 2, "width": 3, "height": 4}],
+            "image_width": 10, "image_height": 20}
+    results = [
+        {"filename": "one.pdf", "text": "Hello", "error": None, "duration": "1.00ms",
+         "ocr_data": [page, {**page, "page_num": 2}, {**page, "page_num": 3}]},
+        {"filename": "two.png", "text": "World", "error": None, "duration": "2.00ms",
+         "ocr_data": [page]},
+    ]
+    OCR_JOBS[test_job_id] = {
+        "job_id": test_job_id, "status": JOB_STATUS["IN_PROGRESS"], "results": []
+    }
+    try:
+        assert client.get(f'/api/ocr_results/{test_job_id}').status_code == 409
+
+        ocr.JOB_STORE.update(test_job_id, status=JOB_STATUS["COMPLETED"], results=results,
+                             result_summaries=[ocr._result_summary(result) for result in results])
+        json_data = json.loads(client.get(f'/api/ocr_status/{test_job_id}').data)
+        assert json_data['status'] == JOB_STATUS["COMPLETED"]
+        assert json_data['results'] == [
+            {"filename": "one.pdf", "error": None, "duration": "1.00ms", "page_count": 3},
+            {"filename": "two.png", "error": None, "duration": "2.00ms", "page_count": 1},
+        ]
+        full = json.loads(client.get(f'/api/ocr_status/{test_job_id}?view=full').data)
+        assert 'result_summaries' not in full
+
+        response = client.get(f'/api/ocr_results/{test_job_id}?offset=1&limit=1&fields=text')
+        json_data = json.loads(response.data)
+        assert json_data['total_files'] == 2
+        assert json_data['results'] == [{"file_index": 1, "text": "World"}]
+
+        response = client.get(f'/api/ocr_results/{test_job_id}/0?offset=1&limit=1&boxes=0')
+        json_data = json.loads(response.data)
+        assert json_data['total_pages'] == 3
+        assert json_data['text'] == "Hello"
+        assert json_data['ocr_data'] == [{"page_num": 2, "image_width": 10, "image_height": 20}]
+
+        assert client.get(f'/api/ocr_results/{test_job_id}/2').status_code == 404
+    finally:
+        ocr.JOB_STORE.delete(test_job_id)
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._ocr_file', return_value={"text": "Hello", "ocr_data": []})
+def test_image_output_url_and_thumbnail(mock_ocr_file, mock_get_tesseract_version_string, client):
+    image = Image.new("RGB", (2000, 1000), "white")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    file_input = {
+        "filename": "page.png", "base64": base64.b64encode(buffer.getvalue()).decode("ascii")
+    }
+    digest = hashlib.sha256(buffer.getvalue()).hexdigest()
+
+    result = _process_single_ocr_task({**file_input, "image_output": "url"})
+    assert result["error"] is None
+    assert result["image_base64"] is None
+    assert result["image_url"] == f"/api/artifacts/img_{digest}.png"
+    response = client.get(result["image_url"])
+    assert response.status_code == 200
+    assert response.data == buffer.getvalue()
+    assert "immutable" in response.headers["Cache-Control"]
+
+    result = _process_single_ocr_task({**file_input, "image_output": "thumbnail"})
+    response = client.get(result["image_url"])
+    assert response.status_code == 200
+    thumbnail_size = app.config["THUMBNAIL_SIZE"]
+    assert Image.open(io.BytesIO(response.data)).size == (thumbnail_size, thumbnail_size // 2)
+
+    rejected = _process_single_ocr_task({**file_input, "image_output": "inline"})
+    assert "image_output" in rejected["error"]
+    assert client.get('/api/artifacts/..%2Focr.py').status_code == 404
+
+    with patch.dict(app.config, {"ARTIFACT_MAX_AGE": -1}):
+        assert client.get(result["image_url"]).status_code == 404
+    assert client.get(f"/api/artifacts/img_{digest}.png").status_code == 200
+    os.remove(os.path.join(app.config["UPLOAD_FOLDER"], f"img_{digest}.png"))
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._ocr_file', return_value={"text": "Hello", "ocr_data": []})
+def test_pdf_artifacts_stored_once_per_content(mock_ocr_file, mock_get_tesseract_version_string,
+                                               client):
+    pdf_bytes = b"%PDF-1.4 artifact test " + os.urandom(8)
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    artifact_path = os.path.join(app.config["UPLOAD_FOLDER"], f"ocr_{digest}.pdf")
+    before = set(os.listdir(app.config["UPLOAD_FOLDER"]))
+    file_input = {"filename": "doc.pdf", "base64": base64.b64encode(pdf_bytes).decode("ascii")}
+
+    # Our own temp file is moved into place, and a second upload of the same bytes reuses it
+    for _ in range(2):
+        result = _process_single_ocr_task(file_input)
+        assert result["error"] is None
+        assert result["source"] == f"/api/artifacts/ocr_{digest}.pdf"
+    assert set(os.listdir(app.config["UPLOAD_FOLDER"])) - before == {f"ocr_{digest}.pdf"}
+    assert client.get(result["source"]).data == pdf_bytes
+
+    # A caller's file is copied and left untouched, mtime included
+    os.remove(artifact_path)
+    caller_path = os.path.join(app.config["UPLOAD_FOLDER"], "caller.pdf")
+    with open(caller_path, "wb") as f:
+        f.write(pdf_bytes)
+    os.utime(caller_path, (1000000000, 1000000000))
+    try:
+        for _ in range(2):
+            result = _process_single_ocr_task({"filepath": caller_path, "filename": "doc.pdf"})
+            assert result["source"] == f"/api/artifacts/ocr_{digest}.pdf"
+        assert os.stat(artifact_path).st_ino != os.stat(caller_path).st_ino
+        assert os.path.getmtime(caller_path) == 1000000000
+        with open(caller_path, "ab") as f:
+            f.write(b"edited")
+        assert client.get(result["source"]).data == pdf_bytes
+    finally:
+        os.remove(caller_path)
+        os.remove(artifact_path)
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._ocr_file', return_value={"text": "Hello", "ocr_data": []})
+def test_api_ocr_moves_its_spooled_pdf_into_the_artifacts(mock_ocr_file,
+                                                          mock_get_tesseract_version_string,
+                                                          client):
+    pdf_bytes = b"%PDF-1.4 upload test " + os.urandom(8)
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    artifact_path = os.path.join(app.config["UPLOAD_FOLDER"], f"ocr_{digest}.pdf")
+    try:
+        with patch('ocr.shutil.copyfile') as mock_copyfile, \
+                patch('ocr.os.remove', wraps=os.remove) as mock_remove:
+            response = client.post('/api/ocr', data={"file": (io.BytesIO(pdf_bytes), "doc.pdf")})
+        assert response.get_json()["source"] == f"/api/artifacts/ocr_{digest}.pdf"
+        mock_copyfile.assert_not_called()
+        mock_remove.assert_not_called()
+        assert client.get(f"/api/artifacts/ocr_{digest}.pdf").data == pdf_bytes
+    finally:
+        os.remove(artifact_path)
+
+
+def test_sweep_artifacts_expires_and_enforces_quota(tmp_path):
+    now = time.time()
+    files = {
+        f"ocr_{'a' * 64}.pdf": now - 7200,          # expired
+        f"ocr_{'b' * 32}_legacy.pdf": now - 7200,   # expired, written by an earlier version
+        f"img_{'c' * 64}.png": now - 60,            # oldest of the rest, over quota
+        f"thumb_{'d' * 64}_1024.jpg": now - 30,
+        f"ocr_{'e' * 64}.pdf": now - 10,
+        "unrelated.pdf": now - 7200,                # not ours
+    }
+    for name, mtime in files.items():
+        (tmp_path / name).write_bytes(b"x" * 100)
+        os.utime(tmp_path / name, (mtime, mtime))
+
+    limits = {"UPLOAD_FOLDER": str(tmp_path), "ARTIFACT_MAX_AGE": 3600, "ARTIFACT_MAX_BYTES": 250}
+    with patch.dict(app.config, limits):
+        ocr._sweep_artifacts()
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [f"thumb_{'d' * 64}_1024.jpg", f"ocr_{'e' * 64}.pdf", "unrelated.pdf"]
+    )
+
+
+def test_spool_input_keeps_small_images_in_memory(client):
+    data, path = ocr._spool_input([b"abc", b"def"], ".png")
+    assert (data, path) == (b"abcdef", None)
+
+    with patch.dict(app.config, {"UPLOAD_SPOOL_THRESHOLD": 4}):
+        data, path = ocr._spool_input([b"abc", b"def"], ".png")
+    assert data is None
+    with open(path, "rb") as f:
+        assert f.read() == b"abcdef"
+    os.remove(path)
+
+    # The poppler tools need a path, so PDFs always go to disk
+    data, path = ocr._spool_input([b"%PDF"], ".pdf")
+    assert data is None and path.endswith(".pdf")
+    os.remove(path)
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._get_ocr_data',
+       return_value={"text": "Hello", "ocr_data": [], "image_width": 20, "image_height": 10})
+def test_api_ocr_image_upload_decoded_from_memory(mock_get_ocr_data,
+                                                  mock_get_tesseract_version_string, client):
+    buffer = io.BytesIO()
+    Image.new("RGB", (20, 10), "white").save(buffer, "PNG")
+    before = set(os.listdir(app.config["UPLOAD_FOLDER"]))
+
+    with patch('ocr.tempfile.NamedTemporaryFile', side_effect=AssertionError("wrote a temp file")):
+        response = client.post('/api/ocr',
+                               data={'file': (io.BytesIO(buffer.getvalue()), 'small.png'),
+                                     'language': 'en'},
+                               content_type='multipart/form-data')
+    assert response.status_code == 200
+    json_data = json.loads(response.data)
+    assert json_data['text'] == "Hello"
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    assert json_data['image_base64'] == "data:image/png;base64," + encoded
+    assert mock_get_ocr_data.call_args[0][0].size == (20, 10)
+    assert set(os.listdir(app.config["UPLOAD_FOLDER"])) == before
+
+
+@pytest.fixture
+def http_origin():
+    # Local stand-in for remote URL inputs
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    buffer = io.BytesIO()
+    Image.new("RGB", (20, 10), "white").save(buffer, "PNG")
+    origin = {"png": buffer.getvalue(), "requests": [], "failures": 1, "delay": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            origin["requests"].append((self.path, self.client_address[1]))
+            time.sleep(origin["delay"])
+            if self.path == "/flaky.png" and origin["failures"] > 0:
+                origin["failures"] -= 1
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = b"x" * 5000 if self.path in ("/big.png", "/unsized.png") else origin["png"]
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            if self.path == "/unsized.png":
+                self.close_connection = True
+            else:
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.handle_error = lambda request, client_address: None  # Clients hanging up on purpose
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    origin["url"] = f"http://127.0.0.1:{server.server_address[1]}"
+    yield origin
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_url_pools_retries_and_limits(http_origin, client):
+    with patch.dict(app.config, {"FETCH_BACKOFF": 0, "FETCH_MAX_BYTES": 1000}):
+        for _ in range(2):
+            fetched = ocr._fetch_url(http_origin["url"] + "/page.png")
+            assert fetched.pop("seconds") > 0
+            assert fetched == {"data": http_origin["png"], "path": None, "suffix": ".png"}
+        # Both requests went over the same kept-alive connection
+        assert http_origin["requests"][0][1] == http_origin["requests"][1][1]
+
+        assert ocr._fetch_url(http_origin["url"] + "/flaky.png")["data"] == http_origin["png"]
+        assert [path for path, _ in http_origin["requests"]].count("/flaky.png") == 2
+
+        for path in ("/big.png", "/unsized.png"):
+            with patch.dict(app.config, {"FETCH_MAX_BYTES": 100}):
+                with pytest.raises(ValueError, match="maximum size"):
+                    ocr._fetch_url(http_origin["url"] + path)
+
+        with patch.dict(app.config, {"FETCH_TOTAL_TIMEOUT": 0}):
+            with pytest.raises(ValueError, match="longer than 0 seconds"):
+                ocr._fetch_url(http_origin["url"] + "/page.png")
+
+    with patch.dict(app.config, {"FETCH_READ_TIMEOUT": 0.1, "FETCH_RETRIES": 0}):
+        http_origin["delay"] = 0.5
+        result = _process_single_ocr_task({"url": http_origin["url"] + "/page.png"})
+        assert result["error"].startswith("Failed to download URL")
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._ocr_file', return_value={"text": "Hello", "ocr_data": []})
+def test_async_job_prefetches_urls_concurrently(mock_ocr_file, mock_get_tesseract_version_string,
+                                                http_origin, client):
+    job_id = "test-prefetch-job-id"
+    OCR_JOBS[job_id] = {"job_id": job_id, "status": JOB_STATUS["PENDING"], "results": []}
+    http_origin["delay"] = 0.4
+    files_payload = [
+        {"url": http_origin["url"] + f"/page.png?n={n}", "language": "en"} for n in range(3)
+    ]
+    try:
+        with patch.dict(app.config, {"JOB_FILE_WORKERS": 1, "FETCH_WORKERS": 3}):
+            started = time.perf_counter()
+            _process_ocr_job(job_id, files_payload)
+            elapsed = time.perf_counter() - started
+        job = ocr.JOB_STORE.get(job_id)
+        assert job["status"] == JOB_STATUS["COMPLETED"]
+        assert [result["error"] for result in job["results"]] == [None] * 3
+        assert [result["text"] for result in job["results"]] == ["Hello"] * 3
+        assert all(result["error"] is None for result in job["results"])
+        # OCR runs one file at a time, but the downloads overlapped
+        assert elapsed < 1.0
+    finally:
+        ocr.JOB_STORE.delete(job_id)
+
+
+@patch('ocr._fetch_url')
+def test_prefetch_window_bounds_downloads_ahead(mock_fetch_url):
+    mock_fetch_url.side_effect = lambda url: {"data": url.encode(), "path": None, "suffix": ".png"}
+    files_payload = [{"url": f"http://example.com/{n}.png"} for n in range(4)]
+    files_payload.append({"base64": "", "filename": "a.png"})
+    with patch.dict(app.config, {"FETCH_PREFETCH_WINDOW": 2}):
+        entries, window = ocr._prefetch_urls(files_payload)
+    assert "prefetch" not in entries[4]
+    assert sorted(window.started) == [0, 1] and len(window.waiting) == 2
+
+    # Taking a download starts the next one; a file the window hadn't reached is fetched on the spot
+    assert entries[0]["prefetch"]()["data"] == b"http://example.com/0.png"
+    assert sorted(window.started) == [1, 2]
+    assert entries[3]["prefetch"]()["data"] == b"http://example.com/3.png"
+    assert sorted(window.started) == [1, 2] and not window.waiting
+
+    window.close()
+    assert not window.started
+    assert sorted(call.args[0] for call in mock_fetch_url.call_args_list) == [
+        f"http://example.com/{n}.png" for n in range(4)
+    ]
+
+
+@patch('ocr.tesserocr', None)
+@patch('ocr._run_tesseract_cli')
+def test_get_ocr_data_columns_format(mock_run_multiple):
+    numeric_tsv = MOCKED_TSV + b"5\t1\t1\t1\t1\t3\t140\t10\t30\t20\t88\t2024\n"
+    mock_run_multiple.return_value = [b"Hello world 2024\n", numeric_tsv]
+
+    results = _get_ocr_data(Image.new("RGB", (200, 100), "white"), "en", (), "columns")
+    assert results["ocr_data"] == {
+        "level": [5, 5, 5], "page_num": [1, 1, 1], "block_num": [1, 1, 1], "par_num": [1, 1, 1],
+        "line_num": [1, 1, 1], "word_num": [1, 2, 3], "left": [10, 70, 140], "top": [10, 10, 10],
+        "width": [50, 60, 30], "height": [20, 20, 20], "conf": [96.5, 91.25, 88.0],
+        "text": ["Hello", "world", "2024"]
+    }
+    records = _get_ocr_data(Image.new("RGB", (200, 100)), "en")["ocr_data"]
+    assert ocr._ocr_data_records(results["ocr_data"]) == records
+
+    with pytest.raises(ValueError, match="ocr_data_format"):
+        ocr._ocr_data_format({"ocr_data_format": "table"})
+
+
+def test_import_defers_heavy_modules():
+    import sys
+    heavy = ["pdf2image", "pytesseract", "requests", "langcodes"]
+    probe = f"import sys, ocr; print([name for name in {heavy!r} if name in sys.modules])"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", probe], cwd=root, check=True, capture_output=True, text=True
+    ).stdout
+    assert output.strip() == "[]"
+
+    ocr.load_heavy_modules()
+    assert ocr.pytesseract.Output is __import__("pytesseract").Output
+
+
+def test_omp_thread_limit_with_any_parallelism():
+    import sys
+    probe = "import os, ocr; print(os.environ.get('OMP_THREAD_LIMIT'))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    serial = {"OCR_PAGE_WORKERS": "1", "JOB_WORKERS": "1", "JOB_FILE_WORKERS": "1",
+              "SYNC_OCR_WORKERS": "1", "OCR_PROCESSES": "1"}
+    base_env = {key: value for key, value in os.environ.items() if key != "OMP_THREAD_LIMIT"}
+    for parallel in (None, *serial):
+        env = {**base_env, **serial, **({parallel: "2"} if parallel else {})}
+        output = subprocess.run([sys.executable, "-c", probe], cwd=root, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        assert output.strip() == ("1" if parallel else "None"), parallel
+
+
+def test_gunicorn_workers_flag_sizes_the_job_pools(tmp_path):
+    import sys
+    # Loads gunicorn.conf.py the way `gunicorn --workers=N` does, then runs a worker's init hook
+    probe = (
+        "import os, sys, types\n"
+        "from gunicorn.app.wsgiapp import WSGIApplication\n"
+        "sys.argv = ['gunicorn', '--workers=' + os.environ['PROBE_WORKERS']]\n"
+        "cfg = WSGIApplication().cfg\n"
+        "cfg.post_worker_init(types.SimpleNamespace(cfg=cfg))\n"
+        "import ocr\n"
+        "keys = ('OCR_PROCESSES', 'JOB_WORKERS', 'JOB_FILE_WORKERS', 'SYNC_OCR_WORKERS')\n"
+        "print(*(ocr.app.config[key] for key in keys))\n"
+        "sys.stdout.flush()\n"
+        "os._exit(0)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    unset = ("OCR_PROCESSES", "JOB_WORKERS", "JOB_FILE_WORKERS", "SYNC_OCR_WORKERS",
+             "GUNICORN_WORKERS", "GUNICORN_CMD_ARGS")
+    base_env = {key: value for key, value in os.environ.items() if key not in unset}
+    cores = os.cpu_count() or 1
+    for workers, pool in ((1, cores), (2 * cores, 1)):
+        env = {**base_env, "PROBE_WORKERS": str(workers), "METRICS_DIR": str(tmp_path)}
+        output = subprocess.run([sys.executable, "-c", probe], cwd=root, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        assert output.split() == [str(workers), str(pool), str(pool), str(pool)]
+
+
+def test_sync_ocr_runs_at_most_sync_ocr_workers_at_once(client):
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def fake_task(file_input, **kwargs):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return {"error": None, "text": file_input["name"]}
+
+    with patch.dict(app.config, {"SYNC_OCR_WORKERS": 2}), \
+            patch('ocr._process_single_ocr_task', fake_task):
+        results = {}
+        threads = [
+            threading.Thread(
+                target=lambda n=n: results.update({n: ocr._run_sync_ocr({"name": n})["text"]})
+            )
+            for n in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == {n: n for n in range(6)}
+    assert peak[0] == 2
+
+
+def _metric_value(body: str, series: str) -> float:
+    for line in body.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr.tesserocr', None)
+@patch('ocr._run_tesseract_cli')
+def test_metrics_endpoint_reports_stage_timings(mock_run_multiple, mock_version, client):
+    mock_run_multiple.return_value = [b"Hello world\n", MOCKED_TSV]
+    ocr_stage = 'ocr_stage_seconds_count{input_type="png",language="en",stage="ocr"}'
+    decode_stage = 'ocr_stage_seconds_count{input_type="png",language="en",stage="decode"}'
+    runs = 'ocr_tesseract_runs_total{engine="subprocess"}'
+    before = client.get("/metrics").get_data(as_text=True)
+
+    image = io.BytesIO()
+    Image.new("RGB", (64, 32), (int(time.time() * 1000) % 256, 7, 7)).save(image, "PNG")
+    for _ in range(2):
+        image.seek(0)
+        response = client.post(
+            "/api/ocr",
+            data={"file": (io.BytesIO(image.getvalue()), "metrics.png"), "language": "en"}
+        )
+        assert response.status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    body = response.get_data(as_text=True)
+    assert "# TYPE ocr_stage_seconds histogram" in body
+    # The second upload is answered by the cache, so only the first one is decoded and OCR'd
+    assert _metric_value(body, ocr_stage) - _metric_value(before, ocr_stage) == 1
+    assert _metric_value(body, decode_stage) - _metric_value(before, decode_stage) == 1
+    assert _metric_value(body, runs) - _metric_value(before, runs) == 1
+    for result in ("miss", "memory"):
+        series = f'ocr_cache_lookups_total{{result="{result}"}}'
+        assert _metric_value(body, series) - _metric_value(before, series) == 1
+    assert 'ocr_stage_seconds_bucket{input_type="png",language="en",stage="ocr",le="+Inf"}' in body
+    assert _metric_value(body, "ocr_tesseract_subprocesses") == 0
+    assert _metric_value(body, "ocr_worker_processes") == 1
+
+
+def test_metrics_aggregate_worker_snapshots(client, tmp_path):
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    labels = [["input_type", "pdf"], ["language", "en"], ["outcome", "ok"]]
+    other = {"pid": os.getppid(), "counters": [["ocr_files_total", labels, 3]],
+             "gauges": [["ocr_job_workers_active", [], 2]], "histograms": []}
+    exited = {**other, "pid": dead.pid, "gauges": [["ocr_job_workers_active", [], 5]]}
+    for snapshot in (other, exited):
+        (tmp_path / f"metrics_{snapshot['pid']}.json").write_text(json.dumps(snapshot))
+    series = 'ocr_files_total{input_type="pdf",language="en",outcome="ok"}'
+    local = client.get("/metrics").get_data(as_text=True)
+
+    with patch.dict(app.config, {"METRICS_DIR": str(tmp_path)}):
+        for _ in range(2):
+            body = client.get("/metrics").get_data(as_text=True)
+            # The exited worker's counters are kept, its gauges are not
+            assert _metric_value(body, series) == _metric_value(local, series) + 6
+            active = _metric_value(local, "ocr_job_workers_active")
+            assert _metric_value(body, "ocr_job_workers_active") == active + 2
+            assert _metric_value(body, "ocr_worker_processes") == 2
+
+    assert not (tmp_path / f"metrics_{dead.pid}.json").exists()
+    assert (tmp_path / f"metrics_{os.getpid()}.json").exists()
+    assert json.loads((tmp_path / "metrics_retired.json").read_text())["counters"][0][2] == 3
+
+
+def test_preprocess_downscales_and_maps_boxes_back(client):
+    seen = []
+
+    def fake_get_ocr_data(image, language, output_formats=(), ocr_data_format="records"):
+        seen.append((image.mode, image.size))
+        words = [{"left": 100, "top": 50, "width": 200, "height": 40, "text": "Hello"}]
+        if ocr_data_format == "columns":
+            ocr_data = {key: [words[0][key]] for key in words[0]}
+        else:
+            ocr_data = words
+        return {
+            "text": "Hello", "ocr_data": ocr_data, "image_width": image.width,
+            "image_height": image.height
+        }
+
+    scan = Image.new("RGB", (4000, 3000), "white")
+    scan.info["dpi"] = (600, 600)
+    options = ocr._preprocess_options({"preprocess": "1"})
+    with patch('ocr._get_ocr_data', side_effect=fake_get_ocr_data), \
+            patch.dict(app.config,
+                       {"PREPROCESS_TARGET_DPI": 300, "PREPROCESS_MAX_PIXELS": 8_000_000}):
+        results = ocr._ocr_image(scan, "en", (), "records", options)
+        assert seen.pop() == ("L", (2000, 1500))
+        assert (results["image_width"], results["image_height"]) == (4000, 3000)
+        assert {key: results["ocr_data"][0][key] for key in ("left", "top", "width", "height")} == {
+            "left": 200, "top": 100, "width": 400, "height": 80
+        }
+
+        columns = ocr._ocr_image(scan, "en", (), "columns", options)["ocr_data"]
+        assert (columns["left"], columns["width"]) == ([200], [400])
+
+        # No DPI to go by: only the pixel cap applies
+        photo = Image.new("RGB", (4000, 3000), "white")
+        with patch.dict(app.config, {"PREPROCESS_MAX_PIXELS": 3_000_000}):
+            ocr._ocr_image(photo, "en", (), "records", options)
+        assert seen.pop() == ("L", (2000, 1500))
+
+        # hOCR/ALTO coordinates can't be mapped back, so those requests keep the full size
+        ocr._ocr_image(scan, "en", ["hocr"], "records", options)
+        assert seen.pop() == ("L", (4000, 3000))
+
+        # A portrait photo stored sideways with EXIF orientation 6 is OCR'd and reported upright
+        rotated = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new("RGB", (300, 200), "white").save(rotated, "JPEG", exif=exif)
+        results = ocr._ocr_image(Image.open(rotated), "en", (), "records", options)
+        assert seen.pop() == ("L", (200, 300))
+        assert (results["image_width"], results["image_height"]) == (200, 300)
+
+        # Off by default
+        ocr._ocr_image(scan, "en", (), "records", ocr._preprocess_options({}))
+        assert seen.pop() == ("RGB", (4000, 3000))
+
+    with pytest.raises(ValueError, match="binarize"):
+        ocr._preprocess_options({"binarize": "adaptive"})
+
+
+def test_binarize_otsu_and_sauvola():
+    np = pytest.importorskip("numpy")
+    # Dark text-like bars on a background that brightens from left to right
+    background = np.tile(np.linspace(90, 250, 200), (100, 1))
+    background[40:60, 20:40] = 20
+    background[40:60, 160:180] = 60
+    image = Image.fromarray(background.astype(np.uint8))
+
+    assert ocr._preprocess_options({"binarize": "otsu"}) == {"enabled": True, "binarize": "otsu"}
+    for method in ("otsu", "sauvola"):
+        binary = np.asarray(ocr._binarize(image, method))
+        assert set(np.unique(binary)) <= {0, 255}
+        assert (binary[40:60, 20:40] == 0).all() and (binary[40:60, 160:180] == 0).all()
+    # The dim left edge falls below Otsu's global threshold;
+    # Sauvola compares each pixel with its surroundings
+    assert (np.asarray(ocr._binarize(image, "otsu"))[:, :10] == 0).all()
+    assert (np.asarray(ocr._binarize(image, "sauvola"))[5:35, 60:150] == 255).all()
+
+
+@pytest.mark.parametrize("fmt", ["TIFF", "GIF", "WEBP"])
+def test_multi_frame_images_are_ocrd_as_pages(fmt, client):
+    frames = [Image.new("RGB", (40 + 10 * i, 30), (60 * i, 0, 0)) for i in range(3)]
+    if fmt != "TIFF":
+        frames = [frame.resize((60, 30)) for frame in frames]  # animation frames share the canvas
+    image_file = io.BytesIO()
+    frames[0].save(image_file, fmt, save_all=True, append_images=frames[1:])
+    seen = []
+
+    def fake_get_ocr_data(image, language, output_formats=(), ocr_data_format="records"):
+        seen.append((image.size, image.getpixel((0, 0))))
+        return {
+            "text": f"frame {len(seen)}", "ocr_data": [], "image_width": image.width,
+            "image_height": image.height
+        }
+
+    with patch('ocr._get_ocr_data', side_effect=fake_get_ocr_data):
+        for workers in (1, 2):
+            seen.clear()
+            with patch.dict(app.config, {"OCR_PAGE_WORKERS": workers}):
+                results = ocr._ocr_file(
+                    io.BytesIO(image_file.getvalue()), fmt.lower(), "en", [], {}, False
+                )
+            assert [page["page_num"] for page in results["ocr_data"]] == [1, 2, 3]
+            assert len(seen) == 3 and len({pixel for _, pixel in seen}) == 3
+            assert results["text"].count("frame") == 3
+        if fmt == "TIFF":
+            assert [page["image_width"] for page in results["ocr_data"]] == [40, 50, 60]
+
+        # Single-frame images keep their one-page result
+        single = io.BytesIO()
+        frames[0].save(single, fmt)
+        results = ocr._ocr_file(single, fmt.lower(), "en", [], {}, False)
+        assert [page["page_num"] for page in results["ocr_data"]] == [1]
+
+
+def test_page_ranges_and_crops_parse():
+    assert ocr._parse_pages("1-3, 5,9-") == [(1, 3), (5, 5), (9, None)]
+    assert ocr._parse_pages([2, "4-5"]) == [(2, 2), (4, 5)]
+    assert ocr._parse_pages(None) is None
+    assert ocr._select_pages([(1, 3), (5, 5), (9, None)], 10) == [1, 2, 3, 5, 9, 10]
+    assert ocr._select_pages([(2, 50)], 4) == [2, 3, 4]
+    assert ocr._select_pages(None, 3) == [1, 2, 3]
+    for bad in ("0", "3-1", "a", "1,,2"):
+        with pytest.raises(ValueError, match="page range"):
+            ocr._parse_pages(bad)
+    with pytest.raises(ValueError, match="No pages selected"):
+        ocr._select_pages([(7, None)], 3)
+
+    assert ocr._parse_crop("10,20,30,40") == [10, 20, 30, 40]
+    crop = {"left": 0.5, "top": 0, "width": 0.5, "height": 0.25}
+    assert ocr._parse_crop(crop) == [0.5, 0, 0.5, 0.25]
+    for bad in ("1,2,3", "1,2,0,4", "-1,0,5,5", "a,b,c,d"):
+        with pytest.raises(ValueError, match="crop"):
+            ocr._parse_crop(bad)
+    # Pixels, clipped to the page, or fractions of it when every value is at most 1
+    assert ocr._crop_box([10, 20, 500, 40], 200, 100) == (10, 20, 200, 60)
+    assert ocr._crop_box([0.5, 0, 0.5, 0.25], 200, 100) == (100, 0, 200, 25)
+    with pytest.raises(ValueError, match="outside"):
+        ocr._crop_box([300, 0, 10, 10], 200, 100)
+
+
+@patch('ocr.pdf2image.convert_from_path')
+@patch('ocr.pdf2image.pdfinfo_from_path', return_value={"Pages": 10})
+@patch('ocr._get_ocr_data')
+def test_pdf_page_ranges_render_only_selected_pages(mock_get_ocr_data, mock_pdfinfo,
+                                                    mock_convert_from_path):
+    mock_convert_from_path.side_effect = lambda pdf_file, first_page, last_page, **kwargs: [
+        Image.new("RGB", (page_num, 10)) for page_num in range(first_page, last_page + 1)
+    ]
+    mock_get_ocr_data.side_effect = lambda image, *args: {
+        "text": f"page {image.width}", "ocr_data": [], "image_width": image.width,
+        "image_height": 10
+    }
+    region = ocr._region_options({"pages": "2-3,9-"})
+    render_options = ocr._pdf_render_options({})
+    results = pdf_to_text("document.pdf", "en", (), render_options, False, "records", region)
+
+    assert [page["page_num"] for page in results] == [2, 3, 9, 10]
+    rendered = [
+        (call.kwargs["first_page"], call.kwargs["last_page"])
+        for call in mock_convert_from_path.call_args_list
+    ]
+    assert rendered == [(2, 3), (9, 10)]
+
+
+@patch('ocr._get_ocr_data')
+@patch('ocr.pdf_page_count', return_value=3)
+@patch('ocr.subprocess.run')
+def test_pdf_crop_renders_only_the_region(mock_run, mock_page_count, mock_get_ocr_data):
+    pdfinfo = (
+        "Page    1 size: 612 x 792 pts (letter)\nPage    1 rot:  0\n"
+        "Page    2 size: 612 x 792 pts (letter)\nPage    2 rot:  90\n"
+    )
+
+    def fake_run(command, **kwargs):
+        if command[0] == "pdfinfo":
+            return MagicMock(stdout=pdfinfo)
+        if command[0] == "pdftotext":
+            return MagicMock(stdout=MOCKED_PDFTOTEXT_BBOX)
+        if command[0] == "pdfimages":
+            return MagicMock(stdout="")
+        region = io.BytesIO()
+        size = (int(command[command.index("-W") + 1]), int(command[command.index("-H") + 1]))
+        Image.new("L", size).save(region, "PPM")
+        return MagicMock(stdout=region.getvalue())
+
+    mock_run.side_effect = fake_run
+    mock_get_ocr_data.side_effect = lambda image, *args: {
+        "text": "region\n",
+        "ocr_data": [{"left": 5, "top": 6, "width": 10, "height": 10, "text": "region"}],
+        "image_width": image.width, "image_height": image.height
+    }
+    render_options = ocr._pdf_render_options({"dpi": 72})
+    region = ocr._region_options({"pages": "1-2", "crop": [0, 0.105, 1, 0.05]})
+
+    # Without the text layer both pages are OCR'd, each rendering only its strip
+    results = pdf_to_text("document.pdf", "en", (), render_options, False, "records", region)
+    renders = [call.args[0] for call in mock_run.call_args_list if call.args[0][0] == "pdftoppm"]
+    assert [command[command.index("-x"):command.index("-x") + 8] for command in renders] == [
+        ["-x", "0", "-y", "83", "-W", "612", "-H", "40"],
+        ["-x", "0", "-y", "64", "-W", "792", "-H", "31"],  # page 2 is rotated to landscape
+    ]
+    first, second = results
+    assert first["crop"] == [0, 83, 612, 40] and second["crop"] == [0, 64, 792, 31]
+    assert (second["image_width"], second["image_height"]) == (792, 612)
+    assert (first["ocr_data"][0]["left"], first["ocr_data"][0]["top"]) == (5, 89)
+
+    # With it, page 1 keeps the text-layer words inside the strip and only page 2 is rendered
+    mock_run.reset_mock()
+    results = pdf_to_text("document.pdf", "en", (), render_options, True, "records", region)
+    pdftotext = next(
+        call.args[0] for call in mock_run.call_args_list if call.args[0][0] == "pdftotext"
+    )
+    assert pdftotext[pdftotext.index("-f"):pdftotext.index("-f") + 4] == ["-f", "1", "-l", "2"]
+    assert [call.args[0][0] for call in mock_run.call_args_list].count("pdftoppm") == 1
+    assert results[0]["text_source"] == "pdf_text_layer"
+    assert results[0]["text"] == "PDF&text\n\n"
+    assert [word["text"] for word in results[0]["ocr_data"]] == ["PDF&text"]
+    assert results[0]["crop"] == [0, 83, 612, 40]
+    assert results[1]["text"] == "region\n"
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr._get_ocr_data')
+def test_image_crop_through_ocr_task(mock_get_ocr_data, mock_version, client):
+    seen = []
+
+    def fake_get_ocr_data(image, language, output_formats=(), ocr_data_format="records"):
+        seen.append(image.size)
+        return {"text": "Hi\n",
+                "ocr_data": [{"left": 1, "top": 2, "width": 3, "height": 4, "text": "Hi"}],
+                "image_width": image.width, "image_height": image.height}
+
+    mock_get_ocr_data.side_effect = fake_get_ocr_data
+    image_file = io.BytesIO()
+    Image.new("RGB", (200, 100), "white").save(image_file, "PNG")
+    encoded = base64.b64encode(image_file.getvalue()).decode()
+
+    result = _process_single_ocr_task(
+        {"base64": encoded, "filename": "form.png", "crop": "0.5,0.5,0.25,0.5"}
+    )
+    assert result["error"] is None
+    assert seen == [(50, 50)]
+    page = result["ocr_data"][0]
+    assert page["crop"] == [100, 50, 50, 50]
+    assert (page["image_width"], page["image_height"]) == (200, 100)
+    assert (page["ocr_data"][0]["left"], page["ocr_data"][0]["top"]) == (101, 52)
+
+    result = _process_single_ocr_task({"base64": encoded, "filename": "form.png", "pages": "2-"})
+    assert "No pages selected" in result["error"]
+
+
+@patch('ocr.get_tesseract_version_string', return_value=MOCKED_TESSERACT_VERSION)
+@patch('ocr.pdf_to_text')
+@patch('ocr._get_ocr_data')
+def test_bench_pipeline_smoke(mock_get_ocr_data, mock_pdf_to_text, mock_version, tmp_path):
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        "bench_pipeline",
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks", "bench_pipeline.py"))
+    bench_pipeline = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench_pipeline)
+
+    page = {"text": "quick\n",
+            "ocr_data": [{"left": 1, "top": 2, "width": 3, "height": 4, "text": "quick"}],
+            "image_width": 10, "image_height": 10}
+    mock_get_ocr_data.side_effect = lambda image, *args, **kwargs: dict(page)
+    mock_pdf_to_text.side_effect = lambda *args, **kwargs: [dict(page)]
+    output = tmp_path / "bench.json"
+    argv = ["bench_pipeline.py", "--no-fixtures", "--synthetic", "1", "--workers", "1",
+            "--repeat", "1", "--json", str(output)]
+    # The PDF input is stored as an artifact, in a folder of the run rather than the upload folder
+    before = set(os.listdir(app.config["UPLOAD_FOLDER"]))
+    with patch('sys.argv', argv):
+        bench_pipeline.main()
+    assert set(os.listdir(app.config["UPLOAD_FOLDER"])) == before
+
+    results = json.loads(output.read_text())
+    assert results["meta"]["inputs"] == ["synthetic_1.png", "synthetic.pdf"]
+    (run,) = results["runs"]
+    assert (run["workers"], run["files"], run["pages"], run["errors"]) == (1, 2, 2, 0)
+    assert set(run["latency_ms"]) == {"mean", "p50", "p95", "p99"}
+
+    fixtures, skipped = bench_pipeline.fixture_paths()
+    names = {os.path.basename(path) for path in fixtures}
+    assert {"sample.pdf", "82092117.png"} <= names
+    skipped_names = {os.path.basename(path) for path in skipped}
+    assert skipped_names == {"test_document.pdf", "test_image.png", "image.png"}